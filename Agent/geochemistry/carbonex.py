@@ -0,0 +1,167 @@
+"""
+Carbonex: fast CO2 solubility in pure NumPy.
+
+Solubility
+    Duan and Sun (2006) for Na/K/Ca/Mg/Cl/SO4 brines
+    (duan_sun.DuanSun2006.calculate_CO2_solubility_array), times an
+    optional calibration factor towards PHREEQC with pitzer.dat.  The factor
+    is tabulated offline as phreeqc_pitzer / Duan-Sun on a (temperature,
+    pressure, NaCl molality) grid by App/backend/carbonex.py and looked up
+    at the ionic strength of the brine, clipped to the grid.
+
+    No calibration file ships.  Until one is built the factor is 1,
+    carbonex is plain Duan and Sun, and its error against phreeqc_pitzer
+    has not been measured.
+
+This is the solubility of App/backend/carbonex.py, which also speciates
+the brine, builds the calibration file and measures its error against
+phreeqc_pitzer; calibration_info() reports that error for the calibration
+in use.
+
+Configuration (environment variables):
+    CARBONEX_CALIBRATION   calibration file built by App/backend/carbonex.py
+                           (default carbonex.npz next to this file)
+"""
+
+import os
+import threading
+
+import numpy as np
+from scipy.interpolate import RegularGridInterpolator
+
+from .duan_sun import KERNEL_IONS, shared_model
+
+CARBONEX_CALIBRATION = os.environ.get(
+    "CARBONEX_CALIBRATION",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "carbonex.npz"),
+)
+
+# Charges of the brine ions; HCO3- and CO3-2 only count as alkalinity
+CHARGES = {
+    "Na+": 1,
+    "K+": 1,
+    "Ca+2": 2,
+    "Mg+2": 2,
+    "Cl-": -1,
+    "SO4-2": -2,
+    "HCO3-": -1,
+    "CO3-2": -2,
+}
+
+
+def _molality(molalities, ion):
+    value = molalities.get(ion)
+    return np.asarray(0.0 if value is None else value, dtype=np.float64)
+
+
+def ionic_strength(molalities):
+    """Ionic strength (mol/kg) of a brine; molalities may be arrays."""
+    return 0.5 * sum(
+        charge**2 * _molality(molalities, ion) for ion, charge in CHARGES.items()
+    )
+
+
+class Calibration:
+    """Factor phreeqc_pitzer / Duan-Sun on a (temperature, pressure, NaCl) grid."""
+
+    def __init__(self, temperature, pressure, nacl, factor, metadata=None):
+        self.temperature = np.asarray(temperature, dtype=np.float64)
+        self.pressure = np.asarray(pressure, dtype=np.float64)
+        self.nacl = np.asarray(nacl, dtype=np.float64)
+        self.factor = np.asarray(factor, dtype=np.float64)
+        self.metadata = metadata or {}
+        self._interpolator = RegularGridInterpolator(
+            (self.temperature, self.pressure, self.nacl),
+            # Cells PHREEQC could not solve keep the Duan-Sun value
+            np.where(np.isfinite(self.factor), self.factor, 1.0),
+            method="linear",
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            metadata = {
+                key: data[key].item()
+                for key in data.files
+                if key not in ("temperature", "pressure", "nacl", "factor")
+            }
+            return cls(
+                data["temperature"],
+                data["pressure"],
+                data["nacl"],
+                data["factor"],
+                metadata,
+            )
+
+    def __call__(self, temperature, pressure, nacl):
+        """Interpolate the factor; arguments broadcast and are clipped to the grid."""
+        temperature, pressure, nacl = np.broadcast_arrays(
+            np.clip(temperature, self.temperature[0], self.temperature[-1]),
+            np.clip(pressure, self.pressure[0], self.pressure[-1]),
+            np.clip(nacl, self.nacl[0], self.nacl[-1]),
+        )
+        points = np.stack([temperature, pressure, nacl], axis=-1).reshape(-1, 3)
+        return self._interpolator(points).reshape(temperature.shape)
+
+
+_calibration = None
+_calibration_lock = threading.Lock()
+
+
+def get_calibration():
+    """Return the loaded calibration, or None when it was not built."""
+    global _calibration
+    try:
+        mtime = os.stat(CARBONEX_CALIBRATION).st_mtime_ns
+    except OSError:
+        return None
+
+    with _calibration_lock:
+        if _calibration is None or _calibration[0] != mtime:
+            _calibration = (mtime, Calibration.load(CARBONEX_CALIBRATION))
+        return _calibration[1]
+
+
+def calibration_info():
+    """Describe the calibration in use and its build-time error."""
+    calibration = get_calibration()
+    if calibration is None:
+        return {"calibrated": False}
+    info = {
+        "calibrated": True,
+        "temperature_range": [calibration.temperature[0], calibration.temperature[-1]],
+        "pressure_range": [calibration.pressure[0], calibration.pressure[-1]],
+        "nacl_range": [calibration.nacl[0], calibration.nacl[-1]],
+        "shape": list(calibration.factor.shape),
+        "failed_points": int(np.isnan(calibration.factor).sum()),
+        **calibration.metadata,
+    }
+    for key in ("temperature_range", "pressure_range", "nacl_range"):
+        info[key] = [float(value) for value in info[key]]
+    return info
+
+
+def solubility(P, T, molalities=None):
+    """
+    Calculate CO2 solubility (mol/kg water) with the carbonex model.
+
+    Parameters:
+        P: Pressure(s) in MPa
+        T: Temperature(s) in Kelvin
+        molalities: Dictionary of ion molalities (keys like 'Na+', 'Cl-');
+            each value may be a scalar or an array
+
+    P, T and the molalities broadcast together, as in
+    duan_sun.DuanSun2006.calculate_CO2_solubility_array.
+
+    Returns:
+        ndarray: CO2 solubility, NaN outside the Duan-Sun EOS ranges
+    """
+    molalities = {
+        ion: value for ion, value in (molalities or {}).items() if ion in KERNEL_IONS
+    }
+    base = shared_model.calculate_CO2_solubility_array(P, T, molalities, model="DuanSun")
+    calibration = get_calibration()
+    if calibration is None:
+        return base
+    return base * calibration(T, P, ionic_strength(molalities))
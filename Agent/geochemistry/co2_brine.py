@@ -1,15 +1,16 @@
 import os
 import math
-import pandas as pd
-import subprocess
-import csv
-from . import duan_sun
+from . import carbonex, duan_sun
 import sys
-import tempfile
 
+import numpy as np
 
+from .phreeqc_engine import run_phreeqc
+from .result_cache import cached_simulation
+
+
+@cached_simulation(templates=("co2_brine_template.pqi",), databases=("pitzer",))
 def simulate_co2_brine_solution_properties(temperature, pressure, species):
-    temp_files_path = tempfile.gettempdir()
     Na = species.get("Na+", 0)
     Cl = species.get("Cl-", 0)
     Mg = species.get("Mg+2", 0)
@@ -24,15 +25,10 @@ def simulate_co2_brine_solution_properties(temperature, pressure, species):
     p_co2 = pressure_atm * 0.95
     p_h2o = pressure_atm * 0.05
 
-    state_out_file = os.path.join(temp_files_path, "solution_properties.tsv")
-
     template_path = os.path.join(os.path.dirname(__file__), "phreeqc_templates", "co2_brine_template.pqi")
     with open(template_path, "r") as template_file:
         phreeqc_code = template_file.read()
 
-    phreeqc_code = phreeqc_code.replace(
-        "__DATABASE__", "/usr/local/share/doc/phreeqc/database/pitzer.dat"
-    )
     phreeqc_code = phreeqc_code.replace("__TEMPERATURE__", str(temperature_c))
     phreeqc_code = phreeqc_code.replace("__NA__", str(Na))
     phreeqc_code = phreeqc_code.replace("__CL__", str(Cl))
@@ -44,40 +40,11 @@ def simulate_co2_brine_solution_properties(temperature, pressure, species):
     phreeqc_code = phreeqc_code.replace("__PRESSURE_ATM__", str(pressure_atm))
     phreeqc_code = phreeqc_code.replace("__P_CO2__", str(p_co2))
     phreeqc_code = phreeqc_code.replace("__P_H2O__", str(p_h2o))
-    phreeqc_code = phreeqc_code.replace("__OUTPUT_FILE__", state_out_file)
-
-    filename = os.path.join(temp_files_path, "solution_properties.pqi")
-
-    pqi = open(filename, "w")
-    pqi.write(phreeqc_code)
-    pqi.close()
-
-    subprocess.run(
-        ["phreeqc", filename, filename.replace(".pqi", ".pqo")],
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.STDOUT,
-    )
-
-    # Make sure the file exists before trying to read it
-    if not os.path.exists(state_out_file):
-        raise FileNotFoundError(f"Output file not found: {state_out_file}")
 
-    results = {}
-    try:
-        with open(state_out_file, mode="r") as file:
-            reader = csv.DictReader(file, delimiter="\t")
-            # Clean column names by stripping spaces
-            if reader.fieldnames:
-                fieldnames = [field.strip() for field in reader.fieldnames]
-                reader = csv.DictReader(file, fieldnames=fieldnames, delimiter="\t")
-                next(reader)  # Skip header row since we're providing our own fieldnames
-
-                # Get the last row (final simulation state)
-                for row in reader:
-                    results = row  # Will keep the last row
-    except Exception as e:
-        print(f"Error reading {state_out_file}: {str(e)}", flush=True)
-        raise
+    # Final simulation state
+    results = run_phreeqc(
+        phreeqc_code, "pitzer", name="solution_properties", last_only=True
+    ).last()
 
     species_data = []
 
@@ -136,7 +103,6 @@ def simulate_co2_brine_solution_properties(temperature, pressure, species):
 
 
 def _simulate_varying_pressure_PHREEQC(temperature, ion_moles, database):
-    temp_files_path = tempfile.gettempdir()
     temperature_c = temperature - 273.15
 
     template_path = os.path.join(
@@ -145,10 +111,6 @@ def _simulate_varying_pressure_PHREEQC(temperature, ion_moles, database):
     with open(template_path, "r") as template_file:
         phreeqc_code = template_file.read()
 
-    database_path = f"/usr/local/share/doc/phreeqc/database/{database}.dat"
-    output_file = os.path.join(temp_files_path, "varying_pressure.tsv")
-
-    phreeqc_code = phreeqc_code.replace("__DATABASE__", database_path)
     phreeqc_code = phreeqc_code.replace("__TEMPERATURE__", str(temperature_c))
     phreeqc_code = phreeqc_code.replace("__NA__", str(ion_moles.get("Na+", 0)))
     phreeqc_code = phreeqc_code.replace("__CL__", str(ion_moles.get("Cl-", 0)))
@@ -156,55 +118,37 @@ def _simulate_varying_pressure_PHREEQC(temperature, ion_moles, database):
     phreeqc_code = phreeqc_code.replace("__MG__", str(ion_moles.get("Mg+2", 0)))
     phreeqc_code = phreeqc_code.replace("__K__", str(ion_moles.get("K+", 0)))
     phreeqc_code = phreeqc_code.replace("__SO4__", str(ion_moles.get("SO4-2", 0)))
-    phreeqc_code = phreeqc_code.replace("__OUTPUT_FILE__", output_file)
-
-    filename = "varying_pressure.pqi"
 
-    pqi = open(os.path.join(temp_files_path, filename), "w")
-    pqi.write(phreeqc_code)
-
-    pqi.close()
-
-    subprocess.run(
-        [
-            "phreeqc",
-            f"{os.path.join(temp_files_path, filename)}",
-            f"{os.path.join(temp_files_path, filename).replace('.pqi', '.pqo')}",
-        ],
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.STDOUT,
-    )
+    output = run_phreeqc(phreeqc_code, database, name="varying_pressure")
 
     result = {"Pressure (MPa)": [], "Dissolved CO2 (mol/kg)": []}
 
-    with open(os.path.join(temp_files_path, "varying_pressure.tsv"), mode="r") as file:
-        reader = csv.DictReader(file, delimiter="\t")
-        # Clean column names by stripping spaces
-        if reader.fieldnames:
-            fieldnames = [field.strip() for field in reader.fieldnames]
-            reader = csv.DictReader(file, fieldnames=fieldnames, delimiter="\t")
-            next(reader)  # Skip header row since we're providing our own fieldnames
-
-        for row in reader:
-            # Convert pressure from atm to MPa
-            pressure = float(row.get("pressure", 0)) * 0.101325
-            pressure = round(pressure, 2)
-            trapped_co2 = float(row.get("C(4)", 2))
-
-            result["Pressure (MPa)"].append(pressure)
-            result["Dissolved CO2 (mol/kg)"].append(trapped_co2)
-
-    if os.path.exists("error.inp"):
-        os.remove("error.inp")
+    for row in output.records():
+        # Convert pressure from atm to MPa
+        pressure = float(row.get("pressure", 0)) * 0.101325
+        pressure = round(pressure, 2)
+        trapped_co2 = float(row.get("C(4)", 2))
 
-    if os.path.exists("phreeqc.log"):
-        os.remove("phreeqc.log")
+        result["Pressure (MPa)"].append(pressure)
+        result["Dissolved CO2 (mol/kg)"].append(trapped_co2)
 
     return result
 
 
 def _simulate_varying_pressure_Carbonex(temperature, ion_moles):
-    return {"Pressure (MPa)": [], "Dissolved CO2 (mol/kg)": []}
+    """
+    Use the carbonex model to calculate CO2 solubility over a pressure range,
+    on the same pressure points as the Duan and Sun sweep.
+    Returns dict with lists for 'Pressure (MPa)' and 'Dissolved CO2 (mol/kg)'.
+    """
+    pressures = np.arange(0.1, 50.0 + 1, 1)
+    trapped_co2 = carbonex.solubility(pressures, temperature, ion_moles)
+    return {
+        "Pressure (MPa)": pressures.tolist(),
+        "Dissolved CO2 (mol/kg)": [
+            None if np.isnan(value) else value for value in trapped_co2.tolist()
+        ],
+    }
 
 
 def _simulate_varying_pressure_DuanSun(temperature, ion_moles):
@@ -213,7 +157,7 @@ def _simulate_varying_pressure_DuanSun(temperature, ion_moles):
     Returns dict with lists for 'Pressure (MPa)' and 'Dissolved CO2 (mol/kg)'.
     """
 
-    model = duan_sun.DuanSun2006()
+    model = duan_sun.shared_model
     P_start = 0.1
     P_end = 50.0
     P_step = 1
@@ -258,9 +202,18 @@ def _simulate_varying_temperature_PHREEQC(pressure, ion_moles, database):
 
 def _simulate_varying_temperature_Carbonex(pressure, ion_moles):
     """
-    Placeholder for Carbonex model varying temperature calculation.
+    Use the carbonex model to calculate CO2 solubility over a temperature
+    range, on the same temperature points as the Duan and Sun sweep.
+    Returns dict with lists for 'Temperature (K)' and 'Dissolved CO2 (mol/kg)'.
     """
-    return {"Temperature (K)": [], "Dissolved CO2 (mol/kg)": []}
+    temperatures = np.arange(273.15, 573.15 + 5.0, 5.0)
+    trapped_co2 = carbonex.solubility(pressure, temperatures, ion_moles)
+    return {
+        "Temperature (K)": temperatures.tolist(),
+        "Dissolved CO2 (mol/kg)": [
+            None if np.isnan(value) else value for value in trapped_co2.tolist()
+        ],
+    }
 
 
 def _simulate_varying_temperature_DuanSun(pressure, ion_moles):
@@ -269,7 +222,7 @@ def _simulate_varying_temperature_DuanSun(pressure, ion_moles):
     Returns dict with lists for 'Temperature (K)' and 'Dissolved CO2 (mol/kg)'.
     """
 
-    model = duan_sun.DuanSun2006()
+    model = duan_sun.shared_model
 
     T_start = 273.15  # 0°C
     T_end = 573.15  # 100°C
@@ -282,6 +235,7 @@ def _simulate_varying_temperature_DuanSun(pressure, ion_moles):
     return result
 
 
+@cached_simulation(templates=("co2_brine_var_pressure_template.pqi",))
 def simulate_co2_brine_var_p(temperature, ion_moles, model):
     if model == "phreeqc_phreeqc":
         result = _simulate_varying_pressure_PHREEQC(
@@ -300,13 +254,14 @@ def simulate_co2_brine_var_p(temperature, ion_moles, model):
         result = _simulate_varying_pressure_DuanSun(temperature, ion_moles)
 
     elif model == "carbonex":
-        results = _simulate_varying_pressure_Carbonex(temperature, ion_moles)
+        result = _simulate_varying_pressure_Carbonex(temperature, ion_moles)
     else:
         result = {"Pressure (MPa)": [], "Dissolved CO2 (mol/kg)": []}
 
     return result
 
 
+@cached_simulation(templates=("co2_brine_template.pqi",))
 def simulate_co2_brine_var_t(pressure, ion_moles, model):
     """
     Simulate CO2 solubility over a range of temperatures at fixed pressure.
@@ -343,7 +298,6 @@ def simulate_co2_brine_var_t(pressure, ion_moles, model):
 
 
 def _run_PHREEQC_state_simulation(temperature, pressure, species, database):
-    temp_files_path = tempfile.gettempdir()
     Na = species.get("Na+", 0)
     Cl = species.get("Cl-", 0)
     Mg = species.get("Mg+2", 0)
@@ -358,18 +312,12 @@ def _run_PHREEQC_state_simulation(temperature, pressure, species, database):
     p_co2 = pressure_atm * 0.95
     p_h2o = pressure_atm * 0.05
 
-    # Define the output file path consistently
-    state_out_file = os.path.join(temp_files_path, "state_out.tsv")
-
     # Load the PHREEQC template
     template_path = os.path.join(os.path.dirname(__file__), "phreeqc_templates", "co2_brine_template.pqi")
     with open(template_path, "r") as template_file:
         phreeqc_code = template_file.read()
 
     # Replace template placeholders with actual values
-    phreeqc_code = phreeqc_code.replace(
-        "__DATABASE__", f"/usr/local/share/doc/phreeqc/database/{database}.dat"
-    )
     phreeqc_code = phreeqc_code.replace("__TEMPERATURE__", str(temperature_c))
     phreeqc_code = phreeqc_code.replace("__NA__", str(Na))
     phreeqc_code = phreeqc_code.replace("__CL__", str(Cl))
@@ -381,46 +329,11 @@ def _run_PHREEQC_state_simulation(temperature, pressure, species, database):
     phreeqc_code = phreeqc_code.replace("__PRESSURE_ATM__", str(pressure_atm))
     phreeqc_code = phreeqc_code.replace("__P_CO2__", str(p_co2))
     phreeqc_code = phreeqc_code.replace("__P_H2O__", str(p_h2o))
-    phreeqc_code = phreeqc_code.replace("__OUTPUT_FILE__", state_out_file)
-
-    filename = os.path.join(temp_files_path, "state_out.pqi")
 
-    pqi = open(filename, "w")
-    pqi.write(phreeqc_code)
-    pqi.close()
-
-    # Run phreeqc with full paths
-    subprocess.run(
-        ["phreeqc", filename, filename.replace(".pqi", ".pqo")],
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.STDOUT,
-    )
-
-    # Make sure the file exists before trying to read it
-    if not os.path.exists(state_out_file):
-        raise FileNotFoundError(f"Output file not found: {state_out_file}")
-
-    # Initialize results with a default empty dictionary
-    results = {}
-
-    # Read the output file to get the CO2 concentration
-    try:
-        with open(state_out_file, mode="r") as file:
-            reader = csv.DictReader(file, delimiter="\t")
-            # Clean column names by stripping spaces
-            if reader.fieldnames:
-                fieldnames = [field.strip() for field in reader.fieldnames]
-                reader = csv.DictReader(file, fieldnames=fieldnames, delimiter="\t")
-                next(reader)  # Skip header row
-
-                # Get the last row (final simulation state)
-                for row in reader:
-                    results = row  # Will keep the last row
-                    # print(results)
-
-    except Exception as e:
-        print(f"Error reading {state_out_file}: {str(e)}", flush=True)
-        raise
+    # Get the last row (final simulation state)
+    results = run_phreeqc(
+        phreeqc_code, database, name="state_out", last_only=True
+    ).last()
 
     # Extract the C(4) value (dissolved CO2)
     try:
@@ -433,7 +346,7 @@ def _run_PHREEQC_state_simulation(temperature, pressure, species, database):
 
 def _run_Duan_Sun_state_simulation(temperature, pressure, species):
     # Use Duan and Sun (2006) model to calculate dissolved CO2
-    model = duan_sun.DuanSun2006()
+    model = duan_sun.shared_model
     try:
         # calculate_CO2_solubility expects P in MPa, T in Kelvin, ion molalities dict
         trapped_co2 = model.calculate_CO2_solubility(
@@ -444,6 +357,13 @@ def _run_Duan_Sun_state_simulation(temperature, pressure, species):
     return trapped_co2
 
 
+def _run_Carbonex_state_simulation(temperature, pressure, species):
+    trapped_co2 = float(carbonex.solubility(pressure, temperature, species))
+    # Outside the EOS ranges, as the Duan and Sun state simulation
+    return trapped_co2 if np.isfinite(trapped_co2) else 0
+
+
+@cached_simulation(templates=("co2_brine_template.pqi",))
 def simulate_co2_brine_fixed(temperature, pressure, species, model):
     """
     Run simulation for fixed conditions and return only dissolved CO2.
@@ -465,7 +385,7 @@ def simulate_co2_brine_fixed(temperature, pressure, species, model):
     elif model == "duan_sun_2006":
         trapped_co2 = _run_Duan_Sun_state_simulation(temperature, pressure, species)
     elif model == "carbonex":
-        trapped_co2 = 3
+        trapped_co2 = _run_Carbonex_state_simulation(temperature, pressure, species)
     else:
         # Default to phreeqc if model is not recognized
         trapped_co2 = _run_PHREEQC_state_simulation(
@@ -1,14 +1,14 @@
 import os
 import math
-import uuid
-import pandas as pd
-import subprocess
-import csv
 import sys
-import tempfile
 
+from .phreeqc_engine import run_phreeqc
+from .result_cache import cached_simulation
 from rock_physics.carbonate_model import wt_fractions_to_moles, moles_to_porosity, moles_to_wt_fractions
 
+@cached_simulation(
+    templates=("co2_brine_rock_template.pqi",), databases=("phreeqc",)
+)
 def simulate_co2_brine_rock_solution_properties(temperature, pressure, species, minerals):
     """
     Run PHREEQC simulation for brine-rock interaction solution properties only.
@@ -23,7 +23,6 @@ def simulate_co2_brine_rock_solution_properties(temperature, pressure, species,
     Returns:
         tuple: (species_data, density, ionic_strength, pH, osmotic_coefficient, partial_pressure_co2, fugacity_co2)
     """
-    temp_files_path = tempfile.gettempdir()
     Na = species.get("Na+", 0)
     Cl = species.get("Cl-", 0)
     Mg = species.get("Mg+2", 0)
@@ -38,8 +37,6 @@ def simulate_co2_brine_rock_solution_properties(temperature, pressure, species,
     p_co2 = pressure_atm * 0.95
     p_h2o = pressure_atm * 0.05
 
-    state_out_file = os.path.join(temp_files_path, "co2_brine_rock_solution_properties.tsv")
-
     template_path = os.path.join(os.path.dirname(__file__), "phreeqc_templates", "co2_brine_rock_template.pqi")
     with open(template_path, "r") as template_file:
         phreeqc_code = template_file.read()
@@ -72,9 +69,6 @@ def simulate_co2_brine_rock_solution_properties(temperature, pressure, species,
 
     mineral_phases_str = "\n".join(mineral_phases)
 
-    phreeqc_code = phreeqc_code.replace(
-        "__DATABASE__", "/usr/local/share/doc/phreeqc/database/phreeqc.dat"
-    )
     phreeqc_code = phreeqc_code.replace("__TEMPERATURE__", str(temperature_c))
     phreeqc_code = phreeqc_code.replace("__NA__", str(Na))
     phreeqc_code = phreeqc_code.replace("__CL__", str(Cl))
@@ -87,39 +81,14 @@ def simulate_co2_brine_rock_solution_properties(temperature, pressure, species,
     phreeqc_code = phreeqc_code.replace("__P_CO2__", str(p_co2))
     phreeqc_code = phreeqc_code.replace("__P_H2O__", str(p_h2o))
     phreeqc_code = phreeqc_code.replace("__MINERAL_PHASES__", mineral_phases_str)
-    phreeqc_code = phreeqc_code.replace("co2_brine_rock.tsv", state_out_file)
-
-    filename = os.path.join(temp_files_path, "co2_brine_rock_solution_properties.pqi")
-
-    with open(filename, "w") as pqi:
-        pqi.write(phreeqc_code)
-
-    subprocess.run(
-        ["phreeqc", filename, filename.replace(".pqi", ".pqo")],
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.STDOUT,
-    )
-
-    # Make sure the file exists before trying to read it
-    if not os.path.exists(state_out_file):
-        raise FileNotFoundError(f"Output file not found: {state_out_file}")
 
-    results = {}
-    try:
-        with open(state_out_file, mode="r") as file:
-            reader = csv.DictReader(file, delimiter="\t")
-            # Clean column names by stripping spaces
-            if reader.fieldnames:
-                fieldnames = [field.strip() for field in reader.fieldnames]
-                reader = csv.DictReader(file, fieldnames=fieldnames, delimiter="\t")
-                next(reader)  # Skip header row since we're providing our own fieldnames
-
-                # Get the last row (final simulation state)
-                for row in reader:
-                    results = row  # Will keep the last row
-    except Exception as e:
-        print(f"Error reading {state_out_file}: {str(e)}", flush=True)
-        raise
+    # Final simulation state
+    results = run_phreeqc(
+        phreeqc_code,
+        "phreeqc",
+        name="co2_brine_rock_solution_properties",
+        last_only=True,
+    ).last()
 
     species_data = []
 
@@ -192,7 +161,6 @@ def _run_PHREEQC_brine_rock_varying_pressure(
     Returns:
         dict: Results with 'Pressure (MPa)' and 'Dissolved CO2 (mol/kg)' lists
     """
-    temp_files_path = tempfile.gettempdir()
     temperature_c = temperature - 273.15
 
     # Load the PHREEQC template
@@ -231,10 +199,6 @@ def _run_PHREEQC_brine_rock_varying_pressure(
     mineral_phases_str = "\n".join(mineral_phases)
 
     # Replace template placeholders with actual values
-    database_path = f"/usr/local/share/doc/phreeqc/database/{database}.dat"
-    output_file = os.path.join(temp_files_path, "co2_brine_rock_var_p.tsv")
-
-    phreeqc_code = phreeqc_code.replace("__DATABASE__", database_path)
     phreeqc_code = phreeqc_code.replace("__TEMPERATURE__", str(temperature_c))
     phreeqc_code = phreeqc_code.replace("__NA__", str(ion_moles.get("Na+", 0)))
     phreeqc_code = phreeqc_code.replace("__CL__", str(ion_moles.get("Cl-", 0)))
@@ -244,72 +208,44 @@ def _run_PHREEQC_brine_rock_varying_pressure(
     phreeqc_code = phreeqc_code.replace("__SO4__", str(ion_moles.get("SO4-2", 0)))
     phreeqc_code = phreeqc_code.replace("__HCO3__", str(ion_moles.get("HCO3-", 0)))
     phreeqc_code = phreeqc_code.replace("__MINERAL_PHASES__", mineral_phases_str)
-    phreeqc_code = phreeqc_code.replace("__OUTPUT_FILE__", output_file)
-
-    filename = "co2_brine_rock_var_pressure.pqi"
-    pqi = open(os.path.join(temp_files_path, filename), "w")
-    pqi.write(phreeqc_code)
-    pqi.close()
-
-    subprocess.run(
-        [
-            "phreeqc",
-            f"{os.path.join(temp_files_path, filename)}",
-            f"{os.path.join(temp_files_path, filename).replace('.pqi', '.pqo')}",
-        ],
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.STDOUT,
-    )
+
+    output = run_phreeqc(phreeqc_code, database, name="co2_brine_rock_var_pressure")
 
     result = {"Pressure (MPa)": [], "Dissolved CO2 (mol/kg)": []}
 
-    with open(output_file, mode="r") as file:
-        reader = csv.DictReader(file, delimiter="\t")
-        # Clean column names by stripping spaces
-        if reader.fieldnames:
-            fieldnames = [field.strip() for field in reader.fieldnames]
-            reader = csv.DictReader(file, fieldnames=fieldnames, delimiter="\t")
-            next(reader)  # Skip header row since we're providing our own fieldnames
-
-        for row in reader:
-            # Get pressure from gas phase data - need to check what column name is used
-            # in the brine-rock template output
-            try:
-                # Try different possible pressure column names
-                pressure = None
-                if "pressure" in row:
-                    pressure = float(row["pressure"])
-                elif "CO2(g)" in row:
-                    # If CO2(g) pressure is available
-                    pressure = float(row["CO2(g)"])
-                elif "PR_CO2" in row:
-                    # Partial pressure from USER_PUNCH
-                    pressure = float(row["PR_CO2"])
-
-                if pressure is not None:
-                    # Convert pressure from atm to MPa if needed
-                    pressure_mpa = pressure * 0.101325 if pressure > 1.0 else pressure
-                    pressure_mpa = round(pressure_mpa, 2)
-
-                    trapped_co2 = float(row.get("C(4)", 0))
-
-                    result["Pressure (MPa)"].append(pressure_mpa)
-                    result["Dissolved CO2 (mol/kg)"].append(trapped_co2)
-
-            except (ValueError, KeyError) as e:
-                # Skip rows with invalid data
-                continue
-
-    # Clean up temporary files
-    if os.path.exists("error.inp"):
-        os.remove("error.inp")
-
-    if os.path.exists("phreeqc.log"):
-        os.remove("phreeqc.log")
+    for row in output.records():
+        # Get pressure from gas phase data - need to check what column name is used
+        # in the brine-rock template output
+        try:
+            # Try different possible pressure column names
+            pressure = None
+            if "pressure" in row:
+                pressure = float(row["pressure"])
+            elif "CO2(g)" in row:
+                # If CO2(g) pressure is available
+                pressure = float(row["CO2(g)"])
+            elif "PR_CO2" in row:
+                # Partial pressure from USER_PUNCH
+                pressure = float(row["PR_CO2"])
+
+            if pressure is not None:
+                # Convert pressure from atm to MPa if needed
+                pressure_mpa = pressure * 0.101325 if pressure > 1.0 else pressure
+                pressure_mpa = round(pressure_mpa, 2)
+
+                trapped_co2 = float(row.get("C(4)", 0))
+
+                result["Pressure (MPa)"].append(pressure_mpa)
+                result["Dissolved CO2 (mol/kg)"].append(trapped_co2)
+
+        except (ValueError, TypeError, KeyError) as e:
+            # Skip rows with invalid data
+            continue
 
     return result
 
 
+@cached_simulation(templates=("co2_brine_rock_template.pqi",))
 def simulate_co2_brine_rock_fixed(
     temperature, pressure, species, mineralogy, model
 ):
@@ -326,7 +262,6 @@ def simulate_co2_brine_rock_fixed(
     Returns:
         dict: Results including dissolved CO2, mineral deltas, and solution properties
     """
-    temp_files_path = tempfile.gettempdir()
     Na = species.get("Na+", 0)
     Cl = species.get("Cl-", 0)
     Mg = species.get("Mg+2", 0)
@@ -378,11 +313,7 @@ def simulate_co2_brine_rock_fixed(
 
     # Replace template placeholders with actual values
     database_name = model if model in ["phreeqc", "pitzer"] else "phreeqc"
-    phreeqc_code = phreeqc_code.replace(
-        "__DATABASE__", f"/usr/local/share/doc/phreeqc/database/{database_name}.dat"
-    )
 
-    brine_rock_out_file = os.path.join(temp_files_path, "co2_brine_rock.tsv")
     phreeqc_code = phreeqc_code.replace("__TEMPERATURE__", str(temperature_c))
     phreeqc_code = phreeqc_code.replace("__NA__", str(Na))
     phreeqc_code = phreeqc_code.replace("__CL__", str(Cl))
@@ -395,44 +326,11 @@ def simulate_co2_brine_rock_fixed(
     phreeqc_code = phreeqc_code.replace("__P_CO2__", str(p_co2))
     phreeqc_code = phreeqc_code.replace("__P_H2O__", str(p_h2o))
     phreeqc_code = phreeqc_code.replace("__MINERAL_PHASES__", mineral_phases_str)
-    phreeqc_code = phreeqc_code.replace("__OUTPUT_FILE__", brine_rock_out_file)
 
-    filename = os.path.join(temp_files_path, "co2_brine_rock.pqi")
-
-    with open(filename, "w") as pqi:
-        pqi.write(phreeqc_code)
-
-    # Run phreeqc with full paths
-    subprocess.run(
-        ["phreeqc", filename, filename.replace(".pqi", ".pqo")],
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.STDOUT,
-    )
-
-    # Make sure the file exists before trying to read it
-    if not os.path.exists(brine_rock_out_file):
-        raise FileNotFoundError(f"Output file not found: {brine_rock_out_file}")
-
-    # Initialize results with a default empty dictionary
-    results = {}
-
-    # Read the output file
-    try:
-        with open(brine_rock_out_file, mode="r") as file:
-            reader = csv.DictReader(file, delimiter="\t")
-            # Clean column names by stripping spaces
-            if reader.fieldnames:
-                fieldnames = [field.strip() for field in reader.fieldnames]
-                reader = csv.DictReader(file, fieldnames=fieldnames, delimiter="\t")
-                next(reader)  # Skip header row
-
-                # Get the last row (final simulation state)
-                for row in reader:
-                    results = row  # Will keep the last row
-
-    except Exception as e:
-        print(f"Error reading {brine_rock_out_file}: {str(e)}", flush=True)
-        raise
+    # Get the last row (final simulation state)
+    results = run_phreeqc(
+        phreeqc_code, database_name, name="co2_brine_rock", last_only=True
+    ).last()
 
     # Extract results
     try:
@@ -470,6 +368,9 @@ def simulate_co2_brine_rock_fixed(
     }
 
 
+@cached_simulation(
+    templates=("co2_brine_rock_var_pressure_template.pqi",), databases=("phreeqc",)
+)
 def simulate_co2_brine_rock_var_p(temperature, ion_moles, mineralogy, model):
     """
     Simulate CO2 solubility with brine-rock interaction over a range of pressures at fixed temperature.
@@ -491,6 +392,7 @@ def simulate_co2_brine_rock_var_p(temperature, ion_moles, mineralogy, model):
     return result
 
 
+@cached_simulation(templates=("co2_brine_rock_template.pqi",))
 def simulate_co2_brine_rock_var_t(pressure, ion_moles, mineralogy, model):
     """
     Simulate CO2 solubility with brine-rock interaction over a range of temperatures at fixed pressure.
@@ -559,6 +461,9 @@ _MINERAL_PHREEQC_NAMES = {
 }
 
 
+@cached_simulation(
+    templates=("mineral_eq_post_template.pqi", "mineral_eq_pre_template.pqi")
+)
 def simulate_mineral_equilibrium(
     temperature_k: float,
     pressure_mpa: float,
@@ -610,7 +515,6 @@ def simulate_mineral_equilibrium(
         salinity_ppm            : float
         ion_totals              : {ion: mol/kg}  Na, Cl, Mg, Ca, K, S(6), C(4)
     """
-    temp_files_path = tempfile.gettempdir()
     temperature_c = temperature_k - 273.15
     pressure_atm = pressure_mpa * 9.86923
     p_co2 = pressure_atm * 0.95
@@ -658,13 +562,7 @@ def simulate_mineral_equilibrium(
     with open(template_path, "r") as f:
         phreeqc_code = f.read()
 
-    # Unique output file to avoid collisions between concurrent calls
-    unique_id = uuid.uuid4().hex[:8]
-    output_tsv = os.path.join(temp_files_path, f"mineral_eq_{unique_id}.tsv")
-    pqi_file = os.path.join(temp_files_path, f"mineral_eq_{unique_id}.pqi")
-
     database_name = model if model in ("phreeqc", "pitzer") else "phreeqc"
-    phreeqc_code = phreeqc_code.replace("__DATABASE__",      f"/usr/local/share/doc/phreeqc/database/{database_name}.dat")
     phreeqc_code = phreeqc_code.replace("__TEMPERATURE__",   str(temperature_c))
     phreeqc_code = phreeqc_code.replace("__PRESSURE_ATM__",  str(pressure_atm))
     phreeqc_code = phreeqc_code.replace("__NA__",            str(Na))
@@ -677,37 +575,21 @@ def simulate_mineral_equilibrium(
     phreeqc_code = phreeqc_code.replace("__WATER_MASS__",    str(water_mass_kg))
     phreeqc_code = phreeqc_code.replace("__MINERAL_PHASES__", mineral_phases_str)
     phreeqc_code = phreeqc_code.replace("__SELECTED_MINERALS__", selected_minerals_str)
-    phreeqc_code = phreeqc_code.replace("__OUTPUT_FILE__",   output_tsv)
     if with_co2:
         phreeqc_code = phreeqc_code.replace("__P_CO2__",  str(p_co2))
         phreeqc_code = phreeqc_code.replace("__P_H2O__",  str(p_h2o))
 
-    with open(pqi_file, "w") as f:
-        f.write(phreeqc_code)
-
-    subprocess.run(
-        ["phreeqc", pqi_file, pqi_file.replace(".pqi", ".pqo")],
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.STDOUT,
-    )
-
-    if not os.path.exists(output_tsv):
-        raise FileNotFoundError(
-            f"PHREEQC did not produce output: {output_tsv}. "
-            "Check the .pqo log for errors."
-        )
-
-    # Parse output with pandas (consistent with supplemental approach)
-    df = pd.read_csv(output_tsv, sep="\t")
-    df.columns = df.columns.str.strip()
-    row = df.iloc[-1]
+    # Only the final equilibrium row is needed
+    row = run_phreeqc(
+        phreeqc_code, database_name, name="mineral_eq", last_only=True
+    ).last()
 
     # Read post-reaction mineral moles (remaining absolute moles)
     post_moles = {}
     for py_name, phreeqc_name in _MINERAL_PHREEQC_NAMES.items():
-        if phreeqc_name in df.columns:
+        if phreeqc_name in row:
             val = row[phreeqc_name]
-            # PHREEQC can write -1.#IND or similar on failure; treat as 0
+            # -1.#IND and similar failure values are read as None
             try:
                 post_moles[py_name] = max(float(val), 0.0)
             except (ValueError, TypeError):
@@ -1,7 +1,10 @@
 import os
 import sys
+import functools
 import numpy as np
 import pandas as pd
+from dataclasses import dataclass
+from types import MappingProxyType
 from typing import Dict, Any, Optional, Tuple
 
 #from SpanWagner import vaporization_curve
@@ -12,316 +15,503 @@ P_critical = 7.3773
 T_critical = 304.1282
 
 def vaporization_curve(T: float) -> float:
-    if T < T_triple or T > T_critical:
+    """
+    Saturation pressure of CO2 (MPa) between the triple and critical points.
+
+    T (K) may also be an array; array points outside that range are NaN.
+    """
+    if np.isscalar(T) and (T < T_triple or T > T_critical):
         raise ValueError(
             f"Temperature for vaporization curve should be between triple point and critical point temperatures (T_triple = {T_triple}), T_critical = {T_critical}"
         )
 
-    a = [-7.0602087, 1.9391218, -1.6463597, -3.2995634]
-    t = [1, 1.5, 2, 4]
-    sum_value = 0
-    for a_i, t_i in zip(a, t):
-        sum_value += a_i * ((1 - T / T_critical) ** t_i)
-    return np.exp((T_critical / T) * sum_value) * P_critical
+    a = np.array([-7.0602087, 1.9391218, -1.6463597, -3.2995634])
+    t = np.array([1, 1.5, 2, 4])
+    T = np.asarray(T, dtype=np.float64)
+    inside = (T >= T_triple) & (T <= T_critical)
+    T_inside = np.where(inside, T, T_critical)
+    sum_value = np.sum(a * (1 - T_inside[..., np.newaxis] / T_critical) ** t, axis=-1)
+    P = np.exp((T_critical / T_inside) * sum_value) * P_critical
+    return np.where(inside, P, np.nan)[()]
 
 
-class DuanSun2006:
-    def __init__(self):
-        self._load_EOS_parameters()
-        self._load_DuanSun_parameters()
-        self._load_Guo_parameters()
+def _read_only(values) -> np.ndarray:
+    array = np.array(values, dtype=np.float64)
+    array.flags.writeable = False
+    return array
 
-        self.params = None
 
-    def _load_EOS_parameters(self) -> None:
-        self.EOS_PARAMS = [
-            # Range 1
-            [
-                1.0,
-                4.7586835e-3,
-                -3.3569963e-6,
-                0.0,
-                -1.3179396,
-                -3.8389101e-6,
-                0.0,
-                2.2815104e-3,
-                0.0,
-                0.0,
-                0.0,
-                0.0,
-                0.0,
-                0.0,
-                0.0,
-            ],
-            # Range 2
-            [
-                -7.1734882e-1,
-                1.5985379e-4,
-                -4.9286471e-7,
-                0.0,
-                0.0,
-                -2.7855285e-7,
-                1.1877015e-9,
-                0.0,
-                0.0,
-                0.0,
-                0.0,
-                -96.539512,
-                4.4774938e-1,
-                101.81078,
-                5.3783879e-6,
-            ],
-            # Range 3
-            [
-                -6.5129019e-2,
-                -2.1429977e-4,
-                -1.1444930e-6,
-                0.0,
-                0.0,
-                -1.1558081e-7,
-                1.1952370e-9,
-                0.0,
-                0.0,
-                0.0,
-                0.0,
-                -221.34306,
-                0.0,
-                71.820393,
-                6.6089246e-6,
-            ],
-            # Range 4
-            [
-                5.0383896,
-                -4.4257744e-3,
-                0.0,
-                1.9572733,
-                0.0,
-                2.4223436e-6,
-                0.0,
-                -9.3796135e-4,
-                -1.502603,
-                3.0272240e-3,
-                -31.377342,
-                -12.847063,
-                0.0,
-                0.0,
-                -1.5056648e-5,
-            ],
-            # Range 5
-            [
-                -16.063152,
-                -2.7057990e-3,
-                0.0,
-                1.4119239e-1,
-                0.0,
-                8.1132965e-7,
-                0.0,
-                -1.1453082e-4,
-                2.3895671,
-                5.0527457e-4,
-                -17.76346,
-                985.92232,
-                0.0,
-                0.0,
-                -5.4965256e-7,
-            ],
-            # Range 6
-            [
-                -1.5693490e-1,
-                4.4621407e-4,
-                -9.1080591e-7,
-                0.0,
-                0.0,
-                1.0647399e-7,
-                2.4273357e-10,
-                0.0,
-                3.5874255e-1,
-                6.3319710e-5,
-                -249.89661,
-                0.0,
-                0.0,
-                888.768,
-                -6.6348003e-7,
-            ],
-        ]
-    
-    def _load_DuanSun_parameters(self) -> None:
-        self.CO2_MU_LIQUID_COEFFS = [
-            28.9447706,
-            -0.0354581768,
-            -4770.67077,
-            1.02782768e-5,
-            33.8126098,
-            9.04037140e-3,
-            -1.14934031e-3,
-            -0.307405726,
-            -0.0907301486,
-            9.32713393e-4,
-            0,
-        ]
+# Coefficients of the CO2 fugacity coefficient equation, one row per T-P
+# range (Duan and Sun 2006, Table 1)
+EOS_PARAMS = _read_only(
+    [
+        # Range 1
+        [
+            1.0,
+            4.7586835e-3,
+            -3.3569963e-6,
+            0.0,
+            -1.3179396,
+            -3.8389101e-6,
+            0.0,
+            2.2815104e-3,
+            0.0,
+            0.0,
+            0.0,
+            0.0,
+            0.0,
+            0.0,
+            0.0,
+        ],
+        # Range 2
+        [
+            -7.1734882e-1,
+            1.5985379e-4,
+            -4.9286471e-7,
+            0.0,
+            0.0,
+            -2.7855285e-7,
+            1.1877015e-9,
+            0.0,
+            0.0,
+            0.0,
+            0.0,
+            -96.539512,
+            4.4774938e-1,
+            101.81078,
+            5.3783879e-6,
+        ],
+        # Range 3
+        [
+            -6.5129019e-2,
+            -2.1429977e-4,
+            -1.1444930e-6,
+            0.0,
+            0.0,
+            -1.1558081e-7,
+            1.1952370e-9,
+            0.0,
+            0.0,
+            0.0,
+            0.0,
+            -221.34306,
+            0.0,
+            71.820393,
+            6.6089246e-6,
+        ],
+        # Range 4
+        [
+            5.0383896,
+            -4.4257744e-3,
+            0.0,
+            1.9572733,
+            0.0,
+            2.4223436e-6,
+            0.0,
+            -9.3796135e-4,
+            -1.502603,
+            3.0272240e-3,
+            -31.377342,
+            -12.847063,
+            0.0,
+            0.0,
+            -1.5056648e-5,
+        ],
+        # Range 5
+        [
+            -16.063152,
+            -2.7057990e-3,
+            0.0,
+            1.4119239e-1,
+            0.0,
+            8.1132965e-7,
+            0.0,
+            -1.1453082e-4,
+            2.3895671,
+            5.0527457e-4,
+            -17.76346,
+            985.92232,
+            0.0,
+            0.0,
+            -5.4965256e-7,
+        ],
+        # Range 6
+        [
+            -1.5693490e-1,
+            4.4621407e-4,
+            -9.1080591e-7,
+            0.0,
+            0.0,
+            1.0647399e-7,
+            2.4273357e-10,
+            0.0,
+            3.5874255e-1,
+            6.3319710e-5,
+            -249.89661,
+            0.0,
+            0.0,
+            888.768,
+            -6.6348003e-7,
+        ],
+    ]
+)
 
-        self.LAMBDA_CO2_NA = [
-            -0.411370585,
-            6.07632013e-4,
-            97.5347708,
-            0,
-            0,
-            0,
-            0,
-            -0.0237622469,
-            0.0170656236,
-            0,
-            1.41335834e-5,
-        ]
+# Coefficients of the mu(CO2), lambda(CO2-Na) and zeta(CO2-Na-Cl)
+# polynomials for each parameter set: Duan and Sun (2006) and the Guo refit
+MODEL_PARAMS = MappingProxyType(
+    {
+        "DuanSun": MappingProxyType(
+            {
+                "CO2_MU_LIQUID_COEFFS": _read_only(
+                    [
+                        28.9447706,
+                        -0.0354581768,
+                        -4770.67077,
+                        1.02782768e-5,
+                        33.8126098,
+                        9.04037140e-3,
+                        -1.14934031e-3,
+                        -0.307405726,
+                        -0.0907301486,
+                        9.32713393e-4,
+                        0,
+                    ]
+                ),
+                "LAMBDA_CO2_NA": _read_only(
+                    [
+                        -0.411370585,
+                        6.07632013e-4,
+                        97.5347708,
+                        0,
+                        0,
+                        0,
+                        0,
+                        -0.0237622469,
+                        0.0170656236,
+                        0,
+                        1.41335834e-5,
+                    ]
+                ),
+                "ZETA_CO2_NA_CL": _read_only(
+                    [
+                        3.36389723e-4,
+                        -1.98298980e-5,
+                        0,
+                        0,
+                        0,
+                        0,
+                        0,
+                        2.12220830e-3,
+                        -5.24873303e-3,
+                        0,
+                        0,
+                    ]
+                ),
+            }
+        ),
+        "Guo": MappingProxyType(
+            {
+                "CO2_MU_LIQUID_COEFFS": _read_only(
+                    [
+                        2.52671156e1,
+                        -2.99024399e-2,
+                        -4.11129437e3,
+                        1.23091891e-5,
+                        -4.86804783e1,
+                        9.66527036e-2,
+                        -1.43035525e-2,
+                        -4.28379454,
+                        2.70920374e-1,
+                        -1.64011109e-2,
+                        -1.24611227e-4,
+                    ]
+                ),
+                "LAMBDA_CO2_NA": _read_only(
+                    [
+                        2.32329297,
+                        -5.52304993e-3,
+                        -3.21472657e2,
+                        1.82754454e-6,
+                        8.16653987e1,
+                        -4.06006390e-2,
+                        6.10232321e-3,
+                        1.88150995,
+                        -2.50830982e-1,
+                        2.48768009e-2,
+                        1.01658267e-4,
+                    ]
+                ),
+                "ZETA_CO2_NA_CL": _read_only(
+                    [
+                        -1.10067716,
+                        2.58535943e-3,
+                        1.61555536e2,
+                        -9.67677864e-7,
+                        -3.24768654e1,
+                        1.30813929e-2,
+                        -1.97407284e-3,
+                        -6.02020260e-1,
+                        9.35464931e-2,
+                        -9.06376267e-3,
+                        -3.63798082e-5,
+                    ]
+                ),
+            }
+        ),
+    }
+)
 
-        self.ZETA_CO2_NA_CL = [
-            3.36389723e-4,
-            -1.98298980e-5,
-            0,
-            0,
-            0,
-            0,
-            0,
-            2.12220830e-3,
-            -5.24873303e-3,
-            0,
-            0,
-        ]
-    
-    def _load_Guo_parameters(self) -> None:
-        self.CO2_MU_LIQUID_COEFFS = [
-            2.52671156e1,
-            -2.99024399e-2,
-            -4.11129437e3,
-            1.23091891e-5,
-            -4.86804783e1,
-            9.66527036e-2,
-            -1.43035525e-2,
-            -4.28379454,
-            2.70920374e-1,
-            -1.64011109e-2,
-            -1.24611227e-4,
-        ]
 
-        self.LAMBDA_CO2_NA = [
-            2.32329297,
-            -5.52304993e-3,
-            -3.21472657e2,
-            1.82754454e-6,
-            8.16653987e1,
-            -4.06006390e-2,
-            6.10232321e-3,
-            1.88150995,
-            -2.50830982e-1,
-            2.48768009e-2,
-            1.01658267e-4,
-        ]
+def _to_list(solubilities: np.ndarray) -> list:
+    """Convert a solubility array to a list, with None where it is NaN."""
+    return [None if np.isnan(value) else value for value in solubilities.tolist()]
 
-        self.ZETA_CO2_NA_CL = [
-            -1.10067716,
-            2.58535943e-3,
-            1.61555536e2,
-            -9.67677864e-7,
-            -3.24768654e1,
-            1.30813929e-2,
-            -1.97407284e-3,
-            -6.02020260e-1,
-            9.35464931e-2,
-            -9.06376267e-3,
-            -3.63798082e-5,
-        ]
+
+# Ion order of the columns of a StateKernel molality matrix
+KERNEL_IONS = ("Na+", "K+", "Ca+2", "Mg+2", "Cl-", "SO4-2")
+
+
+def molality_matrix(brines) -> np.ndarray:
+    """
+    Stack brine compositions into an (N, ions) matrix in KERNEL_IONS order.
+
+    Parameters:
+        brines: Iterable of dictionaries of ion molalities; missing ions are 0
+    """
+    return np.array(
+        [[brine.get(ion, 0.0) or 0.0 for ion in KERNEL_IONS] for brine in brines],
+        dtype=np.float64,
+    ).reshape(-1, len(KERNEL_IONS))
+
+
+@dataclass(frozen=True, eq=False)
+class StateKernel:
+    """
+    The (P, T)-dependent part of the Duan-Sun solubility at one state.
+
+    ln m(CO2) = log_base + ln gamma, where log_base = ln(y_CO2 P phi) - mu/RT
+    depends on P and T only, and the activity term is
+
+        ln gamma = -2 lambda (m_Na + m_K + 2 m_Ca + 2 m_Mg)
+                   - zeta m_Cl (m_Na + m_K + m_Ca + m_Mg) + 0.07 m_SO4
+
+    weights holds both ion sums as the two columns of an (ions, 2) matrix,
+    so apply() needs one matrix product for any number of brines.
+    """
+
+    pressure: float
+    temperature: float
+    model: str
+    log_base: float
+    lambda_CO2_Na: float
+    zeta_CO2_Na_Cl: float
+    weights: np.ndarray
+
+    def apply(self, molalities) -> np.ndarray:
+        """
+        Calculate CO2 solubility (mol/kg water) for many brines at this state.
+
+        Parameters:
+            molalities: (N, ions) matrix with columns in KERNEL_IONS order (see
+                molality_matrix), or a single composition of shape (ions,)
+
+        Returns:
+            ndarray of shape (N,), or a scalar for a single composition; NaN
+            when the state lies outside the EOS ranges
+        """
+        molalities = np.asarray(molalities, dtype=np.float64)
+        sums = molalities @ self.weights
+        log_activity = (
+            sums[..., 0]
+            - self.zeta_CO2_Na_Cl * molalities[..., KERNEL_IONS.index("Cl-")] * sums[..., 1]
+        )
+        return np.exp(self.log_base + log_activity)
+
+
+@functools.lru_cache(maxsize=1024)
+def _state_kernel(P: float, T: float, model: str) -> StateKernel:
+    return shared_model._build_state_kernel(P, T, model)
+
+
+class DuanSun2006:
+    """
+    Duan and Sun (2006) CO2 solubility model, with the Guo parameter set as
+    an alternative (model="Guo").
+
+    The coefficients live in the read-only module tables EOS_PARAMS and
+    MODEL_PARAMS, and every calculation picks its parameter set by name, so
+    instances hold no state and one (shared_model) can serve every thread.
+    """
+
+    @staticmethod
+    def _parameters(model: str):
+        try:
+            return MODEL_PARAMS[model]
+        except KeyError:
+            raise ValueError(f"Model {model} not recognized.") from None
 
     def _determine_equation_range(self, T: float, P: float) -> int:
-        if T < 304.1282:
-            P1 = vaporization_curve(T) * 10  # convert from MPa to bar
-        elif 304.1282 <= T < 405.0:
-            P1 = 75.0 + (T - 305.0) * 1.25  # in bar
-        elif T >= 405.0:
-            P1 = 200.0  # in bar
-
-        # Determine the T-P range
-        if 273.0 < T < 573.0 and P < P1:
-            range_idx = 0  # Range 1
-        elif 273.0 < T < 340.0 and P1 <= P < 1000.0:
-            range_idx = 1  # Range 2
-        elif 273.0 < T < 340.0 and P >= 1000.0:
-            range_idx = 2  # Range 3
-        elif 340.0 <= T < 435.0 and P1 <= P <= 1000.0:
-            range_idx = 3  # Range 4
-        elif 340.0 <= T < 435.0 and P >= 1000.0:
-            range_idx = 4  # Range 5
-        elif T >= 435.0:  # and P > P1:
-            range_idx = 5  # Range 6
-        else:
+        range_idx = self._equation_ranges(T, P)
+        if range_idx < 0:
             raise ValueError(
                 f"Input conditions do not fall within defined T-P ranges {T=} {P=}"
             )
 
-        return range_idx
+        return int(range_idx)
+
+    def _equation_ranges(self, T, P_bar) -> np.ndarray:
+        """
+        Range index (0-5) of every (T, P) point, -1 where no range applies.
+
+        Parameters:
+            T: Temperature(s) in Kelvin
+            P_bar: Pressure(s) in bar, broadcastable with T
+        """
+        T = np.asarray(T, dtype=np.float64)
+        P_bar = np.asarray(P_bar, dtype=np.float64)
+
+        # Boundary pressure P1 in bar
+        with np.errstate(invalid="ignore"):
+            P1 = np.where(
+                T < T_critical,
+                vaporization_curve(T) * 10,  # convert from MPa to bar
+                np.where(T < 405.0, 75.0 + (T - 305.0) * 1.25, 200.0),
+            )
+
+        # Same order as the ranges: the first matching condition wins
+        conditions = [
+            (273.0 < T) & (T < 573.0) & (P_bar < P1),
+            (273.0 < T) & (T < 340.0) & (P1 <= P_bar) & (P_bar < 1000.0),
+            (273.0 < T) & (T < 340.0) & (P_bar >= 1000.0),
+            (340.0 <= T) & (T < 435.0) & (P1 <= P_bar) & (P_bar <= 1000.0),
+            (340.0 <= T) & (T < 435.0) & (P_bar >= 1000.0),
+            T >= 435.0,
+        ]
+        return np.select(conditions, np.arange(len(conditions)), default=-1)
 
-    def calculate_CO2_mu_liquid(self, P: float, T: float) -> float:
+    def calculate_CO2_mu_liquid(self, P: float, T: float, model: str = "DuanSun") -> float:
         """
         calculates the chemical potential (mu) of CO2 in the liquid phase
         """
         # convert pressure from MPa to bar
         P_bar = P * 10
+        coeffs = self._parameters(model)["CO2_MU_LIQUID_COEFFS"]
         return (
-            self.CO2_MU_LIQUID_COEFFS[0]
-            + self.CO2_MU_LIQUID_COEFFS[1] * T
-            + self.CO2_MU_LIQUID_COEFFS[2] / T
-            + self.CO2_MU_LIQUID_COEFFS[3] * T**2
-            + self.CO2_MU_LIQUID_COEFFS[4] / (630 - T)
-            + self.CO2_MU_LIQUID_COEFFS[5] * P_bar
-            + self.CO2_MU_LIQUID_COEFFS[6] * P_bar * np.log(T)
-            + self.CO2_MU_LIQUID_COEFFS[7] * P_bar / T
-            + self.CO2_MU_LIQUID_COEFFS[8] * P_bar / (630 - T)
-            + self.CO2_MU_LIQUID_COEFFS[9] * P_bar**2 / (630 - T) ** 2
-            + self.CO2_MU_LIQUID_COEFFS[10] * T * np.log(P_bar)
+            coeffs[0]
+            + coeffs[1] * T
+            + coeffs[2] / T
+            + coeffs[3] * T**2
+            + coeffs[4] / (630 - T)
+            + coeffs[5] * P_bar
+            + coeffs[6] * P_bar * np.log(T)
+            + coeffs[7] * P_bar / T
+            + coeffs[8] * P_bar / (630 - T)
+            + coeffs[9] * P_bar**2 / (630 - T) ** 2
+            + coeffs[10] * T * np.log(P_bar)
         )
 
-    def calculate_lambda_CO2_Na(self, P: float, T: float) -> float:
+    def calculate_lambda_CO2_Na(self, P: float, T: float, model: str = "DuanSun") -> float:
         """
         Calculate the binary interaction parameter lambda for CO2 and Na+.
         """
         # convert pressure from MPa to bar
         P_bar = P * 10
+        coeffs = self._parameters(model)["LAMBDA_CO2_NA"]
         return (
-            self.LAMBDA_CO2_NA[0]
-            + self.LAMBDA_CO2_NA[1] * T
-            + self.LAMBDA_CO2_NA[2] / T
-            + self.LAMBDA_CO2_NA[3] * T**2
-            + self.LAMBDA_CO2_NA[4] / (630 - T)
-            + self.LAMBDA_CO2_NA[5] * P_bar
-            + self.LAMBDA_CO2_NA[6] * P_bar * np.log(T)
-            + self.LAMBDA_CO2_NA[7] * P_bar / T
-            + self.LAMBDA_CO2_NA[8] * P_bar / (630 - T)
-            + self.LAMBDA_CO2_NA[9] * P_bar**2 / (630 - T) ** 2
-            + self.LAMBDA_CO2_NA[10] * T * np.log(P_bar)
+            coeffs[0]
+            + coeffs[1] * T
+            + coeffs[2] / T
+            + coeffs[3] * T**2
+            + coeffs[4] / (630 - T)
+            + coeffs[5] * P_bar
+            + coeffs[6] * P_bar * np.log(T)
+            + coeffs[7] * P_bar / T
+            + coeffs[8] * P_bar / (630 - T)
+            + coeffs[9] * P_bar**2 / (630 - T) ** 2
+            + coeffs[10] * T * np.log(P_bar)
         )
 
-    def calculate_zeta_CO2_Na_Cl(self, P: float, T: float) -> float:
+    def calculate_zeta_CO2_Na_Cl(self, P: float, T: float, model: str = "DuanSun") -> float:
         """
         Calculate the ternary interaction parameter zeta for CO2, Na+, and Cl-.
         """
         # convert pressure from MPa to bar
         P_bar = P * 10
+        coeffs = self._parameters(model)["ZETA_CO2_NA_CL"]
+        return (
+            coeffs[0]
+            + coeffs[1] * T
+            + coeffs[2] / T
+            + coeffs[3] * T**2
+            + coeffs[4] / (630 - T)
+            + coeffs[5] * P_bar
+            + coeffs[6] * P_bar * np.log(T)
+            + coeffs[7] * P_bar / T
+            + coeffs[8] * P_bar / (630 - T)
+            + coeffs[9] * P_bar**2 / (630 - T) ** 2
+            + coeffs[10] * T * np.log(P_bar)
+        )
+
+    @staticmethod
+    def _polynomial_derivatives(coeffs, P_bar, T):
+        """d/dP_bar and d/dT of the mu/lambda/zeta polynomial with coeffs."""
+        log_T = np.log(T)
+        d_P_bar = (
+            coeffs[5]
+            + coeffs[6] * log_T
+            + coeffs[7] / T
+            + coeffs[8] / (630 - T)
+            + 2 * coeffs[9] * P_bar / (630 - T) ** 2
+            + coeffs[10] * T / P_bar
+        )
+        d_T = (
+            coeffs[1]
+            - coeffs[2] / T**2
+            + 2 * coeffs[3] * T
+            + coeffs[4] / (630 - T) ** 2
+            + coeffs[6] * P_bar / T
+            - coeffs[7] * P_bar / T**2
+            + coeffs[8] * P_bar / (630 - T) ** 2
+            + 2 * coeffs[9] * P_bar**2 / (630 - T) ** 3
+            + coeffs[10] * np.log(P_bar)
+        )
+        return d_P_bar, d_T
+
+    @staticmethod
+    def _vap_mol_frac_derivatives(P_bar, T):
+        """d/dP_bar and d/dT of calculate_CO2_vap_mol_frac (0 where it is clamped)."""
+        Tc = 647.29
+        Pc = 220.85
+        t = (T - Tc) / Tc
+        h = (
+            1
+            - 38.640844 * (-t) ** 1.9
+            + 5.8948420 * t
+            + 59.876516 * t**2
+            + 26.654627 * t**3
+            + 10.637097 * t**4
+        )
+        dh_dt = (
+            38.640844 * 1.9 * (-t) ** 0.9
+            + 5.8948420
+            + 2 * 59.876516 * t
+            + 3 * 26.654627 * t**2
+            + 4 * 10.637097 * t**3
+        )
+        P_water = (Pc * T / Tc) * h
+        dP_water_dT = (Pc / Tc) * h + (Pc * T / Tc) * dh_dt / Tc
+
+        clamped = (P_bar - P_water) / P_bar < 0
         return (
-            self.ZETA_CO2_NA_CL[0]
-            + self.ZETA_CO2_NA_CL[1] * T
-            + self.ZETA_CO2_NA_CL[2] / T
-            + self.ZETA_CO2_NA_CL[3] * T**2
-            + self.ZETA_CO2_NA_CL[4] / (630 - T)
-            + self.ZETA_CO2_NA_CL[5] * P_bar
-            + self.ZETA_CO2_NA_CL[6] * P_bar * np.log(T)
-            + self.ZETA_CO2_NA_CL[7] * P_bar / T
-            + self.ZETA_CO2_NA_CL[8] * P_bar / (630 - T)
-            + self.ZETA_CO2_NA_CL[9] * P_bar**2 / (630 - T) ** 2
-            + self.ZETA_CO2_NA_CL[10] * T * np.log(P_bar)
+            np.where(clamped, 0.0, P_water / P_bar**2),
+            np.where(clamped, 0.0, -dP_water_dT / P_bar),
         )
 
     def calculate_CO2_vap_mol_frac(self, P: float, T: float) -> float:
         """
         Calculate the mole fraction of CO2 in the vapor phase.
+
+        P (MPa) and T (K) may also be arrays, which are broadcast together.
         """
         # convert pressure from MPa to bar
         P_bar = P * 10
@@ -338,6 +528,8 @@ class DuanSun2006:
         )
 
         mole_fraction = (P_bar - P_water) / P_bar
+        if np.ndim(mole_fraction):
+            return np.where(mole_fraction < 0, 1e-6, mole_fraction)
         if mole_fraction < 0:
             return 1e-6
         return mole_fraction
@@ -345,27 +537,34 @@ class DuanSun2006:
     def co2_fugacity_coefficient(self, P: float, T: float) -> float:
         """
         Calculate the fugacity of CO2 using the Duan and Sun (2006) equation of state.
+
+        P (MPa) and T (K) may also be arrays, which are broadcast together;
+        points outside every T-P range then come back as NaN (see
+        co2_fugacity_coefficient_array for the mask of those points).
         """
+        if np.ndim(P) or np.ndim(T):
+            return self.co2_fugacity_coefficient_array(P, T)[0]
+
         # convert pressure from MPa to bar
         P_bar = P * 10
         range_idx = self._determine_equation_range(T, P_bar)
 
         # Extract coefficients
-        c1 = self.EOS_PARAMS[range_idx][0]
-        c2 = self.EOS_PARAMS[range_idx][1]
-        c3 = self.EOS_PARAMS[range_idx][2]
-        c4 = self.EOS_PARAMS[range_idx][3]
-        c5 = self.EOS_PARAMS[range_idx][4]
-        c6 = self.EOS_PARAMS[range_idx][5]
-        c7 = self.EOS_PARAMS[range_idx][6]
-        c8 = self.EOS_PARAMS[range_idx][7]
-        c9 = self.EOS_PARAMS[range_idx][8]
-        c10 = self.EOS_PARAMS[range_idx][9]
-        c11 = self.EOS_PARAMS[range_idx][10]
-        c12 = self.EOS_PARAMS[range_idx][11]
-        c13 = self.EOS_PARAMS[range_idx][12]
-        c14 = self.EOS_PARAMS[range_idx][13]
-        c15 = self.EOS_PARAMS[range_idx][14]
+        c1 = EOS_PARAMS[range_idx][0]
+        c2 = EOS_PARAMS[range_idx][1]
+        c3 = EOS_PARAMS[range_idx][2]
+        c4 = EOS_PARAMS[range_idx][3]
+        c5 = EOS_PARAMS[range_idx][4]
+        c6 = EOS_PARAMS[range_idx][5]
+        c7 = EOS_PARAMS[range_idx][6]
+        c8 = EOS_PARAMS[range_idx][7]
+        c9 = EOS_PARAMS[range_idx][8]
+        c10 = EOS_PARAMS[range_idx][9]
+        c11 = EOS_PARAMS[range_idx][10]
+        c12 = EOS_PARAMS[range_idx][11]
+        c13 = EOS_PARAMS[range_idx][12]
+        c14 = EOS_PARAMS[range_idx][13]
+        c15 = EOS_PARAMS[range_idx][14]
 
         # Calculate fugacity using the provided equation
         try:
@@ -387,14 +586,77 @@ class DuanSun2006:
         except ValueError as e:
             raise ValueError(f"Math domain error during fugacity calculation: {e}")
 
-    def calculate_log_activity(self, P: float, T: float, molalities: Dict[str, float]) -> float:
+    def co2_fugacity_coefficient_array(self, P, T) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Vectorized co2_fugacity_coefficient.
+
+        Parameters:
+            P: Pressure(s) in MPa
+            T: Temperature(s) in Kelvin, broadcastable with P
+
+        Returns:
+            (fugacity, in_range): the fugacity coefficients, NaN for points
+            outside every T-P range, and the boolean mask of the points inside
+        """
+        P_bar = np.asarray(P, dtype=np.float64) * 10
+        T = np.asarray(T, dtype=np.float64)
+        coefficients, in_range = self._EOS_coefficients(P_bar, T)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            fugacity = self._co2_fugacity(coefficients, P_bar, T)
+        return np.where(in_range, fugacity, np.nan), in_range
+
+    def _EOS_coefficients(self, P_bar, T) -> Tuple[np.ndarray, np.ndarray]:
+        """Gather the 15 EOS coefficients of every point from the (6, 15) table."""
+        P_bar, T = np.broadcast_arrays(P_bar, T)
+        range_idx = self._equation_ranges(T, P_bar)
+        in_range = range_idx >= 0
+        coefficients = np.moveaxis(EOS_PARAMS[np.where(in_range, range_idx, 0)], -1, 0)
+        return coefficients, in_range
+
+    @staticmethod
+    def _co2_fugacity(coefficients, P_bar, T):
+        (c1, c2, c3, c4, c5, c6, c7, c8, c9, c10, c11, c12, c13, c14, c15) = coefficients
+        return (
+            c1 +
+            (c2 + c3 * T + c4 / T + c5 / (T - 150.0)) * P_bar +
+            (c6 + c7 * T + c8 / T) * P_bar**2 +
+            (c9 + c10 * T + c11 / T) * np.log(P_bar) +
+            (c12 + c13 * T) / P_bar +
+            c14 / T +
+            c15 * T**2
+        )
+
+    @staticmethod
+    def _co2_fugacity_derivatives(coefficients, P_bar, T):
+        """d/dP_bar and d/dT of the EOS polynomial."""
+        (c1, c2, c3, c4, c5, c6, c7, c8, c9, c10, c11, c12, c13, c14, c15) = coefficients
+        d_P_bar = (
+            (c2 + c3 * T + c4 / T + c5 / (T - 150.0))
+            + 2 * (c6 + c7 * T + c8 / T) * P_bar
+            + (c9 + c10 * T + c11 / T) / P_bar
+            - (c12 + c13 * T) / P_bar**2
+        )
+        d_T = (
+            (c3 - c4 / T**2 - c5 / (T - 150.0) ** 2) * P_bar
+            + (c7 - c8 / T**2) * P_bar**2
+            + (c10 - c11 / T**2) * np.log(P_bar)
+            + c13 / P_bar
+            - c14 / T**2
+            + 2 * c15 * T
+        )
+        return d_P_bar, d_T
+
+    def calculate_log_activity(
+        self, P: float, T: float, molalities: Dict[str, float], model: str = "DuanSun"
+    ) -> float:
         """
         Calculate the logarithm of the activity coefficient using Pitzer equations.
         
         Parameters:
-            P: Pressure in bar
+            P: Pressure in MPa
             T: Temperature in Kelvin
             molalities: Dictionary of ion molalities
+            model: 'DuanSun' or 'Guo'
             
         Returns:
             float: The logarithm of the activity coefficient
@@ -410,9 +672,9 @@ class DuanSun2006:
         # Calculate activity coefficient using Pitzer equations
         log_activity = (
             -2
-            * self.calculate_lambda_CO2_Na(P, T)
+            * self.calculate_lambda_CO2_Na(P, T, model)
             * (m_na + m_k + 2 * m_ca + 2 * m_mg)
-            - self.calculate_zeta_CO2_Na_Cl(P, T) * m_cl * (m_na + m_k + m_ca + m_mg)
+            - self.calculate_zeta_CO2_Na_Cl(P, T, model) * m_cl * (m_na + m_k + m_ca + m_mg)
             + 0.07 * m_so4
         )
         
@@ -445,12 +707,7 @@ class DuanSun2006:
             >>> model.calculate_CO2_solubility(100.0, 323.15, {'Na': 1.0, 'Cl': 1.0})
         """
 
-        if model == "DuanSun":
-            self._load_DuanSun_parameters()
-        elif model == "Guo":
-            self._load_Guo_parameters()
-        else:
-            raise ValueError(f"Model {model} not recognized.")
+        self._parameters(model)
 
         # remove global conversion; convert locally for solubility product
         P_bar = P * 10  # bar equivalent of input MPa
@@ -459,7 +716,7 @@ class DuanSun2006:
             molalities = {}
 
         # Calculate log activity using the extracted method
-        log_activity = self.calculate_log_activity(P, T, molalities)
+        log_activity = self.calculate_log_activity(P, T, molalities, model)
 
         try:
             # Calculate CO2 solubility
@@ -471,7 +728,7 @@ class DuanSun2006:
 
             log_CO2_molality = (
                 np.log(prod)
-                - self.calculate_CO2_mu_liquid(P, T)
+                - self.calculate_CO2_mu_liquid(P, T, model)
                 + log_activity
             )
 
@@ -479,6 +736,383 @@ class DuanSun2006:
         except (ValueError, ZeroDivisionError) as e:
             print("Error calculating CO2 solubility: {e} (T={T} K, P={P} bar)")
 
+    def calculate_CO2_solubility_array(
+        self,
+        P,
+        T,
+        molalities: Optional[Dict[str, Any]] = None,
+        model: str = "DuanSun",
+        return_mask: bool = False,
+    ) -> np.ndarray:
+        """
+        Calculate CO2 solubility for arrays of states in one vectorized pass.
+
+        Parameters:
+            P: Pressure(s) in MPa
+            T: Temperature(s) in Kelvin
+            molalities: Dictionary of ion molalities (keys like 'Na+', 'Cl-');
+                each value may be a scalar or an array
+            model: 'DuanSun' or 'Guo'
+            return_mask: Also return the mask of states inside the EOS ranges
+
+        P, T and the molalities are broadcast together, so e.g. a column of
+        pressures and a row of temperatures give a pressure x temperature grid.
+
+        Returns:
+            ndarray: CO2 solubility in mol/kg water, NaN where a state lies
+            outside the EOS ranges or has no CO2 partial pressure; with
+            return_mask, a (solubility, in_range) tuple
+
+        Examples:
+            >>> model = DuanSun2006()
+            >>> P, T = np.meshgrid(np.linspace(0.5, 50, 100), np.linspace(280, 480, 100))
+            >>> model.calculate_CO2_solubility_array(P, T, {'Na+': 1.0, 'Cl-': 1.0})
+        """
+        self._parameters(model)
+
+        P = np.asarray(P, dtype=np.float64)
+        T = np.asarray(T, dtype=np.float64)
+        molalities = {
+            ion: np.asarray(molality, dtype=np.float64)
+            for ion, molality in (molalities or {}).items()
+        }
+
+        fugacity, in_range = self.co2_fugacity_coefficient_array(P, T)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            prod = self.calculate_CO2_vap_mol_frac(P, T) * (P * 10) * fugacity
+            log_CO2_molality = (
+                np.log(np.where(prod > 0, prod, np.nan))
+                - self.calculate_CO2_mu_liquid(P, T, model)
+                + self.calculate_log_activity(P, T, molalities, model)
+            )
+            solubility = np.exp(log_CO2_molality)
+
+        if return_mask:
+            return solubility, np.broadcast_to(in_range, solubility.shape)
+        return solubility
+
+    def calculate_CO2_solubility_gradient(
+        self,
+        P,
+        T,
+        molalities: Optional[Dict[str, Any]] = None,
+        model: str = "DuanSun",
+    ) -> Dict[str, Any]:
+        """
+        Calculate CO2 solubility together with its analytic derivatives.
+
+        Every closed-form term (EOS polynomial, vapour mole fraction, mu,
+        lambda and zeta polynomials) is evaluated once with its derivatives,
+        so the gradient comes at about the cost of one vectorized solubility
+        evaluation.  Inputs broadcast as in calculate_CO2_solubility_array.
+        The solubility is smooth inside each EOS range; on a range boundary
+        the derivative of the range the state is assigned to is returned.
+
+        Parameters:
+            P: Pressure(s) in MPa
+            T: Temperature(s) in Kelvin
+            molalities: Dictionary of ion molalities; values may be arrays
+            model: 'DuanSun' or 'Guo'
+
+        Returns:
+            dict with
+                'solubility': CO2 solubility in mol/kg water
+                'dS/dP': derivative with respect to pressure, (mol/kg)/MPa
+                'dS/dT': derivative with respect to temperature, (mol/kg)/K
+                'dS/dm': dict of ion (KERNEL_IONS) -> derivative with respect
+                    to its molality
+                'in_range': mask of the states inside the EOS ranges
+            All NaN where the solubility is NaN.
+        """
+        parameters = self._parameters(model)
+        molalities = molalities or {}
+        P = np.asarray(P, dtype=np.float64)
+        T = np.asarray(T, dtype=np.float64)
+        P_bar = P * 10
+        m_na, m_k, m_ca, m_mg, m_cl, m_so4 = (
+            np.asarray(molalities.get(ion, 0.0), dtype=np.float64) for ion in KERNEL_IONS
+        )
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            coefficients, in_range = self._EOS_coefficients(P_bar, T)
+            fugacity = np.where(
+                in_range, self._co2_fugacity(coefficients, P_bar, T), np.nan
+            )
+            dfugacity_dP_bar, dfugacity_dT = self._co2_fugacity_derivatives(
+                coefficients, P_bar, T
+            )
+            mole_fraction = self.calculate_CO2_vap_mol_frac(P, T)
+            dmole_fraction_dP_bar, dmole_fraction_dT = self._vap_mol_frac_derivatives(
+                P_bar, T
+            )
+
+            mu = self.calculate_CO2_mu_liquid(P, T, model)
+            lambda_CO2_Na = self.calculate_lambda_CO2_Na(P, T, model)
+            zeta_CO2_Na_Cl = self.calculate_zeta_CO2_Na_Cl(P, T, model)
+            dmu_dP_bar, dmu_dT = self._polynomial_derivatives(
+                parameters["CO2_MU_LIQUID_COEFFS"], P_bar, T
+            )
+            dlambda_dP_bar, dlambda_dT = self._polynomial_derivatives(
+                parameters["LAMBDA_CO2_NA"], P_bar, T
+            )
+            dzeta_dP_bar, dzeta_dT = self._polynomial_derivatives(
+                parameters["ZETA_CO2_NA_CL"], P_bar, T
+            )
+
+            # Same expression as calculate_log_activity
+            lambda_sum = m_na + m_k + 2 * m_ca + 2 * m_mg
+            zeta_sum = m_na + m_k + m_ca + m_mg
+            log_activity = (
+                -2 * lambda_CO2_Na * lambda_sum
+                - zeta_CO2_Na_Cl * m_cl * zeta_sum
+                + 0.07 * m_so4
+            )
+
+            prod = mole_fraction * P_bar * fugacity
+            solubility = np.exp(
+                np.log(np.where(prod > 0, prod, np.nan)) - mu + log_activity
+            )
+
+            # d ln(solubility)
+            dlog_dP_bar = (
+                dmole_fraction_dP_bar / mole_fraction
+                + 1 / P_bar
+                + dfugacity_dP_bar / fugacity
+                - dmu_dP_bar
+                - 2 * dlambda_dP_bar * lambda_sum
+                - dzeta_dP_bar * m_cl * zeta_sum
+            )
+            dlog_dT = (
+                dmole_fraction_dT / mole_fraction
+                + dfugacity_dT / fugacity
+                - dmu_dT
+                - 2 * dlambda_dT * lambda_sum
+                - dzeta_dT * m_cl * zeta_sum
+            )
+            monovalent = -2 * lambda_CO2_Na - zeta_CO2_Na_Cl * m_cl
+            divalent = -4 * lambda_CO2_Na - zeta_CO2_Na_Cl * m_cl
+            dlog_dm = {
+                "Na+": monovalent,
+                "K+": monovalent,
+                "Ca+2": divalent,
+                "Mg+2": divalent,
+                "Cl-": -zeta_CO2_Na_Cl * zeta_sum,
+                "SO4-2": 0.07,
+            }
+
+        return {
+            "solubility": solubility,
+            "dS/dP": solubility * dlog_dP_bar * 10,  # per MPa
+            "dS/dT": solubility * dlog_dT,
+            "dS/dm": {ion: solubility * dlog_dm[ion] for ion in KERNEL_IONS},
+            "in_range": np.broadcast_to(in_range, solubility.shape),
+        }
+
+    def state_kernel(self, P: float, T: float, model: str = "DuanSun") -> StateKernel:
+        """
+        Precompute every (P, T)-dependent term of the solubility at one state.
+
+        Screening many brines at the same reservoir condition then costs one
+        matrix product (see StateKernel.apply) instead of re-evaluating the
+        mu, lambda and zeta polynomials, the fugacity coefficient and the
+        vapour mole fraction for every composition.  Kernels are memoized per
+        (P, T, model).
+
+        Parameters:
+            P: Pressure in MPa
+            T: Temperature in Kelvin
+            model: 'DuanSun' or 'Guo'
+
+        Examples:
+            >>> kernel = shared_model.state_kernel(20.0, 350.0)
+            >>> kernel.apply(molality_matrix([{'Na+': 1.0, 'Cl-': 1.0}, {'Na+': 2.0, 'Cl-': 2.0}]))
+        """
+        self._parameters(model)
+        return _state_kernel(float(P), float(T), model)
+
+    def _build_state_kernel(self, P: float, T: float, model: str) -> StateKernel:
+        fugacity, _ = self.co2_fugacity_coefficient_array(P, T)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            prod = self.calculate_CO2_vap_mol_frac(P, T) * (P * 10) * float(fugacity)
+            log_base = (
+                np.log(prod) if prod > 0 else np.nan
+            ) - self.calculate_CO2_mu_liquid(P, T, model)
+
+        lambda_CO2_Na = float(self.calculate_lambda_CO2_Na(P, T, model))
+        lambda_term = -2 * lambda_CO2_Na
+        # Rows in KERNEL_IONS order; columns: lambda and sulphate terms,
+        # cations paired with Cl- in the zeta term
+        weights = _read_only(
+            [
+                [lambda_term, 1.0],  # Na+
+                [lambda_term, 1.0],  # K+
+                [2 * lambda_term, 1.0],  # Ca+2
+                [2 * lambda_term, 1.0],  # Mg+2
+                [0.0, 0.0],  # Cl-
+                [0.07, 0.0],  # SO4-2
+            ]
+        )
+
+        return StateKernel(
+            pressure=P,
+            temperature=T,
+            model=model,
+            log_base=float(log_base),
+            lambda_CO2_Na=lambda_CO2_Na,
+            zeta_CO2_Na_Cl=float(self.calculate_zeta_CO2_Na_Cl(P, T, model)),
+            weights=weights,
+        )
+
+    def solve_pressure(
+        self,
+        target,
+        T,
+        molalities: Optional[Dict[str, Any]] = None,
+        model: str = "DuanSun",
+        P_bounds: Tuple[float, float] = (0.1, 100.0),
+        **options,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the pressure at which a brine holds a target dissolved CO2.
+
+        Parameters:
+            target: Target CO2 solubility(ies) in mol/kg water
+            T: Temperature(s) in Kelvin
+            molalities: Dictionary of ion molalities; values may be arrays
+            model: 'DuanSun' or 'Guo'
+            P_bounds: Pressure interval searched, in MPa
+            options: scan_points, rtol and max_iter (see _solve_inverse)
+
+        target, T and the molalities are broadcast together and solved in one
+        batch.
+
+        Returns:
+            (pressure, converged): pressures in MPa, NaN where the target is
+            not reached inside P_bounds, and the boolean convergence flags
+
+        Examples:
+            >>> shared_model.solve_pressure([0.8, 1.0, 1.2], 330.0, {'Na+': 1.0, 'Cl-': 1.0})
+        """
+        return self._solve_inverse("P", target, T, molalities, model, P_bounds, **options)
+
+    def solve_temperature(
+        self,
+        target,
+        P,
+        molalities: Optional[Dict[str, Any]] = None,
+        model: str = "DuanSun",
+        T_bounds: Tuple[float, float] = (273.15, 573.15),
+        **options,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the temperature at which a brine holds a target dissolved CO2.
+
+        Solubility is not monotonic in temperature (it passes through a
+        minimum), so when a target is reached twice inside T_bounds the lower
+        temperature is returned.
+
+        Parameters:
+            target: Target CO2 solubility(ies) in mol/kg water
+            P: Pressure(s) in MPa
+            molalities: Dictionary of ion molalities; values may be arrays
+            model: 'DuanSun' or 'Guo'
+            T_bounds: Temperature interval searched, in Kelvin
+            options: scan_points, rtol and max_iter (see _solve_inverse)
+
+        Returns:
+            (temperature, converged): temperatures in Kelvin, NaN where the
+            target is not reached inside T_bounds, and the convergence flags
+        """
+        return self._solve_inverse("T", target, P, molalities, model, T_bounds, **options)
+
+    def _solve_inverse(
+        self,
+        variable: str,
+        target,
+        fixed,
+        molalities: Optional[Dict[str, Any]],
+        model: str,
+        bounds: Tuple[float, float],
+        scan_points: int = 101,
+        rtol: float = 1e-9,
+        max_iter: int = 100,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Solve solubility(variable) = target for every point at once.
+
+        A scan of scan_points values across bounds brackets the first sign
+        change of the residual for each point; the brackets are then refined
+        together with the Illinois variant of regula falsi.  A point has
+        converged when its residual is within rtol of the target; a bracket
+        that closes on a jump between EOS ranges instead stops unconverged.
+        """
+        self._parameters(model)
+        molalities = molalities or {}
+        arrays = np.broadcast_arrays(
+            np.asarray(target, dtype=np.float64),
+            np.asarray(fixed, dtype=np.float64),
+            *[np.asarray(molality, dtype=np.float64) for molality in molalities.values()],
+        )
+        shape = arrays[0].shape
+        target, fixed = arrays[0].ravel(), arrays[1].ravel()
+        ions = dict(zip(molalities, (array.ravel() for array in arrays[2:])))
+
+        def residual(x, axis=None):
+            # axis: add a trailing axis to the per-point inputs (for the scan)
+            expand = (lambda a: a[:, np.newaxis]) if axis else (lambda a: a)
+            P, T = (x, expand(fixed)) if variable == "P" else (expand(fixed), x)
+            solubility = self.calculate_CO2_solubility_array(
+                P, T, {ion: expand(m) for ion, m in ions.items()}, model
+            )
+            return solubility - expand(target)
+
+        # Bracket the first sign change along the scan
+        grid = np.linspace(bounds[0], bounds[1], scan_points)
+        F = residual(grid[np.newaxis, :], axis=True)
+        change = (
+            np.isfinite(F[:, :-1])
+            & np.isfinite(F[:, 1:])
+            & (np.sign(F[:, :-1]) != np.sign(F[:, 1:]))
+        )
+        active = change.any(axis=1)
+        first = change.argmax(axis=1)
+        rows = np.arange(len(target))
+        a, b = grid[first], grid[first + 1]
+        fa, fb = F[rows, first], F[rows, first + 1]
+
+        x = np.full(len(target), np.nan)
+        converged = np.zeros(len(target), dtype=bool)
+        side = np.zeros(len(target), dtype=np.int8)
+        tolerance = rtol * np.abs(target)
+        for _ in range(max_iter):
+            if not active.any():
+                break
+            with np.errstate(divide="ignore", invalid="ignore"):
+                c = b - fb * (b - a) / (fb - fa)
+            outside = ~np.isfinite(c) | (c < np.minimum(a, b)) | (c > np.maximum(a, b))
+            c = np.where(outside, (a + b) / 2, c)
+            fc = residual(c)
+
+            x = np.where(active, c, x)
+            done = np.abs(fc) <= tolerance
+            converged |= active & done
+            stalled = ~np.isfinite(fc) | (np.abs(b - a) <= 4 * np.finfo(float).eps * np.abs(b))
+            active &= ~done & ~stalled
+
+            # Keep the sign change inside [a, b]; Illinois halves the value at
+            # an endpoint that is retained twice in a row
+            same_as_a = np.sign(fc) == np.sign(fa)
+            a, fa, b, fb = (
+                np.where(same_as_a, c, a),
+                np.where(same_as_a, fc, np.where(side == -1, fa / 2, fa)),
+                np.where(same_as_a, b, c),
+                np.where(same_as_a, np.where(side == 1, fb / 2, fb), fc),
+            )
+            side = np.where(same_as_a, 1, -1).astype(np.int8)
+
+        x = np.where(change.any(axis=1), x, np.nan)
+        return x.reshape(shape), converged.reshape(shape)
+
     def calculate_varying_pressure(
         self,
         P_start: float,
@@ -505,14 +1139,10 @@ class DuanSun2006:
         if molalities is None:
             molalities = {}
         # Prepare pressure array
-        pressures = np.arange(P_start, P_end + P_step, P_step).tolist()
-        solubilities = []
-        for P in pressures:
-            sol = self.calculate_CO2_solubility(P, T, molalities, model)
-            solubilities.append(sol)
+        pressures = np.arange(P_start, P_end + P_step, P_step)
+        solubilities = self.calculate_CO2_solubility_array(pressures, T, molalities, model)
 
-
-        result = {'Pressure (MPa)': pressures, 'Dissolved CO2 (mol/kg)': solubilities}
+        result = {'Pressure (MPa)': pressures.tolist(), 'Dissolved CO2 (mol/kg)': _to_list(solubilities)}
 
         return result
 
@@ -544,17 +1174,16 @@ class DuanSun2006:
             molalities = {}
         
         # Prepare temperature array
-        temperatures = np.arange(T_start, T_end + T_step, T_step).tolist()
-        solubilities = []
-        
-        for T in temperatures:
-            sol = self.calculate_CO2_solubility(P, T, molalities, model)
-            solubilities.append(sol)
-        
-        result = {'Temperature (K)': temperatures, 'Dissolved CO2 (mol/kg)': solubilities}
+        temperatures = np.arange(T_start, T_end + T_step, T_step)
+        solubilities = self.calculate_CO2_solubility_array(P, temperatures, molalities, model)
+
+        result = {'Temperature (K)': temperatures.tolist(), 'Dissolved CO2 (mol/kg)': _to_list(solubilities)}
         
         return result
 
+# Process-wide instance for the simulation code and the agent tools
+shared_model = DuanSun2006()
+
 if __name__ == "__main__":
     # Create a grid of pressures and temperatures for CO2 solubility analysis
     # Temperature range: 280 to 480 K (approximately 7°C to 207°C)
@@ -567,30 +1196,14 @@ if __name__ == "__main__":
     # Create meshgrid for contour plotting
     T_grid, P_grid = np.meshgrid(temperatures, pressures)
     
-    # Initialize the DuanSun2006 model
-    model = DuanSun2006()
-    
-    # Initialize solubility grid
-    solubility_grid = np.zeros_like(T_grid)
+    model = shared_model
     
     print("Calculating CO2 solubility grid...")
     print(f"Temperature range: {temperatures.min():.1f} - {temperatures.max():.1f} K")
     print(f"Pressure range: {pressures.min():.1f} - {pressures.max():.1f} MPa")
     
-    # Calculate solubility for each T-P point (pure water, no ions)
-    for i, T in enumerate(temperatures):
-        for j, P in enumerate(pressures):
-            try:
-                # Calculate solubility for pure water (no molalities provided)
-                solubility = model.calculate_CO2_solubility(P, T, molalities=None, model="DuanSun")
-                solubility_grid[j, i] = solubility
-            except Exception as e:
-                print(f"Error at T={T:.1f}K, P={P:.1f}MPa: {e}")
-                solubility_grid[j, i] = np.nan
-        
-        # Progress indicator
-        if (i + 1) % 10 == 0:
-            print(f"Progress: {i + 1}/{len(temperatures)} temperature points completed")
+    # Calculate solubility for every T-P point at once (pure water, no ions)
+    solubility_grid = model.calculate_CO2_solubility_array(P_grid, T_grid, molalities=None, model="DuanSun")
     
     print("Grid calculation complete!")
     
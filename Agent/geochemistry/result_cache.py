@@ -0,0 +1,264 @@
+"""
+Content-addressed cache for simulation results.
+
+Results are keyed by a SHA-256 hash of
+    - the simulation function,
+    - its arguments after normalisation (ints and floats rounded to
+      CARBONEX_CACHE_PRECISION significant digits, dict keys sorted),
+    - the contents of the PHREEQC templates the function renders and of the
+      database file selected by its model argument,
+so editing a template or a database invalidates the affected entries.
+
+Two tiers are consulted in order:
+    1. an in-process LRU bounded by CARBONEX_CACHE_MAX_BYTES (pickled size),
+    2. an optional directory shared by all gunicorn workers, enabled by
+       setting CARBONEX_CACHE_DIR.
+
+Set CARBONEX_CACHE=0 to disable caching entirely.
+"""
+
+import functools
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+
+from .carbonex import CARBONEX_CALIBRATION
+from .phreeqc_engine import database_path
+
+CARBONEX_CACHE = os.environ.get("CARBONEX_CACHE", "1") == "1"
+CARBONEX_CACHE_MAX_BYTES = int(
+    os.environ.get("CARBONEX_CACHE_MAX_BYTES", str(64 * 1024 * 1024))
+)
+CARBONEX_CACHE_PRECISION = int(os.environ.get("CARBONEX_CACHE_PRECISION", "10"))
+CARBONEX_CACHE_DIR = os.environ.get("CARBONEX_CACHE_DIR")
+
+TEMPLATE_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "phreeqc_templates"
+)
+
+# Model strings that select a PHREEQC database, mapped to that database
+_MODEL_DATABASES = {
+    "phreeqc_phreeqc": "phreeqc",
+    "phreeqc_pitzer": "pitzer",
+    "phreeqc_pitzer_mod": "pitzer_mod",
+    "phreeqc": "phreeqc",
+    "pitzer": "pitzer",
+}
+
+
+def _normalize(value):
+    """Turn an argument into a JSON-serialisable canonical form."""
+    if isinstance(value, bool) or value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)):
+        return float(f"{float(value):.{CARBONEX_CACHE_PRECISION}g}")
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in sorted(value.items())}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    if hasattr(value, "tolist"):
+        # NumPy scalars and arrays
+        return _normalize(value.tolist())
+    raise TypeError(f"Cannot build a cache key from {type(value).__name__}")
+
+
+_file_digests = {}
+_file_digests_lock = threading.Lock()
+
+
+def file_digest(path):
+    """Return the SHA-256 of a file, re-hashed only when its size or mtime change."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    signature = (stat.st_size, stat.st_mtime_ns)
+    with _file_digests_lock:
+        cached = _file_digests.get(path)
+        if cached and cached[0] == signature:
+            return cached[1]
+
+    with open(path, "rb") as file:
+        digest = hashlib.sha256(file.read()).hexdigest()
+
+    with _file_digests_lock:
+        _file_digests[path] = (signature, digest)
+    return digest
+
+
+def cache_key(function_name, arguments, templates=(), databases=()):
+    """Build the content-addressed key of one simulation call."""
+    dependencies = {
+        template: file_digest(os.path.join(TEMPLATE_DIR, template))
+        for template in templates
+    }
+    databases = set(databases)
+    if arguments.get("model") in _MODEL_DATABASES:
+        databases.add(_MODEL_DATABASES[arguments["model"]])
+    for database in databases:
+        dependencies[database] = file_digest(database_path(database))
+    if arguments.get("model") == "carbonex":
+        dependencies["calibration"] = file_digest(CARBONEX_CALIBRATION)
+
+    payload = json.dumps(
+        {
+            "function": function_name,
+            "arguments": _normalize(arguments),
+            "dependencies": dependencies,
+        },
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class LRUCache:
+    """Thread-safe LRU of pickled results, evicting by total pickled size."""
+
+    def __init__(self, max_bytes=CARBONEX_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            blob = self._entries.get(key)
+            if blob is None:
+                return None
+            self._entries.move_to_end(key)
+            return blob
+
+    def put(self, key, blob):
+        if len(blob) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self._entries[key] = blob
+            self.size += len(blob)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DiskCache:
+    """Pickled results in a directory shared by every worker process."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.pkl")
+
+    def get(self, key):
+        try:
+            with open(self._path(key), "rb") as file:
+                return file.read()
+        except OSError:
+            return None
+
+    def put(self, key, blob):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename, so readers in other workers never see half a file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                file.write(blob)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+memory_cache = LRUCache()
+disk_cache = DiskCache(CARBONEX_CACHE_DIR) if CARBONEX_CACHE_DIR else None
+
+_stats = {"hits": 0, "misses": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(outcome):
+    with _stats_lock:
+        _stats[outcome] += 1
+
+
+def cache_stats():
+    """Return hit/miss counters and the size of the in-process tier."""
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+    stats["entries"] = len(memory_cache)
+    stats["bytes"] = memory_cache.size
+    return stats
+
+
+def cached_simulation(templates=(), databases=()):
+    """
+    Decorator caching a simulation function by the content of its inputs.
+
+    Parameters:
+        templates: PHREEQC template files (in phreeqc_templates) the function
+            renders; their contents are part of the key.
+        databases: Databases the function always uses, whatever its model
+            argument says; their contents are part of the key.
+
+    Results are stored pickled and unpickled on every hit, so callers may
+    modify what they get back without corrupting the cache.
+    """
+
+    def decorator(function):
+        signature = inspect.signature(function)
+        function_name = f"{function.__module__}.{function.__qualname__}"
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not CARBONEX_CACHE:
+                return function(*args, **kwargs)
+
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = cache_key(
+                function_name, dict(bound.arguments), templates, databases
+            )
+
+            blob = memory_cache.get(key)
+            if blob is None and disk_cache is not None:
+                blob = disk_cache.get(key)
+                if blob is not None:
+                    memory_cache.put(key, blob)
+            if blob is not None:
+                _count("hits")
+                return pickle.loads(blob)
+
+            _count("misses")
+            result = function(*args, **kwargs)
+
+            blob = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+            memory_cache.put(key, blob)
+            if disk_cache is not None:
+                disk_cache.put(key, blob)
+            return result
+
+        wrapper.uncached = function
+        return wrapper
+
+    return decorator
@@ -0,0 +1,52 @@
+"""
+Per-simulation scratch directories for PHREEQC input and output files.
+
+Every run gets its own freshly created directory, so concurrent requests in
+different gunicorn workers or threads never share a file name, and the
+directory is deleted as soon as the run is over.
+
+The directories are created under:
+    CARBONEX_SCRATCH_DIR   if set,
+    /dev/shm               when available (RAM-backed, no disk I/O),
+    tempfile.gettempdir()  otherwise.
+
+Set CARBONEX_KEEP_SCRATCH=1 to keep the directories (and the PHREEQC .pqo
+reports inside them) for debugging.
+"""
+
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+CARBONEX_SCRATCH_DIR = os.environ.get("CARBONEX_SCRATCH_DIR")
+CARBONEX_KEEP_SCRATCH = os.environ.get("CARBONEX_KEEP_SCRATCH", "0") == "1"
+
+_RAM_DIR = "/dev/shm"
+
+
+def scratch_root():
+    """Return the directory under which workspaces are created."""
+    if CARBONEX_SCRATCH_DIR:
+        os.makedirs(CARBONEX_SCRATCH_DIR, exist_ok=True)
+        return CARBONEX_SCRATCH_DIR
+    if os.path.isdir(_RAM_DIR) and os.access(_RAM_DIR, os.W_OK):
+        return _RAM_DIR
+    return tempfile.gettempdir()
+
+
+@contextmanager
+def simulation_workspace(prefix="phreeqc"):
+    """
+    Create an isolated scratch directory and remove it on exit.
+
+    Example:
+        with simulation_workspace("state_out") as work_dir:
+            ...
+    """
+    work_dir = tempfile.mkdtemp(prefix=f"carbonex_{prefix}_", dir=scratch_root())
+    try:
+        yield work_dir
+    finally:
+        if not CARBONEX_KEEP_SCRATCH:
+            shutil.rmtree(work_dir, ignore_errors=True)
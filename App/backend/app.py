@@ -1,4 +1,6 @@
-from flask import Flask, request, jsonify
+import json
+
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 
 from co2_brine_simulation import (
@@ -6,6 +8,12 @@ from co2_brine_simulation import (
     simulate_co2_brine_fixed,
     simulate_co2_brine_var_p,
     simulate_co2_brine_var_t,
+    solve_co2_brine_inverse,
+    compare_co2_brine_models,
+    simulate_co2_brine_batch,
+    simulate_co2_brine_state,
+    simulate_co2_brine_pt_map,
+    stream_co2_brine_var_t,
 )
 
 from co2_brine_rock_simulation import (
@@ -13,14 +21,44 @@ from co2_brine_rock_simulation import (
     simulate_co2_brine_rock_fixed,
     simulate_co2_brine_rock_var_p,
     simulate_co2_brine_rock_var_t,
+    simulate_co2_brine_rock_batch,
+    simulate_co2_brine_rock_state,
+    stream_co2_brine_rock_var_p,
+    stream_co2_brine_rock_var_t,
 )
 
+from result_cache import cache_stats
+from solubility_tables import table_info
+from carbonex import calibration_info
+from jobs import JobError, JobManager
+
 import requests
 import numpy as np
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
+# Simulations that POST /jobs can run, called with the job's arguments
+job_manager = JobManager(
+    {
+        "co2-brine/solution-properties": simulate_co2_brine_solution_properties,
+        "co2-brine/fixed": simulate_co2_brine_fixed,
+        "co2-brine/var-p": simulate_co2_brine_var_p,
+        "co2-brine/var-t": simulate_co2_brine_var_t,
+        "co2-brine/inverse": solve_co2_brine_inverse,
+        "co2-brine/compare": compare_co2_brine_models,
+        "co2-brine/pt-map": simulate_co2_brine_pt_map,
+        "co2-brine/batch": simulate_co2_brine_batch,
+        "co2-brine/state": simulate_co2_brine_state,
+        "co2-brine-rock/solution-properties": simulate_co2_brine_rock_solution_properties,
+        "co2-brine-rock/fixed": simulate_co2_brine_rock_fixed,
+        "co2-brine-rock/var-p": simulate_co2_brine_rock_var_p,
+        "co2-brine-rock/var-t": simulate_co2_brine_rock_var_t,
+        "co2-brine-rock/batch": simulate_co2_brine_rock_batch,
+        "co2-brine-rock/state": simulate_co2_brine_rock_state,
+    }
+)
+
 
 @app.route("/simulate/co2-brine/solution-properties", methods=["POST"])
 def simulate_co2_brine_solution_properties_endpoint():
@@ -43,7 +81,10 @@ def simulate_co2_brine_solution_properties_endpoint():
             partial_pressure_co2,
             fugacity_co2,
         ) = simulate_co2_brine_solution_properties(
-            temperature=temperature, pressure=pressure, species=concentrations
+            temperature=temperature,
+            pressure=pressure,
+            species=concentrations,
+            model=data.get("model", "phreeqc_pitzer"),
         )
 
         response_data = {
@@ -179,6 +220,139 @@ def simulate_co2_brine_fixed_endpoint():
         return jsonify({"status": "error", "message": str(e)})
 
 
+@app.route("/simulate/co2-brine/state", methods=["POST"])
+def simulate_co2_brine_state_endpoint():
+    try:
+        data = request.json
+
+        state = simulate_co2_brine_state(
+            temperature=data.get("temperature"),
+            pressure=data.get("pressure"),
+            species=data.get("concentrations"),
+            model=data.get("model", "phreeqc_phreeqc"),
+        )
+
+        return jsonify(
+            {
+                "status": "success",
+                "message": "State simulation completed successfully",
+                "data": {
+                    "activity_of_water": 0.0,  # Only returned by carbonex
+                    **state,
+                },
+            }
+        )
+
+    except Exception as e:
+        print(f"Error from state simulation: {e}")
+        return jsonify({"status": "error", "message": str(e)})
+
+
+@app.route("/simulate/co2-brine/batch", methods=["POST"])
+def simulate_co2_brine_batch_endpoint():
+    try:
+        data = request.json
+
+        result = simulate_co2_brine_batch(
+            states=data.get("states"),
+            model=data.get("model", "phreeqc_phreeqc"),
+            concentrations=data.get("concentrations"),
+        )
+
+        return jsonify(
+            {
+                "status": "success",
+                "message": "Batch simulation completed successfully",
+                "data": result,
+            }
+        )
+
+    except Exception as e:
+        print(f"Error from batch simulation: {e}")
+        return jsonify({"status": "error", "message": str(e)})
+
+
+@app.route("/simulate/co2-brine/compare", methods=["POST"])
+def compare_co2_brine_models_endpoint():
+    try:
+        data = request.json
+
+        result = compare_co2_brine_models(
+            sweep=data.get("sweep", "pressure"),
+            ion_moles=data.get("concentrations"),
+            models=data.get("models", []),
+            temperature=data.get("temperature"),
+            pressure=data.get("pressure"),
+            axis=data.get("axis"),
+        )
+
+        return jsonify(
+            {
+                "status": "success",
+                "message": "Model comparison completed successfully",
+                "data": result,
+            }
+        )
+
+    except Exception as e:
+        print(f"Error from model comparison: {e}")
+        return jsonify({"status": "error", "message": str(e)})
+
+
+@app.route("/simulate/co2-brine/pt-map", methods=["POST"])
+def simulate_co2_brine_pt_map_endpoint():
+    try:
+        data = request.json
+
+        result = simulate_co2_brine_pt_map(
+            ion_moles=data.get("concentrations"),
+            model=data.get("model", "duan_sun_2006"),
+            temperature_range=data.get("temperature_range"),
+            pressure_range=data.get("pressure_range"),
+            temperature_points=data.get("temperature_points", 50),
+            pressure_points=data.get("pressure_points", 50),
+        )
+
+        return jsonify(
+            {
+                "status": "success",
+                "message": "Pressure-temperature map completed successfully",
+                "data": result,
+            }
+        )
+
+    except Exception as e:
+        print(f"Error from pressure-temperature map: {e}")
+        return jsonify({"status": "error", "message": str(e)})
+
+
+@app.route("/simulate/co2-brine/inverse", methods=["POST"])
+def solve_co2_brine_inverse_endpoint():
+    try:
+        data = request.json
+
+        result = solve_co2_brine_inverse(
+            target=data.get("target"),
+            ion_moles=data.get("concentrations"),
+            solve_for=data.get("solve_for", "pressure"),
+            temperature=data.get("temperature"),
+            pressure=data.get("pressure"),
+            model=data.get("model", "duan_sun_2006"),
+        )
+
+        return jsonify(
+            {
+                "status": "success",
+                "message": "Inverse solubility calculation completed successfully",
+                "data": result,
+            }
+        )
+
+    except Exception as e:
+        print(f"Error from inverse solubility calculation: {e}")
+        return jsonify({"status": "error", "message": str(e)})
+
+
 @app.route("/simulate/co2-brine-rock/solution-properties", methods=["POST"])
 def simulate_co2_brine_rock_solution_properties_endpoint():
     try:
@@ -201,7 +375,8 @@ def simulate_co2_brine_rock_solution_properties_endpoint():
             temperature=temperature, 
             pressure=pressure, 
             species=concentrations,
-            minerals=mineralogy
+            minerals=mineralogy,
+            model=data.get("model", "phreeqc"),
         )
 
         response_data = {
@@ -265,6 +440,60 @@ def simulate_co2_rock_brine_single_state_endpoint():
         print(f"Error from brine-rock simulation: {e}")
         return jsonify({"status": "error", "message": str(e)})
 
+
+@app.route("/simulate/co2-brine-rock/state", methods=["POST"])
+def simulate_co2_brine_rock_state_endpoint():
+    try:
+        data = request.json
+
+        state = simulate_co2_brine_rock_state(
+            temperature=data.get("temperature"),
+            pressure=data.get("pressure"),
+            species=data.get("concentrations"),
+            mineralogy=data.get("mineralogy", {}),
+            model=data.get("model", "phreeqc"),
+        )
+
+        return jsonify(
+            {
+                "status": "success",
+                "message": "Brine-rock state simulation completed successfully",
+                "data": {
+                    **state,
+                    "activity_of_water": 0.0,  # Placeholder for water activity
+                },
+            }
+        )
+
+    except Exception as e:
+        print(f"Error from brine-rock state simulation: {e}")
+        return jsonify({"status": "error", "message": str(e)})
+
+
+@app.route("/simulate/co2-brine-rock/batch", methods=["POST"])
+def simulate_co2_brine_rock_batch_endpoint():
+    try:
+        data = request.json
+
+        result = simulate_co2_brine_rock_batch(
+            states=data.get("states"),
+            model=data.get("model", "phreeqc"),
+            concentrations=data.get("concentrations"),
+            mineralogy=data.get("mineralogy", {}),
+        )
+
+        return jsonify(
+            {
+                "status": "success",
+                "message": "Brine-rock batch simulation completed successfully",
+                "data": result,
+            }
+        )
+
+    except Exception as e:
+        print(f"Error from brine-rock batch simulation: {e}")
+        return jsonify({"status": "error", "message": str(e)})
+
 @app.route("/simulate/co2-brine-rock/var-p", methods=["POST"])
 def simulate_co2_brine_rock_var_p_endpoint():
     try:
@@ -343,6 +572,193 @@ def simulate_co2_brine_rock_var_t_endpoint():
         return jsonify({"status": "error", "message": str(e)})
 
 
+def _stream_event(event, data, sse):
+    if sse:
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    return json.dumps({"event": event, "data": data}) + "\n"
+
+
+def _stream_points(points, name):
+    """
+    Stream the (x, dissolved CO2) points of a sweep as they are computed.
+
+    The body is NDJSON, one {"event": ..., "data": ...} object per line, or
+    Server-Sent Events with ?format=sse.  Every point is a "point" event
+    holding [x, CO2], and the stream ends with a "done" event holding the
+    number of points, or with an "error" event.
+    """
+    sse = request.args.get("format") == "sse"
+
+    def generate():
+        count = 0
+        try:
+            for point in points:
+                count += 1
+                yield _stream_event("point", list(point), sse)
+            yield _stream_event("done", {"points": count}, sse)
+        except Exception as e:
+            print(f"Error from {name} stream: {e}")
+            yield _stream_event("error", {"message": str(e)}, sse)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream" if sse else "application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route("/simulate/co2-brine/var-t/stream", methods=["POST"])
+def stream_co2_brine_var_t_endpoint():
+    data = request.json
+
+    return _stream_points(
+        stream_co2_brine_var_t(
+            pressure=data.get("pressure"),
+            ion_moles=data.get("concentrations"),
+            model=data.get("model"),
+        ),
+        "varying temperature",
+    )
+
+
+@app.route("/simulate/co2-brine-rock/var-p/stream", methods=["POST"])
+def stream_co2_brine_rock_var_p_endpoint():
+    data = request.json
+
+    return _stream_points(
+        stream_co2_brine_rock_var_p(
+            temperature=data.get("temperature"),
+            ion_moles=data.get("concentrations"),
+            mineralogy=data.get("mineralogy", {}),
+            model=data.get("model", "phreeqc"),
+        ),
+        "mineralization varying pressure",
+    )
+
+
+@app.route("/simulate/co2-brine-rock/var-t/stream", methods=["POST"])
+def stream_co2_brine_rock_var_t_endpoint():
+    data = request.json
+
+    return _stream_points(
+        stream_co2_brine_rock_var_t(
+            pressure=data.get("pressure"),
+            ion_moles=data.get("concentrations"),
+            mineralogy=data.get("mineralogy", {}),
+            model=data.get("model", "phreeqc"),
+        ),
+        "mineralization varying temperature",
+    )
+
+
+@app.route("/jobs", methods=["POST"])
+def submit_job_endpoint():
+    try:
+        data = request.json
+
+        job_id = job_manager.submit(data.get("simulation"), data.get("arguments"))
+
+        return jsonify(
+            {
+                "status": "success",
+                "message": "Job submitted successfully",
+                "data": {"job_id": job_id},
+            }
+        )
+
+    except JobError as e:
+        return jsonify({"status": "error", "message": str(e)})
+    except Exception as e:
+        print(f"Error submitting job: {e}")
+        return jsonify({"status": "error", "message": str(e)})
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job_endpoint(job_id):
+    try:
+        job = job_manager.get(job_id)
+        if job is None:
+            return jsonify({"status": "error", "message": f"Unknown job {job_id}"})
+
+        return jsonify(
+            {
+                "status": "success",
+                "message": "Job retrieved successfully",
+                "data": job,
+            }
+        )
+
+    except Exception as e:
+        print(f"Error reading job {job_id}: {e}")
+        return jsonify({"status": "error", "message": str(e)})
+
+
+@app.route("/jobs/<job_id>", methods=["DELETE"])
+def cancel_job_endpoint(job_id):
+    try:
+        if not job_manager.cancel(job_id):
+            return jsonify(
+                {"status": "error", "message": f"Job {job_id} is not queued or running"}
+            )
+
+        return jsonify(
+            {
+                "status": "success",
+                "message": "Job cancellation requested",
+                "data": {"job_id": job_id},
+            }
+        )
+
+    except Exception as e:
+        print(f"Error cancelling job {job_id}: {e}")
+        return jsonify({"status": "error", "message": str(e)})
+
+
+@app.route("/utilities/cache-stats", methods=["GET"])
+def get_cache_stats():
+    try:
+        return jsonify(
+            {
+                "status": "success",
+                "message": "Cache statistics retrieved successfully",
+                "data": cache_stats(),
+            }
+        )
+    except Exception as e:
+        print(f"Error reading cache statistics: {e}")
+        return jsonify({"status": "error", "message": str(e)})
+
+
+@app.route("/utilities/solubility-tables", methods=["GET"])
+def get_solubility_tables():
+    try:
+        return jsonify(
+            {
+                "status": "success",
+                "message": "Solubility tables retrieved successfully",
+                "data": table_info(),
+            }
+        )
+    except Exception as e:
+        print(f"Error reading solubility tables: {e}")
+        return jsonify({"status": "error", "message": str(e)})
+
+
+@app.route("/utilities/carbonex", methods=["GET"])
+def get_carbonex_calibration():
+    try:
+        return jsonify(
+            {
+                "status": "success",
+                "message": "Carbonex calibration retrieved successfully",
+                "data": calibration_info(),
+            }
+        )
+    except Exception as e:
+        print(f"Error reading carbonex calibration: {e}")
+        return jsonify({"status": "error", "message": str(e)})
+
+
 @app.route("/utilities/AI-insights", methods=["POST"])
 def get_AI_insights():
     try:
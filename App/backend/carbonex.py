@@ -0,0 +1,550 @@
+"""
+Carbonex: fast CO2 solubility and carbonate speciation in pure NumPy.
+
+Solubility
+    Duan and Sun (2006) for Na/K/Ca/Mg/Cl/SO4 brines
+    (DuanSun2006.calculate_CO2_solubility_array), times an optional
+    calibration factor towards PHREEQC with pitzer.dat.  The factor is
+    tabulated offline as phreeqc_pitzer / Duan-Sun on the (temperature,
+    pressure, NaCl molality) grid of solubility_tables.py and looked up at
+    the ionic strength of the brine, clipped to the grid.
+
+    No calibration file ships with the app.  Until one is built (see Build
+    below) the factor is 1: carbonex is plain Duan and Sun plus the
+    speciation below, its error against phreeqc_pitzer has not been
+    measured, and calibration_info() reports it as not calibrated.
+
+Speciation
+    pH, CO2(aq), HCO3-, CO3-2 and OH- follow from the dissolved CO2 and the
+    charge balance of the brine (its HCO3- and CO3-2 carry the alkalinity),
+    with the carbonic acid and water constants of pitzer_mod.dat (analytic
+    log K, no pressure correction), B-dot activity coefficients for the ions
+    and the Duan-Sun activity coefficient for CO2(aq).
+
+Accuracy
+    Building the calibration also runs phreeqc_pitzer at random mixed
+    Na/K/Ca/Mg/Cl/SO4 brines and states that are not on the grid, and records
+    the maximum and mean absolute and relative error of the dissolved CO2 of
+    carbonex and of uncalibrated Duan-Sun against it, and the maximum and
+    mean absolute error of the pH of speciate().  The build prints them and
+    calibration_info() (exposed through GET /utilities/carbonex) reports
+    them for the calibration in use.
+
+Build (needs PHREEQC, takes a while; uses the parallel workers):
+    python carbonex.py
+    python carbonex.py --database pitzer_mod --validation-points 1000
+
+Configuration (environment variables):
+    CARBONEX_CALIBRATION   calibration file (default carbonex.npz in
+                           CARBONEX_TABLE_DIR)
+"""
+
+import argparse
+import os
+import threading
+import time
+
+import numpy as np
+from scipy.interpolate import RegularGridInterpolator
+
+from DuanSun2006 import KERNEL_IONS, shared_model
+from solubility_tables import (
+    CARBONEX_TABLE_DIR,
+    NACL_AXIS,
+    PRESSURE_AXIS,
+    TEMPERATURE_AXIS,
+    _solve_states,
+)
+
+CARBONEX_CALIBRATION = os.environ.get(
+    "CARBONEX_CALIBRATION", os.path.join(CARBONEX_TABLE_DIR, "carbonex.npz")
+)
+
+# Charges of the brine ions; HCO3- and CO3-2 only count as alkalinity
+CHARGES = {
+    "Na+": 1,
+    "K+": 1,
+    "Ca+2": 2,
+    "Mg+2": 2,
+    "Cl-": -1,
+    "SO4-2": -2,
+    "HCO3-": -1,
+    "CO3-2": -2,
+}
+
+# log K = A1 + A2 T + A3 / T + A4 log10(T) + A5 / T^2 (pitzer_mod.dat)
+_LOG_K_HCO3 = (107.8975, 0.03252849, -5151.79, -38.92561, 563713.9)  # CO3-2 + H+ = HCO3-
+_LOG_K_CO2 = (464.1965, 0.09344813, -26986.16, -165.75951, 2248628.9)  # CO3-2 + 2 H+ = CO2 + H2O
+_LOG_K_W = (293.29227, 0.1360833, -10576.913, -123.73158, 0.0)  # H2O = OH- + H+
+_LOG_K_W_T2 = -6.996455e-5
+
+# Debye-Hueckel A (kg^0.5 mol^-0.5) along the saturation curve (Helgeson
+# and Kirkham, 1974) and the NaCl b-dot of Helgeson (1969)
+_DEBYE_HUCKEL_T = np.array([273.15, 298.15, 323.15, 348.15, 373.15, 423.15, 473.15, 523.15, 573.15])
+_DEBYE_HUCKEL_A = np.array([0.4913, 0.5092, 0.5336, 0.5639, 0.5998, 0.6898, 0.7994, 0.9593, 1.2180])
+_B_DOT = 0.041
+
+WATER_MOLAR_MASS = 0.018015
+
+
+def _log_k(coefficients, T):
+    A1, A2, A3, A4, A5 = coefficients
+    return A1 + A2 * T + A3 / T + A4 * np.log10(T) + A5 / T**2
+
+
+def carbonic_acid_constants(T):
+    """
+    Return log10 of K1 (CO2 + H2O = HCO3- + H+), K2 (HCO3- = CO3-2 + H+) and
+    Kw (H2O = OH- + H+) at temperature(s) T in Kelvin.
+    """
+    T = np.asarray(T, dtype=np.float64)
+    log_k_hco3 = _log_k(_LOG_K_HCO3, T)
+    log_k1 = log_k_hco3 - _log_k(_LOG_K_CO2, T)
+    log_k2 = -log_k_hco3
+    log_kw = _log_k(_LOG_K_W, T) + _LOG_K_W_T2 * T**2
+    return log_k1, log_k2, log_kw
+
+
+def _molality(molalities, ion):
+    value = molalities.get(ion)
+    return np.asarray(0.0 if value is None else value, dtype=np.float64)
+
+
+def ionic_strength(molalities):
+    """Ionic strength (mol/kg) of a brine; molalities may be arrays."""
+    return 0.5 * sum(
+        charge**2 * _molality(molalities, ion) for ion, charge in CHARGES.items()
+    )
+
+
+class Calibration:
+    """Factor phreeqc_pitzer / Duan-Sun on a (temperature, pressure, NaCl) grid."""
+
+    def __init__(self, temperature, pressure, nacl, factor, metadata=None):
+        self.temperature = np.asarray(temperature, dtype=np.float64)
+        self.pressure = np.asarray(pressure, dtype=np.float64)
+        self.nacl = np.asarray(nacl, dtype=np.float64)
+        self.factor = np.asarray(factor, dtype=np.float64)
+        self.metadata = metadata or {}
+        self._interpolator = RegularGridInterpolator(
+            (self.temperature, self.pressure, self.nacl),
+            # Cells PHREEQC could not solve keep the Duan-Sun value
+            np.where(np.isfinite(self.factor), self.factor, 1.0),
+            method="linear",
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            metadata = {
+                key: data[key].item()
+                for key in data.files
+                if key not in ("temperature", "pressure", "nacl", "factor")
+            }
+            return cls(
+                data["temperature"],
+                data["pressure"],
+                data["nacl"],
+                data["factor"],
+                metadata,
+            )
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        np.savez_compressed(
+            path,
+            temperature=self.temperature,
+            pressure=self.pressure,
+            nacl=self.nacl,
+            factor=self.factor,
+            **{key: np.asarray(value) for key, value in self.metadata.items()},
+        )
+
+    def __call__(self, temperature, pressure, nacl):
+        """Interpolate the factor; arguments broadcast and are clipped to the grid."""
+        temperature, pressure, nacl = np.broadcast_arrays(
+            np.clip(temperature, self.temperature[0], self.temperature[-1]),
+            np.clip(pressure, self.pressure[0], self.pressure[-1]),
+            np.clip(nacl, self.nacl[0], self.nacl[-1]),
+        )
+        points = np.stack([temperature, pressure, nacl], axis=-1).reshape(-1, 3)
+        return self._interpolator(points).reshape(temperature.shape)
+
+
+_calibration = None
+_calibration_lock = threading.Lock()
+
+
+def get_calibration():
+    """Return the loaded calibration, or None when it was not built."""
+    global _calibration
+    try:
+        mtime = os.stat(CARBONEX_CALIBRATION).st_mtime_ns
+    except OSError:
+        return None
+
+    with _calibration_lock:
+        if _calibration is None or _calibration[0] != mtime:
+            _calibration = (mtime, Calibration.load(CARBONEX_CALIBRATION))
+        return _calibration[1]
+
+
+def calibration_info():
+    """Describe the calibration in use and its build-time error."""
+    calibration = get_calibration()
+    if calibration is None:
+        return {"calibrated": False}
+    info = {
+        "calibrated": True,
+        "temperature_range": [calibration.temperature[0], calibration.temperature[-1]],
+        "pressure_range": [calibration.pressure[0], calibration.pressure[-1]],
+        "nacl_range": [calibration.nacl[0], calibration.nacl[-1]],
+        "shape": list(calibration.factor.shape),
+        "failed_points": int(np.isnan(calibration.factor).sum()),
+        **calibration.metadata,
+    }
+    for key in ("temperature_range", "pressure_range", "nacl_range"):
+        info[key] = [float(value) for value in info[key]]
+    return info
+
+
+def solubility(P, T, molalities=None):
+    """
+    Calculate CO2 solubility (mol/kg water) with the carbonex model.
+
+    Parameters:
+        P: Pressure(s) in MPa
+        T: Temperature(s) in Kelvin
+        molalities: Dictionary of ion molalities (keys like 'Na+', 'Cl-');
+            each value may be a scalar or an array
+
+    P, T and the molalities broadcast together, as in
+    DuanSun2006.calculate_CO2_solubility_array.
+
+    Returns:
+        ndarray: CO2 solubility, NaN outside the Duan-Sun EOS ranges
+    """
+    molalities = {
+        ion: value for ion, value in (molalities or {}).items() if ion in KERNEL_IONS
+    }
+    base = shared_model.calculate_CO2_solubility_array(P, T, molalities, model="DuanSun")
+    calibration = get_calibration()
+    if calibration is None:
+        return base
+    return base * calibration(T, P, ionic_strength(molalities))
+
+
+def _activity_coefficients(P, T, molalities):
+    """
+    Ionic strength, activity of water, B-dot activity coefficients of the
+    singly and doubly charged ions and Duan-Sun coefficient of CO2(aq).
+    """
+    strength = ionic_strength(molalities)
+    total = sum(_molality(molalities, ion) for ion in CHARGES)
+    activity_of_water = np.exp(-WATER_MOLAR_MASS * total)
+
+    A = np.interp(T, _DEBYE_HUCKEL_T, _DEBYE_HUCKEL_A)
+    sqrt_I = np.sqrt(strength)
+    log_gamma_1 = -A * sqrt_I / (1 + sqrt_I) + _B_DOT * strength
+    gamma_1 = 10**log_gamma_1
+    gamma_2 = 10 ** (4 * log_gamma_1 - 3 * _B_DOT * strength)
+    gamma_co2 = np.exp(
+        -shared_model.calculate_log_activity(
+            P,
+            T,
+            {ion: _molality(molalities, ion) for ion in KERNEL_IONS},
+            "DuanSun",
+        )
+    )
+    return strength, activity_of_water, gamma_1, gamma_2, gamma_co2
+
+
+def speciate(P, T, molalities=None, dissolved_co2=None):
+    """
+    Speciate the dissolved inorganic carbon of a CO2-saturated brine.
+
+    Parameters:
+        P: Pressure(s) in MPa
+        T: Temperature(s) in Kelvin
+        molalities: Dictionary of ion molalities, including the HCO3- and
+            CO3-2 of the brine before CO2 injection
+        dissolved_co2: Dissolved CO2 (mol/kg); defaults to solubility()
+
+    Returns:
+        dict of arrays: 'pH', molalities of 'CO2', 'HCO3-', 'CO3-2' and
+        'OH-', 'ionic_strength' and 'activity_of_water'; NaN where the
+        dissolved CO2 is NaN
+    """
+    molalities = molalities or {}
+    T = np.asarray(T, dtype=np.float64)
+    P = np.asarray(P, dtype=np.float64)
+    if dissolved_co2 is None:
+        dissolved_co2 = solubility(P, T, molalities)
+
+    # Total inorganic carbon, and the charge of everything else
+    carbon = np.asarray(dissolved_co2, dtype=np.float64) + _molality(
+        molalities, "HCO3-"
+    ) + _molality(molalities, "CO3-2")
+    charge = sum(
+        CHARGES[ion] * _molality(molalities, ion)
+        for ion in CHARGES
+        if ion not in ("HCO3-", "CO3-2")
+    )
+
+    strength, activity_of_water, gamma_1, gamma_2, gamma_co2 = (
+        _activity_coefficients(P, T, molalities)
+    )
+
+    log_k1, log_k2, log_kw = carbonic_acid_constants(T)
+    k1 = 10**log_k1 * activity_of_water * gamma_co2 / gamma_1
+    k2 = 10**log_k2 * gamma_1 / gamma_2
+    kw = 10**log_kw * activity_of_water / gamma_1
+
+    def species(pH):
+        h = 10 ** (-pH)
+        co2 = carbon / (1 + k1 / h + k1 * k2 / h**2)
+        hco3 = co2 * k1 / h
+        co3 = hco3 * k2 / h
+        return co2, hco3, co3, kw / h, h / gamma_1
+
+    # The charge balance falls monotonically with pH: bisect on it
+    low, high = np.broadcast_arrays(
+        np.zeros(np.broadcast(carbon, T, charge).shape), 14.0
+    )
+    low, high = low.copy(), high.copy()
+    for _ in range(50):
+        middle = (low + high) / 2
+        co2, hco3, co3, oh, h = species(middle)
+        excess = charge + h - hco3 - 2 * co3 - oh
+        low = np.where(excess > 0, middle, low)
+        high = np.where(excess > 0, high, middle)
+    pH = (low + high) / 2
+    co2, hco3, co3, oh, _ = species(pH)
+    pH = np.where(np.isfinite(carbon), pH, np.nan)
+
+    return {
+        "pH": pH,
+        "CO2": co2,
+        "HCO3-": hco3,
+        "CO3-2": co3,
+        "OH-": oh,
+        "ionic_strength": np.broadcast_to(strength, pH.shape),
+        "activity_of_water": np.broadcast_to(activity_of_water, pH.shape),
+    }
+
+
+# Ions reported by solution_properties(), as in the PHREEQC state runs
+SOLUTION_SPECIES = ("Na+", "Cl-", "K+", "Mg+2", "Ca+2", "SO4-2", "HCO3-", "CO3-2")
+
+
+def solution_properties(P, T, molalities=None):
+    """
+    Dissolved CO2 and solution properties of a CO2-saturated brine at one
+    state, without PHREEQC.
+
+    Parameters:
+        P: Pressure in MPa
+        T: Temperature in Kelvin
+        molalities: Dictionary of ion molalities
+
+    Returns:
+        dict: 'trapped_co2' (mol/kg, 0 outside the EOS ranges), 'pH',
+        'ionic_strength' and 'activity_of_water' from speciate(),
+        'species_data' (the 'activity' of each of SOLUTION_SPECIES, with
+        HCO3- and CO3-2 speciated), 'partial_pressure_co2' (atm) and
+        'fugacity_co2' (the fugacity coefficient, None outside the EOS
+        ranges) of the gas, and
+        'density', 'osmotic_coefficient' and the species 'molar_volume',
+        which carbonex does not model, as None
+    """
+    molalities = molalities or {}
+    P = float(P)
+    T = float(T)
+    trapped_co2 = float(solubility(P, T, molalities))
+    if not np.isfinite(trapped_co2):
+        trapped_co2 = 0.0
+
+    speciation = speciate(P, T, molalities, dissolved_co2=trapped_co2)
+    _, _, gamma_1, gamma_2, _ = _activity_coefficients(P, T, molalities)
+    molality = {ion: float(_molality(molalities, ion)) for ion in SOLUTION_SPECIES}
+    molality["HCO3-"] = float(speciation["HCO3-"])
+    molality["CO3-2"] = float(speciation["CO3-2"])
+
+    species_data = []
+    for ion in SOLUTION_SPECIES:
+        gamma = gamma_1 if abs(CHARGES[ion]) == 1 else gamma_2
+        species_data.append(
+            {
+                "species": ion,
+                "activity": round(float(molality[ion] * gamma), 4),
+                "molar_volume": None,
+            }
+        )
+
+    fugacity_co2 = float(shared_model.co2_fugacity_coefficient_array(P, T)[0])
+
+    pressure_atm = P * 9.86923
+    return {
+        "trapped_co2": trapped_co2,
+        "species_data": species_data,
+        "density": None,
+        "ionic_strength": float(speciation["ionic_strength"]),
+        "pH": float(speciation["pH"]),
+        "activity_of_water": float(speciation["activity_of_water"]),
+        "osmotic_coefficient": None,
+        "partial_pressure_co2": float(
+            pressure_atm * shared_model.calculate_CO2_vap_mol_frac(P, T)
+        ),
+        "fugacity_co2": fugacity_co2 if np.isfinite(fugacity_co2) else None,
+    }
+
+
+def _random_brines(count, rng):
+    """Random charge-balanced Na/K/Ca/Mg/Cl/SO4 brines up to ~6 mol/kg NaCl."""
+    brines = []
+    for _ in range(count):
+        brine = {
+            "Na+": rng.uniform(0, NACL_AXIS[-1]),
+            "K+": rng.uniform(0, 0.5),
+            "Ca+2": rng.uniform(0, 0.5),
+            "Mg+2": rng.uniform(0, 0.3),
+            "SO4-2": rng.uniform(0, 0.1),
+        }
+        brine["Cl-"] = (
+            brine["Na+"] + brine["K+"] + 2 * brine["Ca+2"] + 2 * brine["Mg+2"]
+            - 2 * brine["SO4-2"]
+        )
+        brines.append(brine)
+    return brines
+
+
+def _errors(values, reference, prefix):
+    valid = np.isfinite(values) & np.isfinite(reference)
+    abs_error = np.abs(values[valid] - reference[valid])
+    rel_error = abs_error / np.maximum(np.abs(reference[valid]), 1e-12)
+    empty = not abs_error.size
+    return {
+        f"{prefix}max_abs_error": float("nan") if empty else float(abs_error.max()),
+        f"{prefix}mean_abs_error": float("nan") if empty else float(abs_error.mean()),
+        f"{prefix}max_rel_error": float("nan") if empty else float(rel_error.max()),
+        f"{prefix}mean_rel_error": float("nan") if empty else float(rel_error.mean()),
+    }
+
+
+def _phreeqc_state(temperature, pressure, brine, database):
+    """Dissolved CO2 and pH of one state from a single PHREEQC run."""
+    from co2_brine_simulation import simulate_co2_brine_state
+
+    state = simulate_co2_brine_state.uncached(
+        temperature, pressure, brine, f"phreeqc_{database}"
+    )
+    return state["trapped_co2"], state["pH"]
+
+
+def build_calibration(
+    database="pitzer",
+    temperature=TEMPERATURE_AXIS,
+    pressure=PRESSURE_AXIS,
+    nacl=NACL_AXIS,
+    validation_points=500,
+    seed=0,
+):
+    """Run PHREEQC over the grid, fit the factor and measure the error on mixed brines."""
+    from parallel import parallel_starmap
+
+    grid = np.stack(
+        np.meshgrid(temperature, pressure, nacl, indexing="ij"), axis=-1
+    ).reshape(-1, 3)
+    started = time.time()
+    phreeqc = _solve_states([tuple(point) for point in grid], database)
+    duan_sun = shared_model.calculate_CO2_solubility_array(
+        grid[:, 1], grid[:, 0], {"Na+": grid[:, 2], "Cl-": grid[:, 2]}
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        factor = np.where(duan_sun > 0, phreeqc / duan_sun, np.nan)
+    calibration = Calibration(
+        temperature,
+        pressure,
+        nacl,
+        factor.reshape(len(temperature), len(pressure), len(nacl)),
+    )
+
+    rng = np.random.default_rng(seed)
+    brines = _random_brines(validation_points, rng)
+    temperatures = rng.uniform(temperature[0], temperature[-1], validation_points)
+    pressures = rng.uniform(pressure[0], pressure[-1], validation_points)
+    direct = parallel_starmap(
+        _phreeqc_state,
+        [
+            (float(T), float(P), brine, database)
+            for T, P, brine in zip(temperatures, pressures, brines)
+        ],
+    )
+    direct = np.array(
+        [
+            (np.nan, np.nan) if isinstance(value, Exception) else value
+            for value in direct
+        ],
+        dtype=np.float64,
+    ).reshape(-1, 2)
+    direct_pH = direct[:, 1]
+    direct = direct[:, 0]
+
+    stacked = {ion: np.array([brine[ion] for brine in brines]) for ion in brines[0]}
+    uncalibrated = shared_model.calculate_CO2_solubility_array(
+        pressures, temperatures, stacked
+    )
+    calibrated = uncalibrated * calibration(
+        temperatures, pressures, ionic_strength(stacked)
+    )
+    pH = speciate(pressures, temperatures, stacked, dissolved_co2=calibrated)["pH"]
+    pH_valid = np.isfinite(pH) & np.isfinite(direct_pH)
+    pH_error = np.abs(pH[pH_valid] - direct_pH[pH_valid])
+
+    calibration.metadata = {
+        "database": database,
+        "built_at": time.time(),
+        "build_seconds": time.time() - started,
+        "validation_points": int(np.isfinite(direct).sum()),
+        **_errors(calibrated, direct, ""),
+        **_errors(uncalibrated, direct, "duan_sun_"),
+        "max_ph_error": float(pH_error.max()) if pH_error.size else float("nan"),
+        "mean_ph_error": float(pH_error.mean()) if pH_error.size else float("nan"),
+    }
+    return calibration
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Calibrate the carbonex model against PHREEQC."
+    )
+    parser.add_argument(
+        "--database", choices=("pitzer", "pitzer_mod", "phreeqc"), default="pitzer"
+    )
+    parser.add_argument("--validation-points", type=int, default=500)
+    parser.add_argument("--output", default=CARBONEX_CALIBRATION)
+    args = parser.parse_args()
+
+    calibration = build_calibration(
+        args.database, validation_points=args.validation_points
+    )
+    calibration.save(args.output)
+    metadata = calibration.metadata
+    print(
+        f"{args.output}: {int(np.isnan(calibration.factor).sum())} failed points, "
+        f"max error {metadata['max_abs_error']:.3g} mol/kg "
+        f"({metadata['max_rel_error']:.2%}), "
+        f"mean error {metadata['mean_abs_error']:.3g} mol/kg "
+        f"({metadata['mean_rel_error']:.2%}) "
+        f"over {metadata['validation_points']} mixed brines; "
+        f"uncalibrated Duan-Sun {metadata['duan_sun_max_rel_error']:.2%} max, "
+        f"{metadata['duan_sun_mean_rel_error']:.2%} mean; "
+        f"pH error {metadata['max_ph_error']:.2f} max, "
+        f"{metadata['mean_ph_error']:.2f} mean, "
+        f"{metadata['build_seconds']:.0f} s",
+        flush=True,
+    )
+
+
+if __name__ == "__main__":
+    main()
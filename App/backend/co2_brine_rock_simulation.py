@@ -1,178 +1,42 @@
-import os
-import math
-import pandas as pd
-import subprocess
-import csv
 import sys
-import tempfile
 
-def simulate_co2_brine_rock_solution_properties(temperature, pressure, species, minerals):
+from parallel import (
+    parallel_as_completed,
+    parallel_starmap,
+    parallel_workers,
+    split_evenly,
+)
+from phreeqc_engine import run_phreeqc
+from phreeqc_templates import MINERAL_NAMES, SimulationParameters, render
+from result_cache import cached_simulation, mark_incomplete
+from selected_output import solution_properties
+from state_batch import columns, parse_states, run_state_batches
+
+
+def simulate_co2_brine_rock_solution_properties(
+    temperature, pressure, species, minerals, model="phreeqc"
+):
     """
-    Run PHREEQC simulation for brine-rock interaction solution properties only.
-    Similar to simulate_co2_brine_solution_properties but includes mineral interactions.
-    
-    Parameters:
-        temperature: Temperature in Kelvin
-        pressure: Pressure in MPa
-        species: Dictionary of ion molalities
-        minerals: Dictionary of mineral names and initial moles
-        
+    Solution properties of the CO2-saturated brine in contact with the rock
+    at one state.
+
     Returns:
-        tuple: (species_data, density, ionic_strength, pH, osmotic_coefficient, partial_pressure_co2, fugacity_co2)
+        tuple: (species_data, density, ionic_strength, pH,
+        osmotic_coefficient, partial_pressure_co2, fugacity_co2) from
+        simulate_co2_brine_rock_state
     """
-    temp_files_path = tempfile.gettempdir()
-    Na = species.get("Na+", 0)
-    Cl = species.get("Cl-", 0)
-    Mg = species.get("Mg+2", 0)
-    Ca = species.get("Ca+2", 0)
-    K = species.get("K+", 0)
-    SO4 = species.get("SO4-2", 0)
-    HCO3 = species.get("HCO3-", 0)
-    CO3 = species.get("CO3-2", 0)
-
-    pressure_atm = pressure * 9.86923
-    temperature_c = temperature - 273.15
-    p_co2 = pressure_atm * 0.95
-    p_h2o = pressure_atm * 0.05
-
-    state_out_file = os.path.join(temp_files_path, "co2_brine_rock_solution_properties.tsv")
-
-    template_path = os.path.join("phreeqc_programs", "co2_brine_rock_template.pqi")
-    with open(template_path, "r") as template_file:
-        phreeqc_code = template_file.read()
-
-    # Build mineral phases section based on mineralogy dict
-    mineral_phases = []
-    mineral_names = {
-        "Quartz": "Quartz",
-        "Calcite": "Calcite",
-        "Siderite": "Siderite",
-        "Dolomite": "Dolomite",
-        "Illite": "Illite",
-        "Kaolinite": "Kaolinite",
-        "K-feldspar": "K-feldspar",
-        "Albite": "Albite",
-        "Chlorite": "Chlorite(14A)",
-        "Pyrite": "Pyrite",
-    }
-
-    for mineral_key, phreeqc_name in mineral_names.items():
-        if mineral_key in minerals and minerals[mineral_key] >= 0:
-            # Include mineral with 0 saturation index and specified initial moles
-            mineral_phases.append(
-                f"    {phreeqc_name}        0   {minerals[mineral_key]}"
-            )
-        else:
-            # Comment out or skip minerals with negative values
-            mineral_phases.append(f"    #{phreeqc_name}       0   0")
-
-    mineral_phases_str = "\n".join(mineral_phases)
-
-    phreeqc_code = phreeqc_code.replace(
-        "__DATABASE__", "/usr/local/share/doc/phreeqc/database/phreeqc.dat"
-    )
-    phreeqc_code = phreeqc_code.replace("__TEMPERATURE__", str(temperature_c))
-    phreeqc_code = phreeqc_code.replace("__NA__", str(Na))
-    phreeqc_code = phreeqc_code.replace("__CL__", str(Cl))
-    phreeqc_code = phreeqc_code.replace("__CA__", str(Ca))
-    phreeqc_code = phreeqc_code.replace("__MG__", str(Mg))
-    phreeqc_code = phreeqc_code.replace("__K__", str(K))
-    phreeqc_code = phreeqc_code.replace("__SO4__", str(SO4))
-    phreeqc_code = phreeqc_code.replace("__HCO3__", str(HCO3))
-    phreeqc_code = phreeqc_code.replace("__PRESSURE_ATM__", str(pressure_atm))
-    phreeqc_code = phreeqc_code.replace("__P_CO2__", str(p_co2))
-    phreeqc_code = phreeqc_code.replace("__P_H2O__", str(p_h2o))
-    phreeqc_code = phreeqc_code.replace("__MINERAL_PHASES__", mineral_phases_str)
-    phreeqc_code = phreeqc_code.replace("co2_brine_rock.tsv", state_out_file)
-
-    filename = os.path.join(temp_files_path, "co2_brine_rock_solution_properties.pqi")
-
-    with open(filename, "w") as pqi:
-        pqi.write(phreeqc_code)
-
-    subprocess.run(
-        ["phreeqc", filename, filename.replace(".pqi", ".pqo")],
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.STDOUT,
-    )
-
-    # Make sure the file exists before trying to read it
-    if not os.path.exists(state_out_file):
-        raise FileNotFoundError(f"Output file not found: {state_out_file}")
-
-    results = {}
-    try:
-        with open(state_out_file, mode="r") as file:
-            reader = csv.DictReader(file, delimiter="\t")
-            # Clean column names by stripping spaces
-            if reader.fieldnames:
-                fieldnames = [field.strip() for field in reader.fieldnames]
-                reader = csv.DictReader(file, fieldnames=fieldnames, delimiter="\t")
-                next(reader)  # Skip header row since we're providing our own fieldnames
-
-                # Get the last row (final simulation state)
-                for row in reader:
-                    results = row  # Will keep the last row
-    except Exception as e:
-        print(f"Error reading {state_out_file}: {str(e)}", flush=True)
-        raise
-
-    species_data = []
-
-    for ion in ["Na+", "Cl-", "K+", "Mg+2", "Ca+2", "SO4-2", "HCO3-", "CO3-2"]:
-        activity_key = f"la_{ion}"
-        molar_volume_key = f"VM_{ion}"
-
-        # Handle potential missing keys safely
-        try:
-            activity_value = math.exp(float(results.get(activity_key, 0)))
-            molar_volume_value = float(results.get(molar_volume_key, 0))
-        except (ValueError, TypeError):
-            activity_value = 0
-            molar_volume_value = 0
-
-        threshold = (
-            -500
-        )  # even if the species is non-existent, it will have an activity of -1000, this is to avoid including non-existing species
-        species_data.append(
-            {
-                "species": ion,
-                "activity": round(
-                    activity_value if activity_value >= threshold else 0, 4
-                ),
-                "molar_volume": round(
-                    molar_volume_value if molar_volume_value >= threshold else 0, 4
-                ),
-            }
-        )
-
-    # Handle potential missing keys safely
-    try:
-        density = float(results.get("SOL_DENSITY", 0))
-        ionic_strength = float(results.get("mu", 0))
-        pH = float(results.get("pH", 7.0))
-        osmotic_coefficient = float(results.get("OSMOTIC", 0))
-        partial_pressure_co2 = float(results.get("PR_CO2", 0))
-        fugacity_co2 = float(results.get("PHI_CO2", 0))
-
-    except (ValueError, TypeError):
-        density = 0
-        ionic_strength = 0
-        pH = 7.0
-        osmotic_coefficient = 0
-        partial_pressure_co2 = 0
-        fugacity_co2 = 0
-
+    state = simulate_co2_brine_rock_state(temperature, pressure, species, minerals, model)
     return (
-        species_data,
-        density,
-        ionic_strength,
-        pH,
-        osmotic_coefficient,
-        partial_pressure_co2,
-        fugacity_co2,
+        state["species_data"],
+        state["density"],
+        state["ionic_strength"],
+        state["pH"],
+        state["osmotic_coefficient"],
+        state["partial_pressure_co2"],
+        state["fugacity_co2"],
     )
 
+
 def _run_PHREEQC_brine_rock_varying_pressure(
     temperature, ion_moles, mineralogy, database="phreeqc"
 ):
@@ -188,128 +52,65 @@ def _run_PHREEQC_brine_rock_varying_pressure(
     Returns:
         dict: Results with 'Pressure (MPa)' and 'Dissolved CO2 (mol/kg)' lists
     """
-    temp_files_path = tempfile.gettempdir()
-    temperature_c = temperature - 273.15
-
-    # Load the PHREEQC template
-    template_path = os.path.join(
-        "phreeqc_programs", "co2_brine_rock_var_pressure_template.pqi"
+    phreeqc_code = render(
+        "co2_brine_rock_var_pressure_template.pqi",
+        SimulationParameters(
+            temperature=temperature, species=ion_moles, mineralogy=mineralogy
+        ),
     )
-    with open(template_path, "r") as template_file:
-        phreeqc_code = template_file.read()
-
-    # Build mineral phases section based on mineralogy dict
-    mineral_phases = []
-    mineral_names = {
-        "Quartz": "Quartz",
-        "Calcite": "Calcite",
-        "Siderite": "Siderite",
-        "Dolomite": "Dolomite",
-        "Illite": "Illite",
-        "Kaolinite": "Kaolinite",
-        "K-feldspar": "K-feldspar",
-        "Albite": "Albite",
-        "Chlorite": "Chlorite(14A)",
-        "Pyrite": "Pyrite",
-    }
 
-    for mineral_key, phreeqc_name in mineral_names.items():
-        if mineral_key in mineralogy and mineralogy[mineral_key] >= 0:
-            # Include mineral with 0 saturation index and specified initial moles
-            mineral_phases.append(
-                f"    {phreeqc_name}        0   {mineralogy[mineral_key]}"
-            )
-        else:
-            # Comment out or skip minerals with negative values
-            mineral_phases.append(f"    #{phreeqc_name}       0   0")
-
-    mineral_phases_str = "\n".join(mineral_phases)
-
-    # Replace template placeholders with actual values
-    database_path = f"/usr/local/share/doc/phreeqc/database/{database}.dat"
-    output_file = os.path.join(temp_files_path, "co2_brine_rock_var_p.tsv")
-
-    phreeqc_code = phreeqc_code.replace("__DATABASE__", database_path)
-    phreeqc_code = phreeqc_code.replace("__TEMPERATURE__", str(temperature_c))
-    phreeqc_code = phreeqc_code.replace("__NA__", str(ion_moles.get("Na+", 0)))
-    phreeqc_code = phreeqc_code.replace("__CL__", str(ion_moles.get("Cl-", 0)))
-    phreeqc_code = phreeqc_code.replace("__CA__", str(ion_moles.get("Ca+2", 0)))
-    phreeqc_code = phreeqc_code.replace("__MG__", str(ion_moles.get("Mg+2", 0)))
-    phreeqc_code = phreeqc_code.replace("__K__", str(ion_moles.get("K+", 0)))
-    phreeqc_code = phreeqc_code.replace("__SO4__", str(ion_moles.get("SO4-2", 0)))
-    phreeqc_code = phreeqc_code.replace("__HCO3__", str(ion_moles.get("HCO3-", 0)))
-    phreeqc_code = phreeqc_code.replace("__MINERAL_PHASES__", mineral_phases_str)
-    phreeqc_code = phreeqc_code.replace("__OUTPUT_FILE__", output_file)
-
-    filename = "co2_brine_rock_var_pressure.pqi"
-    pqi = open(os.path.join(temp_files_path, filename), "w")
-    pqi.write(phreeqc_code)
-    pqi.close()
-
-    subprocess.run(
-        [
-            "phreeqc",
-            f"{os.path.join(temp_files_path, filename)}",
-            f"{os.path.join(temp_files_path, filename).replace('.pqi', '.pqo')}",
-        ],
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.STDOUT,
-    )
+    output = run_phreeqc(phreeqc_code, database, name="co2_brine_rock_var_pressure")
 
     result = {"Pressure (MPa)": [], "Dissolved CO2 (mol/kg)": []}
 
-    with open(output_file, mode="r") as file:
-        reader = csv.DictReader(file, delimiter="\t")
-        # Clean column names by stripping spaces
-        if reader.fieldnames:
-            fieldnames = [field.strip() for field in reader.fieldnames]
-            reader = csv.DictReader(file, fieldnames=fieldnames, delimiter="\t")
-            next(reader)  # Skip header row since we're providing our own fieldnames
-
-        for row in reader:
-            # Get pressure from gas phase data - need to check what column name is used
-            # in the brine-rock template output
-            try:
-                # Try different possible pressure column names
-                pressure = None
-                if "pressure" in row:
-                    pressure = float(row["pressure"])
-                elif "CO2(g)" in row:
-                    # If CO2(g) pressure is available
-                    pressure = float(row["CO2(g)"])
-                elif "PR_CO2" in row:
-                    # Partial pressure from USER_PUNCH
-                    pressure = float(row["PR_CO2"])
-
-                if pressure is not None:
-                    # Convert pressure from atm to MPa if needed
-                    pressure_mpa = pressure * 0.101325 if pressure > 1.0 else pressure
-                    pressure_mpa = round(pressure_mpa, 2)
-
-                    trapped_co2 = float(row.get("C(4)", 0))
-
-                    result["Pressure (MPa)"].append(pressure_mpa)
-                    result["Dissolved CO2 (mol/kg)"].append(trapped_co2)
-
-            except (ValueError, KeyError) as e:
-                # Skip rows with invalid data
-                continue
-
-    # Clean up temporary files
-    if os.path.exists("error.inp"):
-        os.remove("error.inp")
-
-    if os.path.exists("phreeqc.log"):
-        os.remove("phreeqc.log")
+    for row in output.records():
+        # Get pressure from gas phase data - need to check what column name is used
+        # in the brine-rock template output
+        try:
+            # Try different possible pressure column names
+            pressure = None
+            if "pressure" in row:
+                pressure = float(row["pressure"])
+            elif "CO2(g)" in row:
+                # If CO2(g) pressure is available
+                pressure = float(row["CO2(g)"])
+            elif "PR_CO2" in row:
+                # Partial pressure from USER_PUNCH
+                pressure = float(row["PR_CO2"])
+
+            if pressure is not None:
+                # Convert pressure from atm to MPa if needed
+                pressure_mpa = pressure * 0.101325 if pressure > 1.0 else pressure
+                pressure_mpa = round(pressure_mpa, 2)
+
+                trapped_co2 = float(row.get("C(4)", 0))
+
+                result["Pressure (MPa)"].append(pressure_mpa)
+                result["Dissolved CO2 (mol/kg)"].append(trapped_co2)
+
+        except (ValueError, TypeError, KeyError) as e:
+            # Skip rows with invalid data
+            continue
 
     return result
 
 
-def simulate_co2_brine_rock_fixed(
-    temperature, pressure, species, mineralogy, model
-):
+def rock_database(model):
     """
-    Run PHREEQC simulation for brine-rock interaction at a single state.
+    Database a brine-rock model string selects: 'phreeqc' or 'pitzer', and
+    'phreeqc' for any other string.  The caches of the brine-rock
+    simulations are keyed on it, so every spelling of a model shares them.
+    """
+    return model if model in ["phreeqc", "pitzer"] else "phreeqc"
+
+
+@cached_simulation(
+    templates=("co2_brine_rock_template.pqi",), normalize={"model": rock_database}
+)
+def simulate_co2_brine_rock_state(temperature, pressure, species, mineralogy, model):
+    """
+    Dissolved CO2, mineral deltas and solution properties of a brine-rock
+    state from a single PHREEQC equilibrium.
 
     Parameters:
         temperature: Temperature in Kelvin
@@ -319,128 +120,42 @@ def simulate_co2_brine_rock_fixed(
         model: Database model ('phreeqc' or 'pitzer')
 
     Returns:
-        dict: Results including dissolved CO2, mineral deltas, and solution properties
+        dict: 'trapped_co2' (mol/kg), 'mineral_equi' and the solution
+        properties of selected_output.solution_properties ('species_data',
+        'density', 'ionic_strength', 'pH', 'osmotic_coefficient',
+        'partial_pressure_co2', 'fugacity_co2')
     """
-    temp_files_path = tempfile.gettempdir()
-    Na = species.get("Na+", 0)
-    Cl = species.get("Cl-", 0)
-    Mg = species.get("Mg+2", 0)
-    Ca = species.get("Ca+2", 0)
-    K = species.get("K+", 0)
-    SO4 = species.get("SO4-2", 0)
-    HCO3 = species.get("HCO3-", 0)
-    CO3 = species.get("CO3-2", 0)
-
-    pressure_atm = pressure * 9.86923
-    temperature_c = temperature - 273.15
-    p_co2 = pressure_atm * 0.95
-    p_h2o = pressure_atm * 0.05
-
-
-
-    # Load the PHREEQC template
-    template_path = os.path.join("phreeqc_programs", "co2_brine_rock_template.pqi")
-    with open(template_path, "r") as template_file:
-        phreeqc_code = template_file.read()
-
-    # Build mineral phases section based on mineralogy dict
-    mineral_phases = []
-    mineral_names = {
-        "Quartz": "Quartz",
-        "Calcite": "Calcite",
-        "Siderite": "Siderite",
-        "Dolomite": "Dolomite",
-        "Illite": "Illite",
-        "Kaolinite": "Kaolinite",
-        "K-feldspar": "K-feldspar",
-        "Albite": "Albite",
-        "Chlorite": "Chlorite(14A)",
-        "Pyrite": "Pyrite",
-    }
-
-    for mineral_key, phreeqc_name in mineral_names.items():
-        if mineral_key in mineralogy and mineralogy[mineral_key] >= 0:
-            # Include mineral with 0 saturation index and specified initial moles
-            mineral_phases.append(
-                f"    {phreeqc_name}        0   {mineralogy[mineral_key]}"
-            )
-        else:
-            # Comment out or skip minerals with negative values
-            mineral_phases.append(f"    #{phreeqc_name}       0   0")
-
-    mineral_phases_str = "\n".join(mineral_phases)
-
-    # Replace template placeholders with actual values
-    database_name = model if model in ["phreeqc", "pitzer"] else "phreeqc"
-    phreeqc_code = phreeqc_code.replace(
-        "__DATABASE__", f"/usr/local/share/doc/phreeqc/database/{database_name}.dat"
-    )
-
-    brine_rock_out_file = os.path.join(temp_files_path, "co2_brine_rock.tsv")
-    phreeqc_code = phreeqc_code.replace("__TEMPERATURE__", str(temperature_c))
-    phreeqc_code = phreeqc_code.replace("__NA__", str(Na))
-    phreeqc_code = phreeqc_code.replace("__CL__", str(Cl))
-    phreeqc_code = phreeqc_code.replace("__CA__", str(Ca))
-    phreeqc_code = phreeqc_code.replace("__MG__", str(Mg))
-    phreeqc_code = phreeqc_code.replace("__K__", str(K))
-    phreeqc_code = phreeqc_code.replace("__SO4__", str(SO4))
-    phreeqc_code = phreeqc_code.replace("__HCO3__", str(HCO3))
-    phreeqc_code = phreeqc_code.replace("__PRESSURE_ATM__", str(pressure_atm))
-    phreeqc_code = phreeqc_code.replace("__P_CO2__", str(p_co2))
-    phreeqc_code = phreeqc_code.replace("__P_H2O__", str(p_h2o))
-    phreeqc_code = phreeqc_code.replace("__MINERAL_PHASES__", mineral_phases_str)
-    phreeqc_code = phreeqc_code.replace("__OUTPUT_FILE__", brine_rock_out_file)
-
-    filename = os.path.join(temp_files_path, "co2_brine_rock.pqi")
-
-    with open(filename, "w") as pqi:
-        pqi.write(phreeqc_code)
-
-    # Run phreeqc with full paths
-    subprocess.run(
-        ["phreeqc", filename, filename.replace(".pqi", ".pqo")],
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.STDOUT,
+    database_name = rock_database(model)
+
+    phreeqc_code = render(
+        "co2_brine_rock_template.pqi",
+        SimulationParameters(
+            temperature=temperature,
+            pressure=pressure,
+            species=species,
+            mineralogy=mineralogy,
+        ),
     )
 
-    # Make sure the file exists before trying to read it
-    if not os.path.exists(brine_rock_out_file):
-        raise FileNotFoundError(f"Output file not found: {brine_rock_out_file}")
+    # Get the last row (final simulation state)
+    results = run_phreeqc(
+        phreeqc_code, database_name, name="co2_brine_rock", last_only=True
+    ).last()
 
-    # Initialize results with a default empty dictionary
-    results = {}
+    return _brine_rock_state(results, mineralogy)
 
-    # Read the output file
-    try:
-        with open(brine_rock_out_file, mode="r") as file:
-            reader = csv.DictReader(file, delimiter="\t")
-            # Clean column names by stripping spaces
-            if reader.fieldnames:
-                fieldnames = [field.strip() for field in reader.fieldnames]
-                reader = csv.DictReader(file, fieldnames=fieldnames, delimiter="\t")
-                next(reader)  # Skip header row
-
-                # Get the last row (final simulation state)
-                for row in reader:
-                    results = row  # Will keep the last row
 
-    except Exception as e:
-        print(f"Error reading {brine_rock_out_file}: {str(e)}", flush=True)
-        raise
-
-    # Extract results
+def _brine_rock_state(results, mineralogy):
+    """
+    Dissolved CO2, mineral deltas and solution properties from the
+    equilibrated SELECTED_OUTPUT row of a brine-rock state.
+    """
     try:
         trapped_co2 = float(results.get("C(4)", 0))
-        density = float(results.get("SOL_DENSITY", 0))
-        ionic_strength = float(results.get("mu", 0))
-        pH = float(results.get("pH", 7.0))
-        osmotic_coefficient = float(results.get("OSMOTIC", 0))
-        partial_pressure_co2 = float(results.get("PR_CO2", 0))
-        fugacity_co2 = float(results.get("PHI_CO2", 0))
 
         # Extract mineral deltas
         mineral_equi = {}
-        for mineral_key, phreeqc_name in mineral_names.items():
+        for mineral_key, phreeqc_name in MINERAL_NAMES.items():
             delta_key = f'EQUI_{phreeqc_name.upper().replace("-", "").replace("(", "").replace(")", "").replace("14A", "")}'
             if mineral_key in mineralogy and mineralogy[mineral_key] >= 0:
                 mineral_equi[mineral_key] = float(results.get(delta_key, 0))
@@ -450,20 +165,48 @@ def simulate_co2_brine_rock_fixed(
     except (ValueError, TypeError) as e:
         print(f"Error parsing results: {e}", flush=True)
         trapped_co2 = 0
-        density = 0
-        ionic_strength = 0
-        pH = 7.0
-        osmotic_coefficient = 0
-        partial_pressure_co2 = 0
-        fugacity_co2 = 0
-        mineral_equi = {k: 0 for k in mineral_names.keys()}
+        mineral_equi = {k: 0 for k in MINERAL_NAMES.keys()}
 
     return {
         "trapped_co2": trapped_co2,
         "mineral_equi": mineral_equi,
+        **solution_properties(results),
     }
 
 
+@cached_simulation(
+    templates=("co2_brine_rock_template.pqi",), normalize={"model": rock_database}
+)
+def simulate_co2_brine_rock_fixed(
+    temperature, pressure, species, mineralogy, model
+):
+    """
+    Run PHREEQC simulation for brine-rock interaction at a single state.
+
+    Parameters:
+        temperature: Temperature in Kelvin
+        pressure: Pressure in MPa
+        species: Dictionary of ion molalities
+        mineralogy: Dictionary of mineral names and initial moles
+        model: Database model ('phreeqc' or 'pitzer')
+
+    Returns:
+        dict: 'trapped_co2' and 'mineral_equi' of simulate_co2_brine_rock_state
+    """
+    state = simulate_co2_brine_rock_state(
+        temperature, pressure, species, mineralogy, model
+    )
+    return {
+        "trapped_co2": state["trapped_co2"],
+        "mineral_equi": state["mineral_equi"],
+    }
+
+
+@cached_simulation(
+    templates=("co2_brine_rock_var_pressure_template.pqi",),
+    databases=("phreeqc",),
+    normalize={"model": rock_database},
+)
 def simulate_co2_brine_rock_var_p(temperature, ion_moles, mineralogy, model):
     """
     Simulate CO2 solubility with brine-rock interaction over a range of pressures at fixed temperature.
@@ -485,6 +228,86 @@ def simulate_co2_brine_rock_var_p(temperature, ion_moles, mineralogy, model):
     return result
 
 
+def _run_PHREEQC_brine_rock_state_batch(states, species, mineralogy, database):
+    """
+    Dissolved CO2 (mol/kg) of several (temperature, pressure) brine-rock
+    states run as one PHREEQC job, None where PHREEQC produced no
+    equilibrated row (see _run_PHREEQC_brine_rock_states).
+    """
+    return [
+        None if state is None else state["trapped_co2"]
+        for state in _run_PHREEQC_brine_rock_states(
+            states, species, mineralogy, database
+        )
+    ]
+
+
+def _run_PHREEQC_brine_rock_states(states, species, mineralogy, database):
+    """
+    Run several (temperature, pressure) brine-rock states as one PHREEQC job.
+
+    Each state is its own SOLUTION n / GAS_PHASE n / EQUILIBRIUM_PHASES n
+    simulation, numbered from 1, and its equilibrated row is matched back to
+    the state through the 'soln' column of the single SELECTED_OUTPUT.
+
+    Parameters:
+        states: List of (temperature in Kelvin, pressure in MPa) tuples
+        species: Dictionary of ion molalities
+        mineralogy: Dictionary of mineral names and initial moles
+        database: PHREEQC database name
+
+    Returns:
+        list: Result per state, as returned by simulate_co2_brine_rock_state,
+        None where PHREEQC produced no equilibrated row for it
+    """
+    blocks = []
+    for state, (temperature, pressure) in enumerate(states, start=1):
+        blocks.append(
+            render(
+                "co2_brine_rock_state_block.pqi",
+                SimulationParameters(
+                    temperature=temperature,
+                    pressure=pressure,
+                    species=species,
+                    mineralogy=mineralogy,
+                    state=state,
+                ),
+            )
+        )
+    phreeqc_code = render(
+        "co2_brine_rock_state_batch_template.pqi", STATE_BLOCKS="\n".join(blocks)
+    )
+
+    output = run_phreeqc(phreeqc_code, database, name="co2_brine_rock_state_batch")
+
+    results = [None] * len(states)
+    for row in output.records():
+        # Only the equilibrated rows; 'i_soln' rows hold the initial solution
+        if str(row.get("state", "")).strip() != "react":
+            continue
+        try:
+            index = int(float(row.get("soln", 0))) - 1
+            float(row.get("C(4)", 0))
+        except (ValueError, TypeError):
+            continue
+        if 0 <= index < len(states):
+            results[index] = _brine_rock_state(row, mineralogy)
+
+    return results
+
+
+# Temperatures (K) of the brine-rock var-T sweep (25-160°C)
+BRINE_ROCK_TEMPERATURES = [298, 313, 328, 343, 358, 373, 388, 403, 418, 433]
+
+
+@cached_simulation(
+    templates=(
+        "co2_brine_rock_state_batch_template.pqi",
+        "co2_brine_rock_state_block.pqi",
+        "co2_brine_rock_template.pqi",
+    ),
+    normalize={"model": rock_database},
+)
 def simulate_co2_brine_rock_var_t(pressure, ion_moles, mineralogy, model):
     """
     Simulate CO2 solubility with brine-rock interaction over a range of temperatures at fixed pressure.
@@ -498,35 +321,212 @@ def simulate_co2_brine_rock_var_t(pressure, ion_moles, mineralogy, model):
     Returns:
         dict: Contains 'Temperature (K)' and 'Dissolved CO2 (mol/kg)' lists
     """
-    temperatures = [
-        298,
-        313,
-        328,
-        343,
-        358,
-        373,
-        388,
-        403,
-        418,
-        433,
-    ]  # K range (25-160°C)
-    trapped_co2_values = []
+    temperatures = BRINE_ROCK_TEMPERATURES
+    database_name = rock_database(model)
 
-    for temperature in temperatures:
+    # One PHREEQC job per chunk of the sweep, the chunks running in parallel
+    chunks = split_evenly(
+        [(temperature, pressure) for temperature in temperatures],
+        parallel_workers(),
+    )
+    batches = parallel_starmap(
+        _run_PHREEQC_brine_rock_state_batch,
+        [(chunk, ion_moles, mineralogy, database_name) for chunk in chunks],
+    )
+
+    trapped_co2_values = []
+    for chunk, batch in zip(chunks, batches):
+        if isinstance(batch, Exception):
+            print(f"Error in brine-rock temperature sweep: {batch}")
+            batch = [None] * len(chunk)
+        trapped_co2_values.extend(batch)
+
+    # PHREEQC stops at the first failing simulation; retry the missing points
+    # one by one so a single failure only zeroes itself
+    missing = [i for i, value in enumerate(trapped_co2_values) if value is None]
+    retried = parallel_starmap(
+        simulate_co2_brine_rock_fixed,
+        [
+            (temperatures[i], pressure, ion_moles, mineralogy, model)
+            for i in missing
+        ],
+    )
+    for i, result in zip(missing, retried):
         try:
-            result = simulate_co2_brine_rock_fixed(
-                temperature=temperature,
-                pressure=pressure,
-                species=ion_moles,
-                mineralogy=mineralogy,
-                model=model,
-            )
-            trapped_co2_values.append(result["trapped_co2"])
+            if isinstance(result, Exception):
+                raise result
+            trapped_co2_values[i] = result["trapped_co2"]
         except Exception as e:
-            print(f"Error at temperature {temperature} K: {e}")
-            trapped_co2_values.append(0)
+            print(f"Error at temperature {temperatures[i]} K: {e}")
+            trapped_co2_values[i] = 0
+            mark_incomplete()
 
     return {
         "Temperature (K)": temperatures,
         "Dissolved CO2 (mol/kg)": trapped_co2_values,
     }
+
+
+def _run_PHREEQC_brine_rock_state_point(
+    temperature, pressure, ion_moles, mineralogy, model
+):
+    """
+    Dissolved CO2 of one brine-rock state as a one-state batch, falling back
+    to simulate_co2_brine_rock_fixed, which raises if the state fails.
+    """
+    database_name = rock_database(model)
+    try:
+        trapped_co2 = _run_PHREEQC_brine_rock_state_batch(
+            [(temperature, pressure)], ion_moles, mineralogy, database_name
+        )[0]
+    except Exception as e:
+        print(f"Error in brine-rock temperature sweep: {e}")
+        trapped_co2 = None
+    if trapped_co2 is None:
+        trapped_co2 = simulate_co2_brine_rock_fixed(
+            temperature, pressure, ion_moles, mineralogy, model
+        )["trapped_co2"]
+    return trapped_co2
+
+
+def stream_co2_brine_rock_var_t(pressure, ion_moles, mineralogy, model):
+    """
+    Yield the (temperature, dissolved CO2) points of
+    simulate_co2_brine_rock_var_t as soon as each one is computed.
+
+    Every temperature runs as its own PHREEQC job on the parallel workers and
+    the points come in the order they finish; a failed point is 0, as in the
+    sweep.  A cached sweep is replayed at once, and a stream that runs to the
+    end without a failed point is cached as the sweep would have been.
+    """
+    result = simulate_co2_brine_rock_var_t.lookup(
+        pressure, ion_moles, mineralogy, model
+    )
+    if result is not None:
+        yield from zip(result["Temperature (K)"], result["Dissolved CO2 (mol/kg)"])
+        return
+
+    temperatures = BRINE_ROCK_TEMPERATURES
+    trapped_co2_values = [0] * len(temperatures)
+    complete = True
+    for i, trapped_co2 in parallel_as_completed(
+        _run_PHREEQC_brine_rock_state_point,
+        [
+            (temperature, pressure, ion_moles, mineralogy, model)
+            for temperature in temperatures
+        ],
+    ):
+        if isinstance(trapped_co2, Exception):
+            print(f"Error at temperature {temperatures[i]} K: {trapped_co2}")
+            trapped_co2 = 0
+            complete = False
+        trapped_co2_values[i] = trapped_co2
+        yield temperatures[i], trapped_co2
+
+    if not complete:
+        return
+    simulate_co2_brine_rock_var_t.store(
+        {
+            "Temperature (K)": temperatures,
+            "Dissolved CO2 (mol/kg)": trapped_co2_values,
+        },
+        pressure,
+        ion_moles,
+        mineralogy,
+        model,
+    )
+
+
+def stream_co2_brine_rock_var_p(temperature, ion_moles, mineralogy, model):
+    """
+    Yield the (pressure, dissolved CO2) points of simulate_co2_brine_rock_var_p.
+
+    The pressures are the steps of a single incremental PHREEQC reaction
+    path, each one starting from the equilibrium of the previous step, so
+    they cannot be computed apart: the points follow each other as soon as
+    that one run ends.
+    """
+    result = simulate_co2_brine_rock_var_p(temperature, ion_moles, mineralogy, model)
+    yield from zip(result["Pressure (MPa)"], result["Dissolved CO2 (mol/kg)"])
+
+
+def simulate_co2_brine_rock_batch(states, model, concentrations=None, mineralogy=None):
+    """
+    Calculate dissolved CO2 with brine-rock interaction for many states.
+
+    Identical states are computed once, reusing the results cached by
+    simulate_co2_brine_rock_fixed; the others run as state batches of one
+    brine and mineralogy on the parallel workers, and their results are
+    cached for simulate_co2_brine_rock_state and simulate_co2_brine_rock_fixed.
+
+    Parameters:
+        states: List of dictionaries with 'temperature' (K), 'pressure'
+            (MPa) and optionally 'concentrations' (ion molalities) and
+            'mineralogy' (mineral names and initial moles)
+        model: Database model ('phreeqc' or 'pitzer')
+        concentrations, mineralogy: Used by the states without their own
+
+    Returns:
+        dict: 'temperature', 'pressure', 'dissolved_co2' (mol/kg) and
+        'error' lists in the order of the states (see
+        co2_brine_simulation.simulate_co2_brine_batch), and the count of
+        'unique_states'
+    """
+    database_name = rock_database(model)
+    compositions = ("concentrations", "mineralogy")
+    unique, index, errors = parse_states(
+        states,
+        {"concentrations": concentrations, "mineralogy": mineralogy},
+        compositions,
+    )
+
+    values = {}
+    to_run = []
+    for position, state in enumerate(unique):
+        result = simulate_co2_brine_rock_fixed.lookup(
+            state["temperature"],
+            state["pressure"],
+            state["concentrations"],
+            state["mineralogy"],
+            model,
+        )
+        if result is None:
+            to_run.append(position)
+        else:
+            values[position] = result["trapped_co2"]
+
+    computed, value_errors = run_state_batches(
+        _run_PHREEQC_brine_rock_states,
+        simulate_co2_brine_rock_state,
+        unique,
+        to_run,
+        compositions,
+        database_name,
+    )
+    for position, result in computed.items():
+        state = unique[position]
+        key = (
+            state["temperature"],
+            state["pressure"],
+            state["concentrations"],
+            state["mineralogy"],
+            model,
+        )
+        simulate_co2_brine_rock_state.store(result, *key)
+        simulate_co2_brine_rock_fixed.store(
+            {
+                "trapped_co2": result["trapped_co2"],
+                "mineral_equi": result["mineral_equi"],
+            },
+            *key,
+        )
+        values[position] = result["trapped_co2"]
+
+    return columns(
+        states,
+        unique,
+        index,
+        errors,
+        [values.get(position) for position in range(len(unique))],
+        [value_errors.get(position) for position in range(len(unique))],
+    )
@@ -1,287 +1,298 @@
-import os
-import math
-import pandas as pd
-import subprocess
-import csv
 import DuanSun2006
+import carbonex
 import sys
-import tempfile
-
-
-def simulate_co2_brine_solution_properties(temperature, pressure, species):
-    temp_files_path = tempfile.gettempdir()
-    Na = species.get("Na+", 0)
-    Cl = species.get("Cl-", 0)
-    Mg = species.get("Mg+2", 0)
-    Ca = species.get("Ca+2", 0)
-    K = species.get("K+", 0)
-    SO4 = species.get("SO4-2", 0)
-    HCO3 = species.get("HCO3-", 0)
-    CO3 = species.get("CO3-2", 0)
-
-    pressure_atm = pressure * 9.86923
-    temperature_c = temperature - 273.15
-    p_co2 = pressure_atm * 0.95
-    p_h2o = pressure_atm * 0.05
-
-    state_out_file = os.path.join(temp_files_path, "solution_properties.tsv")
-
-    template_path = os.path.join("phreeqc_programs", "co2_brine_template.pqi")
-    with open(template_path, "r") as template_file:
-        phreeqc_code = template_file.read()
-
-    phreeqc_code = phreeqc_code.replace(
-        "__DATABASE__", "/usr/local/share/doc/phreeqc/database/pitzer.dat"
-    )
-    phreeqc_code = phreeqc_code.replace("__TEMPERATURE__", str(temperature_c))
-    phreeqc_code = phreeqc_code.replace("__NA__", str(Na))
-    phreeqc_code = phreeqc_code.replace("__CL__", str(Cl))
-    phreeqc_code = phreeqc_code.replace("__CA__", str(Ca))
-    phreeqc_code = phreeqc_code.replace("__MG__", str(Mg))
-    phreeqc_code = phreeqc_code.replace("__K__", str(K))
-    phreeqc_code = phreeqc_code.replace("__SO4__", str(SO4))
-    phreeqc_code = phreeqc_code.replace("__HCO3__", str(HCO3))
-    phreeqc_code = phreeqc_code.replace("__PRESSURE_ATM__", str(pressure_atm))
-    phreeqc_code = phreeqc_code.replace("__P_CO2__", str(p_co2))
-    phreeqc_code = phreeqc_code.replace("__P_H2O__", str(p_h2o))
-    phreeqc_code = phreeqc_code.replace("__OUTPUT_FILE__", state_out_file)
-
-    filename = os.path.join(temp_files_path, "solution_properties.pqi")
-
-    pqi = open(filename, "w")
-    pqi.write(phreeqc_code)
-    pqi.close()
-
-    subprocess.run(
-        ["phreeqc", filename, filename.replace(".pqi", ".pqo")],
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.STDOUT,
-    )
-
-    # Make sure the file exists before trying to read it
-    if not os.path.exists(state_out_file):
-        raise FileNotFoundError(f"Output file not found: {state_out_file}")
-
-    results = {}
-    try:
-        with open(state_out_file, mode="r") as file:
-            reader = csv.DictReader(file, delimiter="\t")
-            # Clean column names by stripping spaces
-            if reader.fieldnames:
-                fieldnames = [field.strip() for field in reader.fieldnames]
-                reader = csv.DictReader(file, fieldnames=fieldnames, delimiter="\t")
-                next(reader)  # Skip header row since we're providing our own fieldnames
-
-                # Get the last row (final simulation state)
-                for row in reader:
-                    results = row  # Will keep the last row
-    except Exception as e:
-        print(f"Error reading {state_out_file}: {str(e)}", flush=True)
-        raise
-
-    species_data = []
-
-    for ion in ["Na+", "Cl-", "K+", "Mg+2", "Ca+2", "SO4-2", "HCO3-", "CO3-2"]:
-        activity_key = f"la_{ion}"
-        molar_volume_key = f"VM_{ion}"
-
-        # Handle potential missing keys safely
-        try:
-            activity_value = math.exp(float(results.get(activity_key, 0)))
-            molar_volume_value = float(results.get(molar_volume_key, 0))
-        except (ValueError, TypeError):
-            activity_value = 0
-            molar_volume_value = 0
-
-        threshold = (
-            -500
-        )  # even if the species is non-existent, it will have an activity of -1000, this is to avoid including non-existing species
-        species_data.append(
-            {
-                "species": ion,
-                "activity": round(
-                    activity_value if activity_value >= threshold else 0, 4
-                ),
-                "molar_volume": round(
-                    molar_volume_value if molar_volume_value >= threshold else 0, 4
-                ),
-            }
-        )
-
-    # Handle potential missing keys safely
-    try:
-
-        density = float(results.get("SOL_DENSITY", 0))
-        ionic_strength = float(results.get("mu", 0))
-        pH = float(results.get("pH", 7.0))
-        osmotic_coefficient = float(results.get("OSMOTIC", 0))
-        partial_pressure_co2 = float(results.get("PR_CO2", 0))
-        fugacity_co2 = float(results.get("PHI_CO2", 0))
-
-    except (ValueError, TypeError):
-        density = 0
-        ionic_strength = 0
-        pH = 7.0
-        osmotic_coefficient = 0
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from parallel import (
+    ProgressSplit,
+    parallel_as_completed,
+    parallel_starmap,
+    parallel_workers,
+    split_evenly,
+)
+from phreeqc_engine import run_phreeqc
+from phreeqc_templates import SimulationParameters, render
+from result_cache import cached_simulation, mark_incomplete
+from selected_output import solution_properties
+from solubility_tables import TABLE_MODELS, get_table, lookup
+from state_batch import columns, group_states, parse_states, run_state_batches
+
+
+def simulate_co2_brine_solution_properties(
+    temperature, pressure, species, model="phreeqc_pitzer"
+):
+    """
+    Solution properties of the CO2-saturated brine at one state.
 
+    Returns:
+        tuple: (species_data, density, ionic_strength, pH,
+        osmotic_coefficient, partial_pressure_co2, fugacity_co2) from
+        simulate_co2_brine_state
+    """
+    state = simulate_co2_brine_state(temperature, pressure, species, model)
     return (
-        species_data,
-        density,
-        ionic_strength,
-        pH,
-        osmotic_coefficient,
-        partial_pressure_co2,
-        fugacity_co2,
+        state["species_data"],
+        state["density"],
+        state["ionic_strength"],
+        state["pH"],
+        state["osmotic_coefficient"],
+        state["partial_pressure_co2"],
+        state["fugacity_co2"],
     )
 
 
 def _simulate_varying_pressure_PHREEQC(temperature, ion_moles, database):
-    temp_files_path = tempfile.gettempdir()
-    temperature_c = temperature - 273.15
-
-    template_path = os.path.join(
-        "phreeqc_programs", "co2_brine_var_pressure_template.pqi"
+    phreeqc_code = render(
+        "co2_brine_var_pressure_template.pqi",
+        SimulationParameters(temperature=temperature, species=ion_moles),
     )
-    with open(template_path, "r") as template_file:
-        phreeqc_code = template_file.read()
 
-    database_path = f"/usr/local/share/doc/phreeqc/database/{database}.dat"
-    output_file = os.path.join(temp_files_path, "varying_pressure.tsv")
-
-    phreeqc_code = phreeqc_code.replace("__DATABASE__", database_path)
-    phreeqc_code = phreeqc_code.replace("__TEMPERATURE__", str(temperature_c))
-    phreeqc_code = phreeqc_code.replace("__NA__", str(ion_moles.get("Na+", 0)))
-    phreeqc_code = phreeqc_code.replace("__CL__", str(ion_moles.get("Cl-", 0)))
-    phreeqc_code = phreeqc_code.replace("__CA__", str(ion_moles.get("Ca+2", 0)))
-    phreeqc_code = phreeqc_code.replace("__MG__", str(ion_moles.get("Mg+2", 0)))
-    phreeqc_code = phreeqc_code.replace("__K__", str(ion_moles.get("K+", 0)))
-    phreeqc_code = phreeqc_code.replace("__SO4__", str(ion_moles.get("SO4-2", 0)))
-    phreeqc_code = phreeqc_code.replace("__OUTPUT_FILE__", output_file)
-
-    filename = "varying_pressure.pqi"
-
-    pqi = open(os.path.join(temp_files_path, filename), "w")
-    pqi.write(phreeqc_code)
-
-    pqi.close()
-
-    subprocess.run(
-        [
-            "phreeqc",
-            f"{os.path.join(temp_files_path, filename)}",
-            f"{os.path.join(temp_files_path, filename).replace('.pqi', '.pqo')}",
-        ],
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.STDOUT,
-    )
+    output = run_phreeqc(phreeqc_code, database, name="varying_pressure")
 
     result = {"Pressure (MPa)": [], "Dissolved CO2 (mol/kg)": []}
 
-    with open(os.path.join(temp_files_path, "varying_pressure.tsv"), mode="r") as file:
-        reader = csv.DictReader(file, delimiter="\t")
-        # Clean column names by stripping spaces
-        if reader.fieldnames:
-            fieldnames = [field.strip() for field in reader.fieldnames]
-            reader = csv.DictReader(file, fieldnames=fieldnames, delimiter="\t")
-            next(reader)  # Skip header row since we're providing our own fieldnames
-
-        for row in reader:
-            # Convert pressure from atm to MPa
-            pressure = float(row.get("pressure", 0)) * 0.101325
-            pressure = round(pressure, 2)
-            trapped_co2 = float(row.get("C(4)", 2))
-
-            result["Pressure (MPa)"].append(pressure)
-            result["Dissolved CO2 (mol/kg)"].append(trapped_co2)
-
-    if os.path.exists("error.inp"):
-        os.remove("error.inp")
+    for row in output.records():
+        # Convert pressure from atm to MPa
+        pressure = float(row.get("pressure", 0)) * 0.101325
+        pressure = round(pressure, 2)
+        trapped_co2 = float(row.get("C(4)", 2))
 
-    if os.path.exists("phreeqc.log"):
-        os.remove("phreeqc.log")
+        result["Pressure (MPa)"].append(pressure)
+        result["Dissolved CO2 (mol/kg)"].append(trapped_co2)
 
     return result
 
 
 def _simulate_varying_pressure_Carbonex(temperature, ion_moles):
-    return {"Pressure (MPa)": [], "Dissolved CO2 (mol/kg)": []}
+    """
+    Use the carbonex model to calculate CO2 solubility over a pressure range,
+    on the same pressure points as the Duan and Sun sweep.
+    Returns dict with lists for 'Pressure (MPa)' and 'Dissolved CO2 (mol/kg)'.
+    """
+    pressures = np.arange(0.1, 50.0 + 1, 1)
+    trapped_co2 = carbonex.solubility(pressures, temperature, ion_moles)
+    return {
+        "Pressure (MPa)": pressures.tolist(),
+        "Dissolved CO2 (mol/kg)": [
+            None if np.isnan(value) else value for value in trapped_co2.tolist()
+        ],
+    }
 
 
-def _simulate_varying_pressure_DuanSun(temperature, ion_moles):
+def _simulate_varying_pressure_DuanSun(temperature, ion_moles, parameters="DuanSun"):
     """
     Use Duan and Sun (2006) model to calculate CO2 solubility over a pressure range.
+    parameters selects the coefficient set ('DuanSun' or 'Guo').
     Returns dict with lists for 'Pressure (MPa)' and 'Dissolved CO2 (mol/kg)'.
     """
 
-    model = DuanSun2006.DuanSun2006()
+    model = DuanSun2006.shared_model
     P_start = 0.1
     P_end = 50.0
     P_step = 1
     result = model.calculate_varying_pressure(
-        P_start, P_end, P_step, temperature, ion_moles, model="DuanSun"
+        P_start, P_end, P_step, temperature, ion_moles, model=parameters
     )
     return result
 
 
-def _simulate_varying_temperature_PHREEQC(pressure, ion_moles, database):
+def _simulate_varying_pressure_table(temperature, ion_moles, database):
     """
-    Use PHREEQC to calculate CO2 solubility over a temperature range.
-    Since PHREEQC cannot vary temperature the same way as pressure, we call
-    _run_PHREEQC_state_simulation multiple times with different temperatures.
-    Returns dict with lists for 'Temperature (K)' and 'Dissolved CO2 (mol/kg)'.
+    Interpolate CO2 solubility over a pressure range from the precomputed
+    table of a database (see solubility_tables.py), on the same pressure
+    points as the Duan and Sun sweep clipped to the top of the table.
+    Points outside the table are run through PHREEQC one by one and skipped
+    if they fail, as in _simulate_varying_temperature_table; the PHREEQC
+    sweep runs instead when the temperature or brine is outside the table.
     """
+    # Same points as DuanSun2006.calculate_varying_pressure(0.1, 50.0, 1);
+    # its last one, 50.1 MPa, becomes the 50 MPa top of the default table
+    pressures = np.arange(0.1, 50.0 + 1, 1)
+    table = get_table(database)
+    if table is not None:
+        pressures = np.unique(np.minimum(pressures, table.pressure[-1]))
+    trapped_co2_values = lookup(database, temperature, pressures, ion_moles)
+    if trapped_co2_values is None or not np.any(np.isfinite(trapped_co2_values)):
+        print(
+            f"Temperature {temperature} or brine outside the {database} table, "
+            "running the PHREEQC sweep",
+            flush=True,
+        )
+        return _simulate_varying_pressure_PHREEQC(temperature, ion_moles, database)
+
+    trapped_co2_values = [
+        float(value) if np.isfinite(value) else None for value in trapped_co2_values
+    ]
+    missing = [i for i, value in enumerate(trapped_co2_values) if value is None]
+    if missing:
+        print(
+            f"{len(missing)} pressures outside the {database} table, "
+            "running them through PHREEQC",
+            flush=True,
+        )
+    retried = parallel_starmap(
+        _run_PHREEQC_state_simulation,
+        [(temperature, float(pressures[i]), ion_moles, database) for i in missing],
+    )
+    for i, trapped_co2 in zip(missing, retried):
+        if isinstance(trapped_co2, Exception):
+            print(f"Error at pressure {pressures[i]}: {trapped_co2}", flush=True)
+            mark_incomplete()
+            continue
+        trapped_co2_values[i] = trapped_co2
+
+    result = {"Pressure (MPa)": [], "Dissolved CO2 (mol/kg)": []}
+    for pressure, trapped_co2 in zip(pressures, trapped_co2_values):
+        if trapped_co2 is None:
+            continue
+        result["Pressure (MPa)"].append(round(float(pressure), 2))
+        result["Dissolved CO2 (mol/kg)"].append(trapped_co2)
+    return result
+
+
+def _PHREEQC_sweep_temperatures():
+    """Temperatures (K) of the PHREEQC var-T sweeps."""
     T_start = 273.15  # 0°C
-    T_end = 573.15  # 100°C
+    T_end = 573.15  # 300°C
     T_step = 20
 
-    result = {"Temperature (K)": [], "Dissolved CO2 (mol/kg)": []}
-
     temperatures = []
     temp = T_start
     while temp <= T_end:
         temperatures.append(temp)
         temp += T_step
+    return temperatures
 
-    for temperature in temperatures:
-        try:
-            trapped_co2 = _run_PHREEQC_state_simulation(
-                temperature, pressure, ion_moles, database
-            )
-            result["Temperature (K)"].append(temperature)
-            result["Dissolved CO2 (mol/kg)"].append(trapped_co2)
-        except Exception as e:
-            print(f"Error at temperature {temperature}: {e}", flush=True)
+
+def _simulate_varying_temperature_PHREEQC(pressure, ion_moles, database):
+    """
+    Use PHREEQC to calculate CO2 solubility over a temperature range.
+    Since PHREEQC cannot vary temperature the same way as pressure, every
+    temperature becomes its own SOLUTION/GAS_PHASE simulation, and all of them
+    run in PHREEQC jobs of several states each (see _run_PHREEQC_state_batch)
+    spread over the parallel workers (see parallel.py).
+    Returns dict with lists for 'Temperature (K)' and 'Dissolved CO2 (mol/kg)'.
+    """
+    result = {"Temperature (K)": [], "Dissolved CO2 (mol/kg)": []}
+
+    temperatures = _PHREEQC_sweep_temperatures()
+
+    # The sweep is split into one chunk per worker; every chunk runs as a
+    # single PHREEQC job and the chunks run in parallel
+    chunks = split_evenly(
+        [(temperature, pressure) for temperature in temperatures],
+        parallel_workers(),
+    )
+    batches = parallel_starmap(
+        _run_PHREEQC_state_batch,
+        [(chunk, ion_moles, database) for chunk in chunks],
+    )
+
+    trapped_co2_values = []
+    for chunk, batch in zip(chunks, batches):
+        if isinstance(batch, Exception):
+            print(f"Error in temperature sweep: {batch}", flush=True)
+            batch = [None] * len(chunk)
+        trapped_co2_values.extend(batch)
+
+    # PHREEQC stops at the first failing simulation; retry the missing points
+    # one by one so a single failure only skips itself
+    missing = [i for i, value in enumerate(trapped_co2_values) if value is None]
+    retried = parallel_starmap(
+        _run_PHREEQC_state_simulation,
+        [(temperatures[i], pressure, ion_moles, database) for i in missing],
+    )
+    for i, trapped_co2 in zip(missing, retried):
+        if isinstance(trapped_co2, Exception):
+            print(f"Error at temperature {temperatures[i]}: {trapped_co2}", flush=True)
+            mark_incomplete()
+            continue
+        trapped_co2_values[i] = trapped_co2
+
+    for temperature, trapped_co2 in zip(temperatures, trapped_co2_values):
+        if trapped_co2 is None:
+            continue
+        result["Temperature (K)"].append(temperature)
+        result["Dissolved CO2 (mol/kg)"].append(trapped_co2)
+
+    return result
+
+
+def _simulate_varying_temperature_table(pressure, ion_moles, database):
+    """
+    Interpolate CO2 solubility over the PHREEQC temperature range from the
+    precomputed table of a database (see solubility_tables.py).  Points
+    outside the table are run through PHREEQC one by one and, as in the
+    PHREEQC sweep, skipped if they fail.
+    """
+    temperatures = _PHREEQC_sweep_temperatures()
+    trapped_co2_values = lookup(database, temperatures, pressure, ion_moles)
+    if trapped_co2_values is None:
+        return _simulate_varying_temperature_PHREEQC(pressure, ion_moles, database)
+
+    trapped_co2_values = [
+        float(value) if np.isfinite(value) else None for value in trapped_co2_values
+    ]
+    missing = [i for i, value in enumerate(trapped_co2_values) if value is None]
+    retried = parallel_starmap(
+        _run_PHREEQC_state_simulation,
+        [(temperatures[i], pressure, ion_moles, database) for i in missing],
+    )
+    for i, trapped_co2 in zip(missing, retried):
+        if isinstance(trapped_co2, Exception):
+            print(f"Error at temperature {temperatures[i]}: {trapped_co2}", flush=True)
+            mark_incomplete()
             continue
+        trapped_co2_values[i] = trapped_co2
 
+    result = {"Temperature (K)": [], "Dissolved CO2 (mol/kg)": []}
+    for temperature, trapped_co2 in zip(temperatures, trapped_co2_values):
+        if trapped_co2 is None:
+            continue
+        result["Temperature (K)"].append(temperature)
+        result["Dissolved CO2 (mol/kg)"].append(trapped_co2)
     return result
 
 
 def _simulate_varying_temperature_Carbonex(pressure, ion_moles):
     """
-    Placeholder for Carbonex model varying temperature calculation.
+    Use the carbonex model to calculate CO2 solubility over a temperature
+    range, on the same temperature points as the Duan and Sun sweep.
+    Returns dict with lists for 'Temperature (K)' and 'Dissolved CO2 (mol/kg)'.
     """
-    return {"Temperature (K)": [], "Dissolved CO2 (mol/kg)": []}
+    temperatures = np.arange(273.15, 573.15 + 5.0, 5.0)
+    trapped_co2 = carbonex.solubility(pressure, temperatures, ion_moles)
+    return {
+        "Temperature (K)": temperatures.tolist(),
+        "Dissolved CO2 (mol/kg)": [
+            None if np.isnan(value) else value for value in trapped_co2.tolist()
+        ],
+    }
 
 
-def _simulate_varying_temperature_DuanSun(pressure, ion_moles):
+def _simulate_varying_temperature_DuanSun(pressure, ion_moles, parameters="DuanSun"):
     """
     Use Duan and Sun (2006) model to calculate CO2 solubility over a temperature range.
+    parameters selects the coefficient set ('DuanSun' or 'Guo').
     Returns dict with lists for 'Temperature (K)' and 'Dissolved CO2 (mol/kg)'.
     """
 
-    model = DuanSun2006.DuanSun2006()
+    model = DuanSun2006.shared_model
 
     T_start = 273.15  # 0°C
     T_end = 573.15  # 100°C
     T_step = 5.0  # 5K steps
 
     result = model.calculate_varying_temperature(
-        T_start, T_end, T_step, pressure, ion_moles, model="DuanSun"
+        T_start, T_end, T_step, pressure, ion_moles, model=parameters
     )
 
     return result
 
 
+@cached_simulation(templates=("co2_brine_var_pressure_template.pqi",))
 def simulate_co2_brine_var_p(temperature, ion_moles, model):
     if model == "phreeqc_phreeqc":
         result = _simulate_varying_pressure_PHREEQC(
@@ -298,15 +309,30 @@ def simulate_co2_brine_var_p(temperature, ion_moles, model):
     elif model == "duan_sun_2006":
         print("using duan sun model", flush=True)
         result = _simulate_varying_pressure_DuanSun(temperature, ion_moles)
+    elif model == "duan_sun_guo":
+        result = _simulate_varying_pressure_DuanSun(
+            temperature, ion_moles, parameters="Guo"
+        )
+    elif model in TABLE_MODELS:
+        result = _simulate_varying_pressure_table(
+            temperature, ion_moles, database=TABLE_MODELS[model]
+        )
 
     elif model == "carbonex":
-        results = _simulate_varying_pressure_Carbonex(temperature, ion_moles)
+        result = _simulate_varying_pressure_Carbonex(temperature, ion_moles)
     else:
         result = {"Pressure (MPa)": [], "Dissolved CO2 (mol/kg)": []}
 
     return result
 
 
+@cached_simulation(
+    templates=(
+        "co2_brine_state_batch_template.pqi",
+        "co2_brine_state_block.pqi",
+        "co2_brine_template.pqi",
+    )
+)
 def simulate_co2_brine_var_t(pressure, ion_moles, model):
     """
     Simulate CO2 solubility over a range of temperatures at fixed pressure.
@@ -314,7 +340,8 @@ def simulate_co2_brine_var_t(pressure, ion_moles, model):
     Parameters:
         pressure: Fixed pressure in MPa
         ion_moles: Dictionary of ion molalities
-        model: Model to use ('phreeqc_phreeqc', 'phreeqc_pitzer', 'duan_sun_2006', 'carbonex')
+        model: Model to use ('phreeqc_phreeqc', 'phreeqc_pitzer', 'duan_sun_2006',
+            'duan_sun_guo', 'carbonex', or a '*_table' variant of the PHREEQC models)
 
     Returns:
         dict: Contains 'Temperature (K)' and 'Dissolved CO2 (mol/kg)' lists
@@ -333,6 +360,14 @@ def simulate_co2_brine_var_t(pressure, ion_moles, model):
         )
     elif model == "duan_sun_2006":
         result = _simulate_varying_temperature_DuanSun(pressure, ion_moles)
+    elif model == "duan_sun_guo":
+        result = _simulate_varying_temperature_DuanSun(
+            pressure, ion_moles, parameters="Guo"
+        )
+    elif model in TABLE_MODELS:
+        result = _simulate_varying_temperature_table(
+            pressure, ion_moles, database=TABLE_MODELS[model]
+        )
     elif model == "carbonex":
         result = _simulate_varying_temperature_Carbonex(pressure, ion_moles)
     else:
@@ -342,85 +377,74 @@ def simulate_co2_brine_var_t(pressure, ion_moles, model):
     return result
 
 
-def _run_PHREEQC_state_simulation(temperature, pressure, species, database):
-    temp_files_path = tempfile.gettempdir()
-    Na = species.get("Na+", 0)
-    Cl = species.get("Cl-", 0)
-    Mg = species.get("Mg+2", 0)
-    Ca = species.get("Ca+2", 0)
-    K = species.get("K+", 0)
-    SO4 = species.get("SO4-2", 0)
-    HCO3 = species.get("HCO3-", 0)
-    CO3 = species.get("CO3-2", 0)
-
-    pressure_atm = pressure * 9.86923
-    temperature_c = temperature - 273.15
-    p_co2 = pressure_atm * 0.95
-    p_h2o = pressure_atm * 0.05
-
-    # Define the output file path consistently
-    state_out_file = os.path.join(temp_files_path, "state_out.tsv")
-
-    # Load the PHREEQC template
-    template_path = os.path.join("phreeqc_programs", "co2_brine_template.pqi")
-    with open(template_path, "r") as template_file:
-        phreeqc_code = template_file.read()
-
-    # Replace template placeholders with actual values
-    phreeqc_code = phreeqc_code.replace(
-        "__DATABASE__", f"/usr/local/share/doc/phreeqc/database/{database}.dat"
-    )
-    phreeqc_code = phreeqc_code.replace("__TEMPERATURE__", str(temperature_c))
-    phreeqc_code = phreeqc_code.replace("__NA__", str(Na))
-    phreeqc_code = phreeqc_code.replace("__CL__", str(Cl))
-    phreeqc_code = phreeqc_code.replace("__CA__", str(Ca))
-    phreeqc_code = phreeqc_code.replace("__MG__", str(Mg))
-    phreeqc_code = phreeqc_code.replace("__K__", str(K))
-    phreeqc_code = phreeqc_code.replace("__SO4__", str(SO4))
-    phreeqc_code = phreeqc_code.replace("__HCO3__", str(HCO3))
-    phreeqc_code = phreeqc_code.replace("__PRESSURE_ATM__", str(pressure_atm))
-    phreeqc_code = phreeqc_code.replace("__P_CO2__", str(p_co2))
-    phreeqc_code = phreeqc_code.replace("__P_H2O__", str(p_h2o))
-    phreeqc_code = phreeqc_code.replace("__OUTPUT_FILE__", state_out_file)
-
-    filename = os.path.join(temp_files_path, "state_out.pqi")
-
-    pqi = open(filename, "w")
-    pqi.write(phreeqc_code)
-    pqi.close()
-
-    # Run phreeqc with full paths
-    subprocess.run(
-        ["phreeqc", filename, filename.replace(".pqi", ".pqo")],
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.STDOUT,
-    )
+# PHREEQC models of the sweeps, mapped to their database
+PHREEQC_MODELS = {
+    "phreeqc_phreeqc": "phreeqc",
+    "phreeqc_pitzer": "pitzer",
+    "phreeqc_pitzer_mod": "pitzer_mod",
+}
 
-    # Make sure the file exists before trying to read it
-    if not os.path.exists(state_out_file):
-        raise FileNotFoundError(f"Output file not found: {state_out_file}")
 
-    # Initialize results with a default empty dictionary
-    results = {}
+def stream_co2_brine_var_t(pressure, ion_moles, model):
+    """
+    Yield the (temperature, dissolved CO2) points of simulate_co2_brine_var_t
+    as soon as each one is computed.
+
+    The PHREEQC models run every temperature as its own job on the parallel
+    workers and yield the points in the order they finish; the other models
+    are fast enough to compute the whole sweep first.  A cached sweep is
+    replayed at once, and a stream that runs to the end without a failed
+    point is cached as the sweep would have been.
+    """
+    result = simulate_co2_brine_var_t.lookup(pressure, ion_moles, model)
+    if result is None and model in PHREEQC_MODELS:
+        temperatures = _PHREEQC_sweep_temperatures()
+        trapped_co2_values = [None] * len(temperatures)
+        complete = True
+        for i, trapped_co2 in parallel_as_completed(
+            _run_PHREEQC_state_point,
+            [
+                (temperature, pressure, ion_moles, PHREEQC_MODELS[model])
+                for temperature in temperatures
+            ],
+        ):
+            if isinstance(trapped_co2, Exception):
+                print(f"Error at temperature {temperatures[i]}: {trapped_co2}", flush=True)
+                complete = False
+                continue
+            if trapped_co2 is None:
+                complete = False
+                continue
+            trapped_co2_values[i] = trapped_co2
+            yield temperatures[i], trapped_co2
 
-    # Read the output file to get the CO2 concentration
-    try:
-        with open(state_out_file, mode="r") as file:
-            reader = csv.DictReader(file, delimiter="\t")
-            # Clean column names by stripping spaces
-            if reader.fieldnames:
-                fieldnames = [field.strip() for field in reader.fieldnames]
-                reader = csv.DictReader(file, fieldnames=fieldnames, delimiter="\t")
-                next(reader)  # Skip header row
-
-                # Get the last row (final simulation state)
-                for row in reader:
-                    results = row  # Will keep the last row
-                    # print(results)
+        result = {"Temperature (K)": [], "Dissolved CO2 (mol/kg)": []}
+        for temperature, trapped_co2 in zip(temperatures, trapped_co2_values):
+            if trapped_co2 is None:
+                continue
+            result["Temperature (K)"].append(temperature)
+            result["Dissolved CO2 (mol/kg)"].append(trapped_co2)
+        if complete:
+            simulate_co2_brine_var_t.store(result, pressure, ion_moles, model)
+        return
+
+    if result is None:
+        result = simulate_co2_brine_var_t(pressure, ion_moles, model)
+    yield from zip(result["Temperature (K)"], result["Dissolved CO2 (mol/kg)"])
 
-    except Exception as e:
-        print(f"Error reading {state_out_file}: {str(e)}", flush=True)
-        raise
+
+def _run_PHREEQC_state_simulation(temperature, pressure, species, database):
+    phreeqc_code = render(
+        "co2_brine_template.pqi",
+        SimulationParameters(
+            temperature=temperature, pressure=pressure, species=species
+        ),
+    )
+
+    # Get the last row (final simulation state)
+    results = run_phreeqc(
+        phreeqc_code, database, name="state_out", last_only=True
+    ).last()
 
     # Extract the C(4) value (dissolved CO2)
     try:
@@ -431,45 +455,665 @@ def _run_PHREEQC_state_simulation(temperature, pressure, species, database):
     return trapped_co2
 
 
-def _run_Duan_Sun_state_simulation(temperature, pressure, species):
+def _run_PHREEQC_state_batch(states, species, database):
+    """
+    Run several (temperature, pressure) states of one brine as one PHREEQC job.
+
+    Each state is written as its own SOLUTION n / GAS_PHASE n simulation,
+    numbered from 1, so the rows of the single SELECTED_OUTPUT can be matched
+    back to their state through the 'soln' column.
+
+    Parameters:
+        states: List of (temperature in Kelvin, pressure in MPa) tuples
+        species: Dictionary of ion molalities
+        database: PHREEQC database name
+
+    Returns:
+        list: Dissolved CO2 (mol/kg) per state, None where PHREEQC produced
+        no equilibrated row for it
+    """
+    blocks = [
+        render(
+            "co2_brine_state_block.pqi",
+            SimulationParameters(
+                temperature=temperature,
+                pressure=pressure,
+                species=species,
+                state=state,
+            ),
+        )
+        for state, (temperature, pressure) in enumerate(states, start=1)
+    ]
+    phreeqc_code = render(
+        "co2_brine_state_batch_template.pqi", STATE_BLOCKS="\n".join(blocks)
+    )
+
+    output = run_phreeqc(phreeqc_code, database, name="state_batch")
+
+    trapped_co2_values = [None] * len(states)
+    for row in output.records():
+        # Only the equilibrated rows; 'i_soln' rows hold the initial solution
+        if str(row.get("state", "")).strip() != "react":
+            continue
+        try:
+            index = int(float(row.get("soln", 0))) - 1
+            trapped_co2 = float(row.get("C(4)", 0))
+        except (ValueError, TypeError):
+            continue
+        if 0 <= index < len(states):
+            trapped_co2_values[index] = trapped_co2
+
+    return trapped_co2_values
+
+
+def _run_PHREEQC_state_point(temperature, pressure, species, database):
+    """
+    Dissolved CO2 of one state as a one-state batch, falling back to the
+    single-state template as the sweeps do; None if both produce nothing.
+    """
+    try:
+        trapped_co2 = _run_PHREEQC_state_batch(
+            [(temperature, pressure)], species, database
+        )[0]
+    except Exception as e:
+        print(f"Error at temperature {temperature}: {e}", flush=True)
+        trapped_co2 = None
+    if trapped_co2 is None:
+        trapped_co2 = _run_PHREEQC_state_simulation(
+            temperature, pressure, species, database
+        )
+    return trapped_co2
+
+
+def _run_Duan_Sun_state_simulation(temperature, pressure, species, parameters="DuanSun"):
     # Use Duan and Sun (2006) model to calculate dissolved CO2
-    model = DuanSun2006.DuanSun2006()
+    model = DuanSun2006.shared_model
     try:
         # calculate_CO2_solubility expects P in MPa, T in Kelvin, ion molalities dict
         trapped_co2 = model.calculate_CO2_solubility(
-            pressure, temperature, species, model="DuanSun"
+            pressure, temperature, species, model=parameters
         )
     except Exception:
         trapped_co2 = 0
     return trapped_co2
 
 
+def _run_Carbonex_state_simulation(temperature, pressure, species):
+    trapped_co2 = float(carbonex.solubility(pressure, temperature, species))
+    # Outside the EOS ranges, as the Duan and Sun state simulation
+    return trapped_co2 if np.isfinite(trapped_co2) else 0
+
+
+@cached_simulation(templates=("co2_brine_template.pqi",))
 def simulate_co2_brine_fixed(temperature, pressure, species, model):
     """
     Run simulation for fixed conditions and return only dissolved CO2.
+
+    The PHREEQC models, and the '*_table' models outside their table, take
+    it from the cached simulate_co2_brine_state run, so a state endpoint
+    call at the same conditions does not run PHREEQC again.
     """
     trapped_co2 = 0  # Default value
-    
-    if model == "phreeqc_phreeqc":
-        trapped_co2 = _run_PHREEQC_state_simulation(
-            temperature, pressure, species, database="phreeqc"
-        )
-    elif model == "phreeqc_pitzer":
-        trapped_co2 = _run_PHREEQC_state_simulation(
-            temperature, pressure, species, database="pitzer"
-        )
-    elif model == "phreeqc_pitzer_mod":
-        trapped_co2 = _run_PHREEQC_state_simulation(
-            temperature, pressure, species, database="pitzer_mod"
-        )
+
+    if model in PHREEQC_MODELS:
+        trapped_co2 = simulate_co2_brine_state(
+            temperature, pressure, species, model
+        )["trapped_co2"]
     elif model == "duan_sun_2006":
         trapped_co2 = _run_Duan_Sun_state_simulation(temperature, pressure, species)
+    elif model == "duan_sun_guo":
+        trapped_co2 = _run_Duan_Sun_state_simulation(
+            temperature, pressure, species, parameters="Guo"
+        )
+    elif model in TABLE_MODELS:
+        trapped_co2 = lookup(TABLE_MODELS[model], temperature, pressure, species)
+        if trapped_co2 is not None and np.isfinite(trapped_co2):
+            trapped_co2 = float(trapped_co2)
+        else:
+            trapped_co2 = simulate_co2_brine_state(
+                temperature, pressure, species, model
+            )["trapped_co2"]
     elif model == "carbonex":
-        trapped_co2 = 3
+        trapped_co2 = _run_Carbonex_state_simulation(temperature, pressure, species)
     else:
         # Default to phreeqc if model is not recognized
-        trapped_co2 = _run_PHREEQC_state_simulation(
-            temperature, pressure, species, database="phreeqc"
-        )
+        trapped_co2 = simulate_co2_brine_state(
+            temperature, pressure, species, "phreeqc_phreeqc"
+        )["trapped_co2"]
 
     return trapped_co2
+
+
+# Database of the solution properties of the models that do not run PHREEQC
+STATE_PROPERTIES_DATABASE = "pitzer"
+
+
+@cached_simulation(
+    templates=("co2_brine_template.pqi",), databases=(STATE_PROPERTIES_DATABASE,)
+)
+def simulate_co2_brine_state(temperature, pressure, species, model):
+    """
+    Dissolved CO2 and solution properties at one state from a single
+    PHREEQC equilibrium.
+
+    The PHREEQC and '*_table' models run the equilibrium with their own
+    database, and their dissolved CO2 comes from that same run (the table
+    is interpolated first).  carbonex computes both without PHREEQC (see
+    carbonex.solution_properties).  The other models keep their own
+    dissolved CO2, and the solution properties come from
+    STATE_PROPERTIES_DATABASE.
+
+    Parameters:
+        temperature: Temperature in Kelvin
+        pressure: Pressure in MPa
+        species: Dictionary of ion molalities
+        model: Model to use (see simulate_co2_brine_var_p)
+
+    Returns:
+        dict: 'trapped_co2' (mol/kg), the solution properties of
+        selected_output.solution_properties ('species_data', 'density',
+        'ionic_strength', 'pH', 'osmotic_coefficient',
+        'partial_pressure_co2', 'fugacity_co2'; carbonex adds
+        'activity_of_water') and the 'properties_database' they come from
+    """
+    if model == "carbonex":
+        return {
+            **carbonex.solution_properties(pressure, temperature, species),
+            "properties_database": "carbonex",
+        }
+
+    if model in PHREEQC_MODELS:
+        database = PHREEQC_MODELS[model]
+    elif model in TABLE_MODELS:
+        database = TABLE_MODELS[model]
+    else:
+        database = STATE_PROPERTIES_DATABASE
+
+    phreeqc_code = render(
+        "co2_brine_template.pqi",
+        SimulationParameters(
+            temperature=temperature, pressure=pressure, species=species
+        ),
+    )
+    results = run_phreeqc(phreeqc_code, database, name="state", last_only=True).last()
+
+    trapped_co2 = None
+    if model in TABLE_MODELS:
+        trapped_co2 = lookup(database, temperature, pressure, species)
+        if trapped_co2 is not None and not np.isfinite(trapped_co2):
+            trapped_co2 = None
+    elif model not in PHREEQC_MODELS:
+        trapped_co2 = simulate_co2_brine_fixed(temperature, pressure, species, model)
+    if trapped_co2 is None:
+        try:
+            trapped_co2 = float(results.get("C(4)", 0))
+        except (ValueError, TypeError):
+            trapped_co2 = 0
+
+    return {
+        "trapped_co2": float(trapped_co2),
+        **solution_properties(results),
+        "properties_database": database,
+    }
+
+
+# Models with a closed form that can be inverted, mapped to their
+# DuanSun2006 parameter set
+INVERSE_MODELS = {"duan_sun_2006": "DuanSun", "duan_sun_guo": "Guo"}
+
+
+def solve_co2_brine_inverse(
+    target, ion_moles, solve_for, temperature=None, pressure=None, model="duan_sun_2006"
+):
+    """
+    Find the pressure or temperature at which a brine holds a target dissolved CO2.
+
+    Parameters:
+        target: Target dissolved CO2 in mol/kg, or a list of targets
+        ion_moles: Dictionary of ion molalities
+        solve_for: 'pressure' (at the given temperature) or 'temperature' (at
+            the given pressure)
+        temperature: Temperature in Kelvin, when solving for pressure
+        pressure: Pressure in MPa, when solving for temperature
+        model: Model to invert (see INVERSE_MODELS)
+
+    Returns:
+        dict: 'Dissolved CO2 (mol/kg)' targets, the 'Pressure (MPa)' or
+        'Temperature (K)' that reaches each of them (None when it is not
+        reached within the search interval) and 'Converged' flags
+    """
+    if model not in INVERSE_MODELS:
+        raise ValueError(f"Inverse solving is not available for model '{model}'")
+
+    targets = np.atleast_1d(np.asarray(target, dtype=np.float64))
+    duan_sun = DuanSun2006.shared_model
+    if solve_for == "pressure":
+        if temperature is None:
+            raise ValueError("A temperature is required to solve for pressure")
+        values, converged = duan_sun.solve_pressure(
+            targets, temperature, ion_moles, model=INVERSE_MODELS[model]
+        )
+        key = "Pressure (MPa)"
+    elif solve_for == "temperature":
+        if pressure is None:
+            raise ValueError("A pressure is required to solve for temperature")
+        values, converged = duan_sun.solve_temperature(
+            targets, pressure, ion_moles, model=INVERSE_MODELS[model]
+        )
+        key = "Temperature (K)"
+    else:
+        raise ValueError(
+            f"solve_for must be 'pressure' or 'temperature', not '{solve_for}'"
+        )
+
+    return {
+        "Dissolved CO2 (mol/kg)": targets.tolist(),
+        key: [None if np.isnan(value) else value for value in values.tolist()],
+        "Converged": converged.tolist(),
+    }
+
+
+# Default shared axes of compare_co2_brine_models: the Duan and Sun sweep points
+COMPARE_PRESSURES = np.arange(0.1, 50.0 + 1, 1)
+COMPARE_TEMPERATURES = np.arange(273.15, 573.15 + 5.0, 5.0)
+
+# Model sweeps of one comparison run side by side in these threads; the
+# PHREEQC jobs inside each sweep still go to the parallel workers
+_compare_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="compare")
+
+
+def _align(result, axis_key, axis):
+    """Interpolate one model sweep onto the shared axis; None outside its range."""
+    points = sorted(
+        (float(x), float(y))
+        for x, y in zip(result.get(axis_key, []), result.get("Dissolved CO2 (mol/kg)", []))
+        if x is not None and y is not None and np.isfinite(x) and np.isfinite(y)
+    )
+    if not points:
+        return [None] * len(axis)
+    x, y = np.array(points).T
+    aligned = np.interp(axis, x, y)
+    inside = (axis >= x[0] - 1e-9) & (axis <= x[-1] + 1e-9)
+    return [float(value) if ok else None for value, ok in zip(aligned, inside)]
+
+
+def compare_co2_brine_models(
+    sweep, ion_moles, models, temperature=None, pressure=None, axis=None
+):
+    """
+    Run the var-P or var-T sweep of several models concurrently and align them.
+
+    Each model runs through simulate_co2_brine_var_p/var_t (and so through
+    the result cache) in its own thread, so the comparison takes as long as
+    the slowest model rather than the sum of all of them.  The sweeps do not
+    share points (PHREEQC pressures follow the gas phase, for example), so
+    every model is interpolated linearly onto one shared axis.
+
+    Parameters:
+        sweep: 'pressure' (at the given temperature) or 'temperature' (at the
+            given pressure)
+        ion_moles: Dictionary of ion molalities
+        models: List of model names (see simulate_co2_brine_var_p)
+        temperature: Fixed temperature in Kelvin, for a pressure sweep
+        pressure: Fixed pressure in MPa, for a temperature sweep
+        axis: Shared pressures (MPa) or temperatures (K); defaults to
+            COMPARE_PRESSURES or COMPARE_TEMPERATURES
+
+    Returns:
+        dict: the shared axis under 'Pressure (MPa)' or 'Temperature (K)',
+        'Dissolved CO2 (mol/kg)' mapping every model to its values on that
+        axis (None outside the range the model covered), and 'errors'
+        mapping models that failed to their error message
+    """
+    if sweep == "pressure":
+        if temperature is None:
+            raise ValueError("A temperature is required for a pressure sweep")
+        axis_key = "Pressure (MPa)"
+        simulate, fixed = simulate_co2_brine_var_p, temperature
+        default_axis = COMPARE_PRESSURES
+    elif sweep == "temperature":
+        if pressure is None:
+            raise ValueError("A pressure is required for a temperature sweep")
+        axis_key = "Temperature (K)"
+        simulate, fixed = simulate_co2_brine_var_t, pressure
+        default_axis = COMPARE_TEMPERATURES
+    else:
+        raise ValueError(f"sweep must be 'pressure' or 'temperature', not '{sweep}'")
+
+    axis = np.asarray(default_axis if axis is None else axis, dtype=np.float64)
+    models = list(dict.fromkeys(models))
+    split = ProgressSplit()
+    futures = {
+        model: split.submit(_compare_executor, simulate, fixed, ion_moles, model)
+        for model in models
+    }
+
+    values = {}
+    errors = {}
+    for model, future in futures.items():
+        try:
+            values[model] = _align(future.result(), axis_key, axis)
+        except Exception as e:
+            print(f"Error comparing model {model}: {e}", flush=True)
+            errors[model] = str(e)
+            values[model] = [None] * len(axis)
+    split.raise_if_stopped()
+
+    return {
+        axis_key: axis.tolist(),
+        "Dissolved CO2 (mol/kg)": values,
+        "errors": errors,
+    }
+
+
+# Default axes and largest resolution of simulate_co2_brine_pt_map; the
+# defaults are the grid of the DuanSun2006.py example
+PT_MAP_TEMPERATURE_RANGE = (280.0, 480.0)
+PT_MAP_PRESSURE_RANGE = (0.5, 50.0)
+PT_MAP_MAX_POINTS = 500
+
+# States per PHREEQC job of a pressure-temperature map
+_PT_MAP_BATCH_SIZE = 50
+
+
+def _pt_map_PHREEQC(temperatures, pressures, ion_moles, database, cells=None):
+    """
+    Dissolved CO2 on a temperature x pressure grid via PHREEQC.
+
+    The cells (all of them by default) run as state batches of
+    _PT_MAP_BATCH_SIZE spread over the parallel workers; states a batch
+    could not equilibrate are retried one by one, and left NaN if they fail.
+    """
+    values = np.full((len(temperatures), len(pressures)), np.nan)
+    if cells is None:
+        cells = [
+            (i, j) for i in range(len(temperatures)) for j in range(len(pressures))
+        ]
+
+    chunks = [
+        cells[start : start + _PT_MAP_BATCH_SIZE]
+        for start in range(0, len(cells), _PT_MAP_BATCH_SIZE)
+    ]
+    batches = parallel_starmap(
+        _run_PHREEQC_state_batch,
+        [
+            (
+                [(float(temperatures[i]), float(pressures[j])) for i, j in chunk],
+                ion_moles,
+                database,
+            )
+            for chunk in chunks
+        ],
+    )
+
+    missing = []
+    for chunk, batch in zip(chunks, batches):
+        if isinstance(batch, Exception):
+            print(f"Error in pressure-temperature map: {batch}", flush=True)
+            batch = [None] * len(chunk)
+        for (i, j), trapped_co2 in zip(chunk, batch):
+            if trapped_co2 is None:
+                missing.append((i, j))
+            else:
+                values[i, j] = trapped_co2
+
+    retried = parallel_starmap(
+        _run_PHREEQC_state_simulation,
+        [
+            (float(temperatures[i]), float(pressures[j]), ion_moles, database)
+            for i, j in missing
+        ],
+    )
+    for (i, j), trapped_co2 in zip(missing, retried):
+        if isinstance(trapped_co2, Exception):
+            print(
+                f"Error at {temperatures[i]} K, {pressures[j]} MPa: {trapped_co2}",
+                flush=True,
+            )
+            mark_incomplete()
+            continue
+        values[i, j] = trapped_co2
+    return values
+
+
+def _pt_map_table(temperatures, pressures, ion_moles, database):
+    """
+    Dissolved CO2 on a temperature x pressure grid from the precomputed
+    table of a database; cells outside the table go through PHREEQC.
+    """
+    values = lookup(database, temperatures[:, None], pressures[None, :], ion_moles)
+    if values is None:
+        return _pt_map_PHREEQC(temperatures, pressures, ion_moles, database)
+
+    outside = [tuple(cell) for cell in np.argwhere(~np.isfinite(values)).tolist()]
+    if outside:
+        filled = _pt_map_PHREEQC(
+            temperatures, pressures, ion_moles, database, cells=outside
+        )
+        values = np.where(np.isfinite(values), values, filled)
+    return values
+
+
+def _pt_map_axis(bounds, points, default_bounds, name):
+    start, end = default_bounds if bounds is None else bounds
+    points = int(points)
+    if not 2 <= points <= PT_MAP_MAX_POINTS:
+        raise ValueError(
+            f"The {name} resolution must be between 2 and {PT_MAP_MAX_POINTS} points"
+        )
+    if not start < end:
+        raise ValueError(f"The {name} range must be increasing")
+    return np.linspace(float(start), float(end), points)
+
+
+@cached_simulation(
+    templates=(
+        "co2_brine_state_batch_template.pqi",
+        "co2_brine_state_block.pqi",
+        "co2_brine_template.pqi",
+    )
+)
+def simulate_co2_brine_pt_map(
+    ion_moles,
+    model,
+    temperature_range=None,
+    pressure_range=None,
+    temperature_points=50,
+    pressure_points=50,
+):
+    """
+    Map CO2 solubility over a temperature x pressure grid for one brine.
+
+    The Duan and Sun and carbonex models evaluate the whole grid in a single
+    vectorized call; the PHREEQC models run it as state batches on the parallel
+    workers, and the '*_table' models interpolate their table and only run
+    PHREEQC for the cells outside it.
+
+    Parameters:
+        ion_moles: Dictionary of ion molalities
+        model: Model to use (see simulate_co2_brine_var_p)
+        temperature_range: (lowest, highest) temperature in Kelvin; defaults
+            to PT_MAP_TEMPERATURE_RANGE
+        pressure_range: (lowest, highest) pressure in MPa; defaults to
+            PT_MAP_PRESSURE_RANGE
+        temperature_points, pressure_points: Resolution of each axis, at most
+            PT_MAP_MAX_POINTS
+
+    Returns:
+        dict: 'temperatures' (K) and 'pressures' (MPa) of the grid, and
+        'values', one row of dissolved CO2 (mol/kg) per temperature with
+        None where the model has no result
+    """
+    temperatures = _pt_map_axis(
+        temperature_range, temperature_points, PT_MAP_TEMPERATURE_RANGE, "temperature"
+    )
+    pressures = _pt_map_axis(
+        pressure_range, pressure_points, PT_MAP_PRESSURE_RANGE, "pressure"
+    )
+
+    if model in INVERSE_MODELS:
+        # Closed form: the whole grid in one call
+        values = DuanSun2006.shared_model.calculate_CO2_solubility_array(
+            pressures[None, :],
+            temperatures[:, None],
+            ion_moles,
+            model=INVERSE_MODELS[model],
+        )
+    elif model == "carbonex":
+        values = carbonex.solubility(
+            pressures[None, :], temperatures[:, None], ion_moles
+        )
+    elif model == "phreeqc_phreeqc":
+        values = _pt_map_PHREEQC(temperatures, pressures, ion_moles, "phreeqc")
+    elif model == "phreeqc_pitzer":
+        values = _pt_map_PHREEQC(temperatures, pressures, ion_moles, "pitzer")
+    elif model == "phreeqc_pitzer_mod":
+        values = _pt_map_PHREEQC(temperatures, pressures, ion_moles, "pitzer_mod")
+    elif model in TABLE_MODELS:
+        values = _pt_map_table(
+            temperatures, pressures, ion_moles, database=TABLE_MODELS[model]
+        )
+    else:
+        raise ValueError(f"Pressure-temperature maps are not available for model '{model}'")
+
+    values = np.broadcast_to(values, (len(temperatures), len(pressures)))
+    return {
+        "temperatures": temperatures.tolist(),
+        "pressures": pressures.tolist(),
+        "values": np.where(np.isfinite(values), values, None).tolist(),
+    }
+
+
+def _batch_closed_form(unique, model):
+    """Dissolved CO2 of every unique state in one vectorized call."""
+    ions = sorted({ion for state in unique for ion in state["concentrations"]})
+    pressures = np.array([state["pressure"] for state in unique])
+    temperatures = np.array([state["temperature"] for state in unique])
+    molalities = {
+        ion: np.array([state["concentrations"].get(ion, 0.0) for state in unique])
+        for ion in ions
+    }
+    if model == "carbonex":
+        return carbonex.solubility(pressures, temperatures, molalities)
+    return DuanSun2006.shared_model.calculate_CO2_solubility_array(
+        pressures, temperatures, molalities, model=INVERSE_MODELS[model]
+    )
+
+
+def _batch_PHREEQC(unique, positions, model, database):
+    """
+    Dissolved CO2 of the unique states at positions via PHREEQC, reusing
+    and filling the cache of simulate_co2_brine_fixed state by state.
+    """
+    values = {}
+    to_run = []
+    for position in positions:
+        state = unique[position]
+        trapped_co2 = simulate_co2_brine_fixed.lookup(
+            state["temperature"], state["pressure"], state["concentrations"], model
+        )
+        if trapped_co2 is None:
+            to_run.append(position)
+        else:
+            values[position] = trapped_co2
+
+    computed, errors = run_state_batches(
+        _run_PHREEQC_state_batch,
+        _run_PHREEQC_state_simulation,
+        unique,
+        to_run,
+        ("concentrations",),
+        database,
+    )
+    for position, trapped_co2 in computed.items():
+        state = unique[position]
+        simulate_co2_brine_fixed.store(
+            trapped_co2,
+            state["temperature"],
+            state["pressure"],
+            state["concentrations"],
+            model,
+        )
+    values.update(computed)
+    return values, errors
+
+
+def _batch_table(unique, model, database):
+    """
+    Dissolved CO2 of the unique states from the precomputed table of a
+    database, one interpolation per brine; states outside the table go
+    through PHREEQC.
+    """
+    values = {}
+    outside = []
+    for (species,), group in group_states(unique):
+        trapped_co2 = lookup(
+            database,
+            np.array([unique[position]["temperature"] for position in group]),
+            np.array([unique[position]["pressure"] for position in group]),
+            species,
+        )
+        if trapped_co2 is None:
+            outside.extend(group)
+            continue
+        for position, value in zip(group, np.atleast_1d(trapped_co2).tolist()):
+            if np.isfinite(value):
+                values[position] = value
+            else:
+                outside.append(position)
+
+    computed, errors = _batch_PHREEQC(unique, outside, model, database)
+    values.update(computed)
+    return values, errors
+
+
+def simulate_co2_brine_batch(states, model, concentrations=None):
+    """
+    Calculate dissolved CO2 for many independent (P, T, brine) states.
+
+    Identical states are computed once.  The Duan and Sun and carbonex
+    models evaluate all the states in a single vectorized call; the PHREEQC
+    models run them as state batches of one brine on the parallel workers,
+    and the '*_table' models interpolate their table and only run PHREEQC
+    for the states outside it.
+
+    Parameters:
+        states: List of dictionaries with 'temperature' (K), 'pressure'
+            (MPa) and optionally 'concentrations' (ion molalities)
+        model: Model to use (see simulate_co2_brine_var_p)
+        concentrations: Ion molalities of the states without their own
+
+    Returns:
+        dict: 'temperature', 'pressure', 'dissolved_co2' (mol/kg) and
+        'error' lists in the order of the states, where a state that is
+        invalid or that the model could not solve has a None dissolved CO2
+        and the reason in its error slot, and the count of 'unique_states'
+    """
+    unique, index, errors = parse_states(states, {"concentrations": concentrations})
+
+    if model in INVERSE_MODELS or model == "carbonex":
+        solubility = _batch_closed_form(unique, model) if unique else []
+        values = dict(enumerate(np.asarray(solubility, dtype=float).tolist()))
+        value_errors = {}
+    elif model in PHREEQC_MODELS:
+        values, value_errors = _batch_PHREEQC(
+            unique, list(range(len(unique))), model, PHREEQC_MODELS[model]
+        )
+    elif model in TABLE_MODELS:
+        values, value_errors = _batch_table(unique, model, TABLE_MODELS[model])
+    else:
+        raise ValueError(f"Batches are not available for model '{model}'")
+
+    results = []
+    result_errors = []
+    for position in range(len(unique)):
+        value = values.get(position)
+        if value is not None and not np.isfinite(value):
+            value = None
+        results.append(value)
+        result_errors.append(
+            None
+            if value is not None
+            else value_errors.get(position, "Outside the range of the model")
+        )
+    return columns(states, unique, index, errors, results, result_errors)
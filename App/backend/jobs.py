@@ -0,0 +1,326 @@
+"""
+Asynchronous jobs for long simulations.
+
+A sweep that runs PHREEQC over many states holds a synchronous gunicorn
+worker for its whole duration.  submit() instead hands the simulation to a
+small bounded pool of job threads and returns a job id at once; the client
+then polls get() (GET /jobs/<id>) for its status, progress and result, and
+the gunicorn workers stay free for short requests.
+
+Jobs are recorded in a local SQLite file shared by every gunicorn worker, so
+any worker can answer for, or cancel, a job another one is running.  A job
+goes through
+
+    queued -> running -> done | failed | cancelled
+
+and its progress is the (finished, total) count of the parallel_starmap call
+in flight (see parallel.progress_callback); co2-brine/compare sums it over
+its models.  Cancelling a queued job drops it; a running job stops at its
+next progress report, between points.
+
+Simulations that make no parallel_starmap call report no progress: they
+stay at done 0 of total 1 until they finish, and once running they cannot
+be cancelled.  These are the closed-form models (duan_sun_*, carbonex),
+interpolations wholly inside a '*_table' model, the single-run PHREEQC
+var-P sweeps and the single states (fixed, state, solution properties).
+Finished jobs are deleted CARBONEX_JOB_TTL seconds after they end.
+
+Every worker stamps a heartbeat on its queued and running jobs each
+CARBONEX_JOB_HEARTBEAT seconds.  A queued or running job whose heartbeat is
+older than _STALE_HEARTBEATS of them belonged to a worker that died; it is
+marked failed when a JobManager starts and whenever a job is read.
+
+Configuration (environment variables):
+    CARBONEX_JOB_STORE      path of the SQLite file (default
+                            carbonex_jobs.sqlite3 in the private directory
+                            of workspace.py)
+    CARBONEX_JOB_WORKERS    jobs running at the same time per gunicorn worker
+                            (default 2)
+    CARBONEX_JOB_QUEUE      queued jobs accepted per gunicorn worker (default 100)
+    CARBONEX_JOB_TTL        seconds a finished job is kept (default 1 hour)
+    CARBONEX_JOB_HEARTBEAT  seconds between two heartbeats of a worker's jobs
+                            (default 10)
+"""
+
+import inspect
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from parallel import progress_callback
+from workspace import private_directory, private_file
+
+CARBONEX_JOB_STORE = os.environ.get("CARBONEX_JOB_STORE")
+CARBONEX_JOB_WORKERS = int(os.environ.get("CARBONEX_JOB_WORKERS", "2"))
+CARBONEX_JOB_QUEUE = int(os.environ.get("CARBONEX_JOB_QUEUE", "100"))
+CARBONEX_JOB_TTL = float(os.environ.get("CARBONEX_JOB_TTL", "3600"))
+CARBONEX_JOB_HEARTBEAT = float(os.environ.get("CARBONEX_JOB_HEARTBEAT", "10"))
+
+# Missed heartbeats after which a queued or running job is taken as orphaned
+_STALE_HEARTBEATS = 6
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    simulation TEXT NOT NULL,
+    status TEXT NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    total INTEGER NOT NULL DEFAULT 0,
+    result BLOB,
+    error TEXT,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    heartbeat_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_finished_at ON jobs (finished_at);
+"""
+
+
+class JobError(ValueError):
+    """A job cannot be submitted (unknown simulation, bad arguments, full queue)."""
+
+
+class JobCancelled(Exception):
+    """Raised inside a running job whose cancellation was requested."""
+
+
+class JobManager:
+    """Runs registered simulations as jobs and records them in SQLite."""
+
+    def __init__(
+        self,
+        simulations,
+        path=CARBONEX_JOB_STORE,
+        workers=CARBONEX_JOB_WORKERS,
+        queue=CARBONEX_JOB_QUEUE,
+        ttl=CARBONEX_JOB_TTL,
+        heartbeat=CARBONEX_JOB_HEARTBEAT,
+    ):
+        self.simulations = dict(simulations)
+        self.path = path or os.path.join(private_directory(), "carbonex_jobs.sqlite3")
+        self.workers = max(1, workers)
+        self.queue = queue
+        self.ttl = ttl
+        self.heartbeat = heartbeat
+        self._heartbeat_thread = None
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="job"
+        )
+        self._futures = {}
+        self._futures_lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        private_file(self.path)
+        connection = self._connection()
+        connection.executescript(_SCHEMA)
+        columns = [row[1] for row in connection.execute("PRAGMA table_info(jobs)")]
+        if "heartbeat_at" not in columns:  # Store created before heartbeats
+            connection.execute("ALTER TABLE jobs ADD COLUMN heartbeat_at REAL")
+        self.fail_orphans()
+
+    def _connection(self):
+        # sqlite3 connections must stay on the thread that created them
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def purge(self):
+        """Delete the jobs that finished more than ttl seconds ago."""
+        self._connection().execute(
+            "DELETE FROM jobs WHERE finished_at < ?", (time.time() - self.ttl,)
+        )
+
+    def fail_orphans(self):
+        """Mark failed the queued and running jobs whose worker stopped beating."""
+        now = time.time()
+        self._connection().execute(
+            "UPDATE jobs SET status = 'failed', error = ?, finished_at = ? "
+            "WHERE status IN ('queued', 'running') "
+            "AND COALESCE(heartbeat_at, created_at) < ?",
+            (
+                "The worker running the job exited",
+                now,
+                now - _STALE_HEARTBEATS * self.heartbeat,
+            ),
+        )
+
+    def _beat(self):
+        connection = self._connection()
+        while True:
+            time.sleep(self.heartbeat)
+            with self._futures_lock:
+                job_ids = list(self._futures)
+            try:
+                connection.executemany(
+                    "UPDATE jobs SET heartbeat_at = ? WHERE id = ?",
+                    [(time.time(), job_id) for job_id in job_ids],
+                )
+            except sqlite3.Error as e:
+                print(f"Job heartbeat failed: {e}", flush=True)
+
+    def submit(self, simulation, arguments):
+        """
+        Queue a registered simulation and return the new job id.
+
+        Parameters:
+            simulation: Name the simulation was registered under
+            arguments: Dictionary of keyword arguments of the simulation
+
+        Raises:
+            JobError: if the simulation is unknown, the arguments do not fit
+                its signature or this worker's queue is full
+        """
+        function = self.simulations.get(simulation)
+        if function is None:
+            raise JobError(
+                f"Unknown simulation '{simulation}'; "
+                f"use one of {sorted(self.simulations)}"
+            )
+        try:
+            inspect.signature(function).bind(**(arguments or {}))
+        except TypeError as e:
+            raise JobError(f"Bad arguments for {simulation}: {e}") from None
+
+        with self._futures_lock:
+            if len(self._futures) >= self.queue + self.workers:
+                raise JobError("The job queue is full, try again later")
+
+            if self._heartbeat_thread is None:
+                self._heartbeat_thread = threading.Thread(
+                    target=self._beat, name="job-heartbeat", daemon=True
+                )
+                self._heartbeat_thread.start()
+
+            self.purge()
+            job_id = uuid.uuid4().hex
+            now = time.time()
+            self._connection().execute(
+                "INSERT INTO jobs (id, simulation, status, created_at, heartbeat_at) "
+                "VALUES (?, ?, 'queued', ?, ?)",
+                (job_id, simulation, now, now),
+            )
+            self._futures[job_id] = self._executor.submit(
+                self._run, job_id, function, arguments or {}
+            )
+        return job_id
+
+    def _run(self, job_id, function, arguments):
+        connection = self._connection()
+        try:
+            updated = connection.execute(
+                "UPDATE jobs SET status = 'running', started_at = ?, total = 1 "
+                "WHERE id = ? AND status = 'queued' AND cancel_requested = 0",
+                (time.time(), job_id),
+            ).rowcount
+            if not updated:
+                self._finish(job_id, "cancelled")
+                return
+
+            def report(done, total):
+                # Also called from the threads of a parallel.ProgressSplit
+                connection = self._connection()
+                connection.execute(
+                    "UPDATE jobs SET done = ?, total = ? WHERE id = ?",
+                    (done, total, job_id),
+                )
+                row = connection.execute(
+                    "SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)
+                ).fetchone()
+                if row is None or row[0]:
+                    raise JobCancelled(job_id)
+
+            with progress_callback(report):
+                result = function(**arguments)
+            connection.execute(
+                "UPDATE jobs SET done = total WHERE id = ?", (job_id,)
+            )
+            self._finish(
+                job_id,
+                "done",
+                result=pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL),
+            )
+        except JobCancelled:
+            self._finish(job_id, "cancelled")
+        except Exception as e:
+            print(f"Job {job_id} failed: {e}", flush=True)
+            self._finish(job_id, "failed", error=str(e))
+        finally:
+            with self._futures_lock:
+                self._futures.pop(job_id, None)
+
+    def _finish(self, job_id, status, result=None, error=None):
+        self._connection().execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? "
+            "WHERE id = ?",
+            (status, result, error, time.time(), job_id),
+        )
+
+    def get(self, job_id):
+        """
+        Return the status of a job, or None if it is unknown or expired.
+
+        Returns:
+            dict: 'job_id', 'simulation', 'status', 'progress' ({'done',
+            'total'}), 'created_at', 'started_at', 'finished_at', and the
+            'result' once done or the 'error' once failed
+        """
+        self.purge()
+        self.fail_orphans()
+        row = self._connection().execute(
+            "SELECT simulation, status, done, total, result, error, "
+            "created_at, started_at, finished_at FROM jobs WHERE id = ?",
+            (job_id,),
+        ).fetchone()
+        if row is None:
+            return None
+
+        simulation, status, done, total, result, error, created, started, finished = row
+        job = {
+            "job_id": job_id,
+            "simulation": simulation,
+            "status": status,
+            "progress": {"done": done, "total": total},
+            "created_at": created,
+            "started_at": started,
+            "finished_at": finished,
+        }
+        if status == "done":
+            job["result"] = pickle.loads(result)
+        elif status == "failed":
+            job["error"] = error
+        return job
+
+    def cancel(self, job_id):
+        """
+        Request the cancellation of a job.
+
+        Returns:
+            bool: False if the job is unknown or has already finished
+        """
+        updated = self._connection().execute(
+            "UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status IN "
+            "('queued', 'running')",
+            (job_id,),
+        ).rowcount
+        if not updated:
+            return False
+
+        # Queued here: drop it now instead of when a thread picks it up
+        with self._futures_lock:
+            future = self._futures.get(job_id)
+        if future is not None and future.cancel():
+            self._finish(job_id, "cancelled")
+            with self._futures_lock:
+                self._futures.pop(job_id, None)
+        return True
@@ -0,0 +1,269 @@
+"""
+Parallel execution of independent simulation points.
+
+Sweeps evaluate many (temperature, pressure) states that do not depend on
+each other.  parallel_starmap() fans such calls out over a pool of worker
+processes, so each CPU core runs its own PHREEQC job, and returns the
+results in the order of the inputs.
+
+A call that raises does not stop the others: its exception object is
+returned in its slot instead of a result, and the caller decides what a
+failed point becomes (skipped, zeroed, retried, ...).
+
+Configuration (environment variables):
+    CARBONEX_PARALLEL          "process" (default), "thread" or "off"
+    CARBONEX_PARALLEL_WORKERS  number of workers (default: CPU count)
+
+Code running a long simulation (see jobs.py) can follow it through
+progress_callback(): parallel_starmap() then calls the callback with
+(finished calls, total calls) as its calls complete.  An exception raised by
+the callback cancels the calls that have not started and propagates, which
+is how a cancelled job stops between points.  The callback belongs to the
+calling context, not to a thread: code that runs parts of a simulation on
+its own threads submits them through a ProgressSplit, which carries the
+callback over and sums their progress.
+
+Each gunicorn worker owns its own pool, so size CARBONEX_PARALLEL_WORKERS
+with the number of gunicorn workers in mind.  "thread" suits the pool
+engine (PHREEQC_ENGINE=pool), whose runs already happen in other processes.
+"""
+
+import atexit
+import contextlib
+import contextvars
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+CARBONEX_PARALLEL = os.environ.get("CARBONEX_PARALLEL", "process")
+CARBONEX_PARALLEL_WORKERS = int(
+    os.environ.get("CARBONEX_PARALLEL_WORKERS", str(os.cpu_count() or 1))
+)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# Progress callback of the simulation running in this context
+_progress = contextvars.ContextVar("carbonex_progress", default=None)
+
+
+def parallel_workers():
+    """Return how many points can run at the same time."""
+    if CARBONEX_PARALLEL == "off":
+        return 1
+    return max(1, CARBONEX_PARALLEL_WORKERS)
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            if CARBONEX_PARALLEL == "thread":
+                _executor = ThreadPoolExecutor(
+                    max_workers=parallel_workers(), thread_name_prefix="carbonex"
+                )
+            elif CARBONEX_PARALLEL == "process":
+                # spawn: the Flask process holds threads and IPhreeqc instances
+                # that must not be duplicated by fork
+                _executor = ProcessPoolExecutor(
+                    max_workers=parallel_workers(),
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            else:
+                raise ValueError(f"Unknown CARBONEX_PARALLEL mode '{CARBONEX_PARALLEL}'")
+        return _executor
+
+
+def _reset_executor(broken):
+    """Drop a process pool whose worker died, so the next call starts a new one."""
+    global _executor
+    with _executor_lock:
+        if _executor is broken:
+            _executor = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown():
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+atexit.register(shutdown)
+
+
+@contextlib.contextmanager
+def progress_callback(callback):
+    """Report the progress of the parallel_starmap calls of this context to callback."""
+    token = _progress.set(callback)
+    try:
+        yield
+    finally:
+        _progress.reset(token)
+
+
+def _report_progress(done, total):
+    callback = _progress.get()
+    if callback is not None:
+        callback(done, total)
+
+
+class ProgressSplit:
+    """
+    Run parts of a simulation on other threads under the progress callback
+    of the calling context.
+
+    The (done, total) reports of all the parts are summed and passed on to
+    that callback.  Once it raises (a cancelled job), every later report of
+    any part raises the same exception, so all of them stop at their next
+    point, and raise_if_stopped() raises it in the caller, which may have
+    caught it as the failure of a single part.
+    """
+
+    def __init__(self):
+        self.callback = _progress.get()
+        self.stopped = None
+        self._parts = {}
+        self._lock = threading.Lock()
+
+    def submit(self, executor, function, *args):
+        """executor.submit(function, *args), reporting as one part of the split."""
+        part = object()
+
+        def run():
+            with progress_callback(lambda done, total: self._report(part, done, total)):
+                return function(*args)
+
+        return executor.submit(contextvars.copy_context().run, run)
+
+    def _report(self, part, done, total):
+        if self.callback is None:
+            return
+        with self._lock:
+            if self.stopped is not None:
+                raise self.stopped
+            self._parts[part] = (done, total)
+            done = sum(value[0] for value in self._parts.values())
+            total = sum(value[1] for value in self._parts.values())
+            try:
+                self.callback(done, total)
+            except Exception as e:
+                self.stopped = e
+                raise
+
+    def raise_if_stopped(self):
+        if self.stopped is not None:
+            raise self.stopped
+
+
+def split_evenly(items, parts):
+    """Split items into at most `parts` contiguous chunks of near-equal size."""
+    items = list(items)
+    parts = max(1, min(parts, len(items)))
+    size, extra = divmod(len(items), parts)
+    chunks = []
+    start = 0
+    for index in range(parts):
+        end = start + size + (1 if index < extra else 0)
+        chunks.append(items[start:end])
+        start = end
+    return [chunk for chunk in chunks if chunk]
+
+
+def parallel_starmap(function, argument_tuples):
+    """
+    Call function(*arguments) for every tuple and return the results in order.
+
+    Parameters:
+        function: Module-level function (it is pickled by reference for the
+            process pool)
+        argument_tuples: Iterable of positional argument tuples
+
+    Returns:
+        list: One entry per tuple, either the return value or the exception
+        raised by that call
+    """
+    argument_tuples = list(argument_tuples)
+    total = len(argument_tuples)
+    if total <= 1 or parallel_workers() == 1:
+        results = []
+        for arguments in argument_tuples:
+            _report_progress(len(results), total)
+            try:
+                results.append(function(*arguments))
+            except Exception as e:
+                results.append(e)
+        if total:
+            _report_progress(total, total)
+        return results
+
+    executor = _get_executor()
+    futures = [executor.submit(function, *arguments) for arguments in argument_tuples]
+
+    results = []
+    broken = False
+    try:
+        for future in futures:
+            try:
+                results.append(future.result())
+            except BrokenProcessPool as e:
+                broken = True
+                results.append(e)
+            except Exception as e:
+                results.append(e)
+            _report_progress(len(results), total)
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        raise
+
+    if broken:
+        _reset_executor(executor)
+    return results
+
+
+def parallel_as_completed(function, argument_tuples):
+    """
+    Like parallel_starmap(), but yield (index, result) pairs as calls finish.
+
+    Results come in completion order, index being the position of their
+    tuple; a call that raised yields its exception.  Closing the generator
+    early (e.g. when a streaming client disconnects) cancels the calls that
+    have not started.
+    """
+    argument_tuples = list(argument_tuples)
+    if len(argument_tuples) <= 1 or parallel_workers() == 1:
+        for index, arguments in enumerate(argument_tuples):
+            try:
+                result = function(*arguments)
+            except Exception as e:
+                result = e
+            yield index, result
+        return
+
+    executor = _get_executor()
+    futures = {
+        executor.submit(function, *arguments): index
+        for index, arguments in enumerate(argument_tuples)
+    }
+
+    broken = False
+    try:
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except BrokenProcessPool as e:
+                broken = True
+                result = e
+            except Exception as e:
+                result = e
+            yield futures[future], result
+    finally:
+        for future in futures:
+            future.cancel()
+        if broken:
+            _reset_executor(executor)
@@ -0,0 +1,242 @@
+"""
+PHREEQC engine backends.
+
+Every simulation renders a PHREEQC input script and hands it to an engine,
+which runs it against a thermodynamic database and returns the rows of the
+SELECTED_OUTPUT block.  Two engines are available:
+
+- ``subprocess``: forks the ``phreeqc`` binary, which re-parses the database
+  on every call, and reads the selected output back from a TSV file.
+- ``iphreeqc``: keeps the IPhreeqc shared library loaded in the Python
+  process (through the ``phreeqpy`` bindings).  Each database is parsed once
+  per thread and the selected output is returned straight from memory.
+
+A third engine, ``pool``, forwards runs to warm worker processes that keep
+their database loaded (see phreeqc_pool.py).
+
+The engine is chosen with the ``PHREEQC_ENGINE`` environment variable
+("subprocess", "iphreeqc", "pool" or "auto").  "auto", the default, uses
+IPhreeqc when the library can be loaded and falls back to the binary
+otherwise, so the ``model=`` strings accepted by the endpoints keep their
+meaning.
+
+Templates keep two placeholders for the engine to fill: ``__DATABASE__`` and
+``__OUTPUT_FILE__``.
+
+Callers that only need the final equilibrium state pass ``last_only=True``;
+the engines then read just the last row of the output (see
+selected_output.py).
+"""
+
+import os
+import re
+import subprocess
+import threading
+
+from selected_output import clean_value, read_last_row, read_rows, to_array
+from workspace import simulation_workspace
+
+PHREEQC_DATABASE_DIR = os.environ.get(
+    "PHREEQC_DATABASE_DIR", "/usr/local/share/doc/phreeqc/database"
+)
+PHREEQC_ENGINE = os.environ.get("PHREEQC_ENGINE", "auto")
+IPHREEQC_LIBRARY = os.environ.get("IPHREEQC_LIBRARY")
+
+_DATABASE_LINE = re.compile(r"^[ \t]*DATABASE[ \t].*$", re.MULTILINE)
+
+
+def database_path(database):
+    """Return the path of a PHREEQC database given its name (e.g. 'pitzer')."""
+    return os.path.join(PHREEQC_DATABASE_DIR, f"{database}.dat")
+
+
+class SelectedOutput:
+    """
+    Rows of a PHREEQC SELECTED_OUTPUT block held in memory.
+
+    Headings are stripped of PHREEQC's column padding.  Numbers are floats,
+    undefined numbers (-1.#IND and the like) are None and text columns stay
+    strings, whichever engine produced the rows.
+    """
+
+    def __init__(self, headings, rows):
+        self.headings = [str(heading).strip() for heading in headings]
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def records(self):
+        """Return every row as a dict keyed by column heading."""
+        return [dict(zip(self.headings, row)) for row in self.rows]
+
+    def last(self):
+        """Return the final row (final simulation state), or {} if empty."""
+        if not self.rows:
+            return {}
+        return dict(zip(self.headings, self.rows[-1]))
+
+    def column(self, heading):
+        """Return all values of one column."""
+        index = self.headings.index(heading)
+        return [row[index] for row in self.rows]
+
+    def array(self, heading):
+        """Return one column as a float64 array, NaN where undefined."""
+        return to_array(self.column(heading))
+
+
+def read_selected_output(path, last_only=False):
+    """Read a PHREEQC selected-output TSV file into a SelectedOutput."""
+    if last_only:
+        row = read_last_row(path)
+        return SelectedOutput(list(row), [list(row.values())] if row else [])
+    return SelectedOutput(*read_rows(path))
+
+
+class SubprocessEngine:
+    """
+    Run each input script with a fresh ``phreeqc`` process.
+
+    Files are written to a private scratch directory that is removed after
+    the run (see workspace.py), so concurrent runs never collide.
+    """
+
+    name = "subprocess"
+
+    def __init__(self, executable="phreeqc"):
+        self.executable = executable
+
+    def run(self, phreeqc_code, database, name="phreeqc", last_only=False):
+        with simulation_workspace(name) as work_dir:
+            input_file = os.path.join(work_dir, f"{name}.pqi")
+            output_file = os.path.join(work_dir, f"{name}.tsv")
+
+            phreeqc_code = phreeqc_code.replace(
+                "__DATABASE__", database_path(database)
+            )
+            phreeqc_code = phreeqc_code.replace("__OUTPUT_FILE__", output_file)
+
+            with open(input_file, "w") as pqi:
+                pqi.write(phreeqc_code)
+
+            # error.inp and phreeqc.log also land in the workspace
+            subprocess.run(
+                [self.executable, input_file, input_file.replace(".pqi", ".pqo")],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.STDOUT,
+                cwd=work_dir,
+            )
+
+            if not os.path.exists(output_file):
+                raise FileNotFoundError(f"Output file not found: {output_file}")
+
+            return read_selected_output(output_file, last_only)
+
+
+class IPhreeqcEngine:
+    """
+    Run input scripts through the IPhreeqc shared library.
+
+    IPhreeqc instances are not thread-safe, so every thread keeps its own
+    instance per database.  The database is loaded when the instance is
+    created and reused by every subsequent run.
+    """
+
+    name = "iphreeqc"
+
+    def __init__(self, library=IPHREEQC_LIBRARY):
+        # Raises ImportError when phreeqpy is not installed
+        from phreeqpy.iphreeqc.phreeqc_dll import IPhreeqc
+
+        self._factory = IPhreeqc
+        self._library = library
+        self._local = threading.local()
+
+    def _instance(self, database):
+        instances = getattr(self._local, "instances", None)
+        if instances is None:
+            instances = self._local.instances = {}
+
+        phreeqc = instances.get(database)
+        if phreeqc is None:
+            if self._library:
+                phreeqc = self._factory(self._library)
+            else:
+                phreeqc = self._factory()
+            phreeqc.load_database(database_path(database))
+            instances[database] = phreeqc
+
+        return phreeqc
+
+    def preload(self, database):
+        """Parse a database now so the first run does not pay for it."""
+        self._instance(database)
+
+    def run(self, phreeqc_code, database, name="phreeqc", last_only=False):
+        phreeqc = self._instance(database)
+
+        # The database is already loaded; IPhreeqc never writes the file
+        phreeqc_code = _DATABASE_LINE.sub("", phreeqc_code)
+        phreeqc_code = phreeqc_code.replace("__OUTPUT_FILE__", f"{name}.tsv")
+
+        phreeqc.run_string(phreeqc_code)
+        if phreeqc.row_count == 0:
+            raise RuntimeError(f"PHREEQC returned no selected output for {name}")
+
+        # Every value is a separate library call, so skip rows nobody reads
+        headings = phreeqc.get_selected_output_row(0)
+        if last_only:
+            rows = []
+            if phreeqc.row_count > 1:
+                rows = [phreeqc.get_selected_output_row(-1)]
+        else:
+            rows = phreeqc.get_selected_output_array()[1:]
+
+        return SelectedOutput(
+            headings, [[clean_value(value) for value in row] for row in rows]
+        )
+
+
+def create_engine(kind):
+    """Create a PHREEQC engine ('subprocess', 'iphreeqc', 'pool' or 'auto')."""
+    if kind == "subprocess":
+        return SubprocessEngine()
+    if kind == "iphreeqc":
+        return IPhreeqcEngine()
+    if kind == "pool":
+        from phreeqc_pool import PoolEngine
+
+        return PoolEngine()
+    if kind == "auto":
+        try:
+            return IPhreeqcEngine()
+        except (ImportError, OSError):
+            return SubprocessEngine()
+    raise ValueError(f"Unknown PHREEQC engine '{kind}'")
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """Return the process-wide engine configured by PHREEQC_ENGINE."""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = create_engine(PHREEQC_ENGINE)
+    return _engine
+
+
+def run_phreeqc(phreeqc_code, database, name="phreeqc", last_only=False):
+    """
+    Run a rendered input script and return its SelectedOutput.
+
+    Parameters:
+        phreeqc_code: Input script; __DATABASE__ and __OUTPUT_FILE__ are filled here
+        database: Database name ('phreeqc', 'pitzer' or 'pitzer_mod')
+        name: Short label used for the files written by the subprocess engine
+        last_only: Only return the final row of the selected output
+    """
+    return get_engine().run(phreeqc_code, database, name, last_only)
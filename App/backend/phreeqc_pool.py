@@ -0,0 +1,216 @@
+"""
+Pool of warm PHREEQC worker processes.
+
+Each worker is a child process bound to one database.  It loads the database
+into IPhreeqc once at start-up and then runs input scripts received over a
+pipe, sending back the selected output.  Workers are grouped per database
+(affinity), so a pitzer request is always served by a process that already
+has pitzer.dat parsed.
+
+Configuration (environment variables):
+    PHREEQC_POOL_SIZE       workers per database (default 2)
+    PHREEQC_POOL_DATABASES  databases served by the pool
+                            (default "phreeqc,pitzer,pitzer_mod")
+    PHREEQC_POOL_TIMEOUT    seconds a single run may take (default 120)
+    PHREEQC_POOL_MAX_JOBS   runs before a worker is recycled (default 1000)
+
+A worker that dies, stops answering or exceeds the timeout is killed and
+replaced by a fresh one before the next request reaches it.
+
+Select the pool for all simulations with PHREEQC_ENGINE=pool.
+"""
+
+import atexit
+import multiprocessing
+import os
+import queue
+import threading
+
+from phreeqc_engine import SelectedOutput, create_engine
+
+PHREEQC_POOL_SIZE = int(os.environ.get("PHREEQC_POOL_SIZE", "2"))
+PHREEQC_POOL_DATABASES = os.environ.get(
+    "PHREEQC_POOL_DATABASES", "phreeqc,pitzer,pitzer_mod"
+).split(",")
+PHREEQC_POOL_TIMEOUT = float(os.environ.get("PHREEQC_POOL_TIMEOUT", "120"))
+PHREEQC_POOL_MAX_JOBS = int(os.environ.get("PHREEQC_POOL_MAX_JOBS", "1000"))
+
+
+def _worker_main(connection, database):
+    """Child process loop: preload the database, then serve run requests."""
+    engine = create_engine("iphreeqc")
+    engine.preload(database)
+    connection.send(("ready", None))
+
+    while True:
+        try:
+            request = connection.recv()
+        except EOFError:
+            break
+        if request is None:
+            break
+
+        phreeqc_code, name, last_only = request
+        try:
+            output = engine.run(phreeqc_code, database, name, last_only)
+            connection.send(("ok", (output.headings, output.rows)))
+        except Exception as e:
+            connection.send(("error", f"{type(e).__name__}: {e}"))
+
+    connection.close()
+
+
+class _Worker:
+    """Handle on one child process and its end of the pipe."""
+
+    def __init__(self, context, database):
+        self.database = database
+        self.jobs = 0
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main,
+            args=(child_connection, database),
+            name=f"phreeqc-{database}",
+            daemon=True,
+        )
+        self.process.start()
+        child_connection.close()
+
+    def wait_ready(self, timeout):
+        if not self.connection.poll(timeout):
+            raise TimeoutError(f"PHREEQC worker for {self.database} did not start")
+        status, message = self.connection.recv()
+        if status != "ready":
+            raise RuntimeError(message)
+
+    def run(self, phreeqc_code, name, last_only, timeout):
+        self.jobs += 1
+        self.connection.send((phreeqc_code, name, last_only))
+        if not self.connection.poll(timeout):
+            raise TimeoutError(
+                f"PHREEQC worker for {self.database} timed out after {timeout} s"
+            )
+        return self.connection.recv()
+
+    def is_healthy(self):
+        return self.process.is_alive()
+
+    def stop(self):
+        try:
+            self.connection.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.connection.close()
+
+
+class PhreeqcWorkerPool:
+    """
+    Fixed-size groups of warm PHREEQC workers, one group per database.
+
+    Groups are started on the first request for their database.  run() checks
+    an idle worker out of the group, restarting it first if it is unhealthy or
+    has served max_jobs runs, and always hands a healthy worker back.
+    """
+
+    def __init__(
+        self,
+        size=PHREEQC_POOL_SIZE,
+        databases=PHREEQC_POOL_DATABASES,
+        timeout=PHREEQC_POOL_TIMEOUT,
+        max_jobs=PHREEQC_POOL_MAX_JOBS,
+    ):
+        if size < 1:
+            raise ValueError("PHREEQC pool size must be at least 1")
+        self.size = size
+        self.databases = set(databases)
+        self.timeout = timeout
+        self.max_jobs = max_jobs
+        self._context = multiprocessing.get_context("spawn")
+        self._idle = {}
+        self._workers = []
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _start_worker(self, database):
+        worker = _Worker(self._context, database)
+        try:
+            worker.wait_ready(self.timeout)
+        except Exception:
+            worker.stop()
+            raise
+        return worker
+
+    def _group(self, database):
+        if database not in self.databases:
+            raise ValueError(f"Database '{database}' is not served by the PHREEQC pool")
+
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("PHREEQC pool is closed")
+            idle = self._idle.get(database)
+            if idle is None:
+                idle = queue.Queue()
+                for _ in range(self.size):
+                    worker = self._start_worker(database)
+                    self._workers.append(worker)
+                    idle.put(worker)
+                self._idle[database] = idle
+        return idle
+
+    def _replace(self, worker):
+        worker.stop()
+        fresh = self._start_worker(worker.database)
+        with self._lock:
+            self._workers.remove(worker)
+            self._workers.append(fresh)
+        return fresh
+
+    def run(self, phreeqc_code, database, name="phreeqc", last_only=False):
+        """Run an input script on a warm worker and return its SelectedOutput."""
+        idle = self._group(database)
+        worker = idle.get()
+        try:
+            if not worker.is_healthy() or worker.jobs >= self.max_jobs:
+                worker = self._replace(worker)
+
+            try:
+                status, payload = worker.run(
+                    phreeqc_code, name, last_only, self.timeout
+                )
+            except (TimeoutError, EOFError, BrokenPipeError, OSError):
+                # The worker is stuck or gone; never hand it to another request
+                worker = self._replace(worker)
+                raise
+        finally:
+            idle.put(worker)
+
+        if status == "error":
+            raise RuntimeError(payload)
+
+        headings, rows = payload
+        return SelectedOutput(headings, rows)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            workers, self._workers = self._workers, []
+            self._idle = {}
+        for worker in workers:
+            worker.stop()
+
+
+class PoolEngine:
+    """PHREEQC engine that forwards every run to a PhreeqcWorkerPool."""
+
+    name = "pool"
+
+    def __init__(self, pool=None):
+        self.pool = pool or PhreeqcWorkerPool()
+        atexit.register(self.pool.close)
+
+    def run(self, phreeqc_code, database, name="phreeqc", last_only=False):
+        return self.pool.run(phreeqc_code, database, name, last_only)
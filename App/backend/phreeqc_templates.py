@@ -0,0 +1,196 @@
+"""
+Precompiled PHREEQC input templates.
+
+Every ``*.pqi`` file in phreeqc_programs is read once, at import, and split
+into literal text and ``__PLACEHOLDER__`` tokens.  Rendering then joins the
+pieces in a single pass instead of copying the whole script once per
+str.replace(), and fails loudly when a placeholder has no value, instead of
+handing PHREEQC a script with ``__NA__`` left in it.
+
+``__DATABASE__`` and ``__OUTPUT_FILE__`` are kept as literal text for the
+PHREEQC engine to fill (see phreeqc_engine.py).
+
+Example:
+    code = render(
+        "co2_brine_template.pqi",
+        SimulationParameters(temperature=323.15, pressure=10, species=ions),
+    )
+"""
+
+import hashlib
+import os
+import re
+from dataclasses import dataclass
+from typing import Mapping, Optional
+
+TEMPLATE_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "phreeqc_programs"
+)
+
+# Filled by the engine, never by the simulations
+ENGINE_PLACEHOLDERS = frozenset({"DATABASE", "OUTPUT_FILE"})
+
+_PLACEHOLDER = re.compile(r"__([A-Z0-9]+(?:_[A-Z0-9]+)*)__")
+
+# Mineral keys accepted by the endpoints, mapped to PHREEQC phase names
+MINERAL_NAMES = {
+    "Quartz": "Quartz",
+    "Calcite": "Calcite",
+    "Siderite": "Siderite",
+    "Dolomite": "Dolomite",
+    "Illite": "Illite",
+    "Kaolinite": "Kaolinite",
+    "K-feldspar": "K-feldspar",
+    "Albite": "Albite",
+    "Chlorite": "Chlorite(14A)",
+    "Pyrite": "Pyrite",
+}
+
+# Ion placeholders and the species keys they are read from
+_ION_PLACEHOLDERS = {
+    "NA": "Na+",
+    "CL": "Cl-",
+    "CA": "Ca+2",
+    "MG": "Mg+2",
+    "K": "K+",
+    "SO4": "SO4-2",
+    "HCO3": "HCO3-",
+}
+
+
+class TemplateError(ValueError):
+    """A template is missing or a placeholder was left without a value."""
+
+
+class Template:
+    """A PHREEQC input template split into literal text and placeholders."""
+
+    def __init__(self, name, text):
+        self.name = name
+        self.digest = hashlib.sha256(text.encode()).hexdigest()
+
+        # Even indices hold literal text, odd indices placeholder names
+        self._parts = []
+        literal = []
+        position = 0
+        for match in _PLACEHOLDER.finditer(text):
+            literal.append(text[position : match.start()])
+            if match.group(1) in ENGINE_PLACEHOLDERS:
+                literal.append(match.group(0))
+            else:
+                self._parts.append("".join(literal))
+                self._parts.append(match.group(1))
+                literal = []
+            position = match.end()
+        literal.append(text[position:])
+        self._parts.append("".join(literal))
+
+        self.placeholders = frozenset(self._parts[1::2])
+
+    def render(self, values):
+        """
+        Fill every placeholder from values (placeholder name -> value).
+
+        Raises:
+            TemplateError: if a placeholder of the template has no value
+        """
+        missing = self.placeholders.difference(values)
+        if missing:
+            raise TemplateError(
+                f"Template {self.name} has no value for "
+                + ", ".join(f"__{name}__" for name in sorted(missing))
+            )
+
+        parts = self._parts
+        return "".join(
+            [
+                part if index % 2 == 0 else str(values[part])
+                for index, part in enumerate(parts)
+            ]
+        )
+
+
+def _load_templates(directory):
+    templates = {}
+    for file_name in sorted(os.listdir(directory)):
+        if file_name.endswith(".pqi"):
+            with open(os.path.join(directory, file_name), "r") as template_file:
+                templates[file_name] = Template(file_name, template_file.read())
+    return templates
+
+
+TEMPLATES = _load_templates(TEMPLATE_DIR)
+
+
+def get_template(name):
+    """Return the compiled template loaded from phreeqc_programs/<name>."""
+    try:
+        return TEMPLATES[name]
+    except KeyError:
+        raise TemplateError(f"Unknown PHREEQC template '{name}'") from None
+
+
+def mineral_phases_block(mineralogy):
+    """
+    Build the EQUILIBRIUM_PHASES lines for a mineralogy dict.
+
+    Minerals with a non-negative amount are equilibrated (saturation index 0)
+    starting from that many moles; the others are written commented out.
+    """
+    lines = []
+    for mineral_key, phreeqc_name in MINERAL_NAMES.items():
+        if mineral_key in mineralogy and mineralogy[mineral_key] >= 0:
+            lines.append(f"    {phreeqc_name}        0   {mineralogy[mineral_key]}")
+        else:
+            lines.append(f"    #{phreeqc_name}       0   0")
+    return "\n".join(lines)
+
+
+@dataclass(frozen=True)
+class SimulationParameters:
+    """
+    Physical inputs of one PHREEQC simulation.
+
+    Parameters:
+        temperature: Temperature in Kelvin
+        species: Dictionary of ion molalities
+        pressure: Pressure in MPa; None for templates that sweep pressure
+        mineralogy: Dictionary of mineral names and initial moles, for the
+            brine-rock templates
+        state: Simulation number, for the blocks of multi-state jobs
+    """
+
+    temperature: float
+    species: Mapping[str, float]
+    pressure: Optional[float] = None
+    mineralogy: Optional[Mapping[str, float]] = None
+    state: Optional[int] = None
+
+    def values(self):
+        """Return the placeholder values of these parameters."""
+        values = {"TEMPERATURE": self.temperature - 273.15}
+        for placeholder, ion in _ION_PLACEHOLDERS.items():
+            values[placeholder] = self.species.get(ion, 0)
+
+        if self.pressure is not None:
+            pressure_atm = self.pressure * 9.86923
+            values["PRESSURE_ATM"] = pressure_atm
+            values["P_CO2"] = pressure_atm * 0.95
+            values["P_H2O"] = pressure_atm * 0.05
+        if self.mineralogy is not None:
+            values["MINERAL_PHASES"] = mineral_phases_block(self.mineralogy)
+        if self.state is not None:
+            values["STATE"] = self.state
+        return values
+
+
+def render(name, parameters=None, **values):
+    """
+    Render a template from a SimulationParameters and/or explicit values.
+
+    Explicit keyword values (e.g. STATE_BLOCKS=...) take precedence over the
+    ones derived from parameters.
+    """
+    if parameters is not None:
+        values = {**parameters.values(), **values}
+    return get_template(name).render(values)
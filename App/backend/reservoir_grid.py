@@ -0,0 +1,370 @@
+"""
+Duan and Sun CO2 solubility over reservoir simulation grids.
+
+A reservoir model gives every cell its own pressure, temperature and brine,
+and has 10^6-10^7 cells, far too many for one dictionary per cell.
+evaluate_grid() reads the per-cell fields from memory-mapped files, runs
+DuanSun2006.calculate_CO2_solubility_array on fixed-size chunks of cells and
+writes the results straight into memory-mapped .npy outputs, so memory use
+depends on the chunk size and not on the grid size:
+
+    solubility.npy     dissolved CO2 (mol/kg water), NaN outside the model
+    trapped_co2.npy    dissolved CO2 per cell (kg), when the water in the
+                       cells is known
+
+Fields (pressure in MPa, temperature in K, ion molalities keyed as in
+DuanSun2006.KERNEL_IONS, water mass in kg) can be given as
+    - a number, for a field that is uniform over the grid
+    - "cells.npy"
+    - "fields.npz:name", or "fields.npz" when it holds a single array; the
+      members must be stored uncompressed (np.savez, not np.savez_compressed)
+      to be memory-mapped, compressed ones are read whole
+    - any other path, read as raw binary of the grid shape and the given dtype
+
+Instead of water_mass, pore_volume (m^3) with an optional water_saturation
+gives the water mass at WATER_DENSITY.
+
+Chunks are independent, so with parallel=True they run on the workers of
+parallel.py; each worker maps the files itself and writes its own slice of
+the outputs.
+
+Example (grid of 200 x 200 x 250 cells in raw float32 files):
+    python reservoir_grid.py --pressure p.bin --temperature t.bin \\
+        --nacl salinity.bin --pore-volume pv.bin --dtype float32 \\
+        --shape 200 200 250 --output-dir results --parallel
+
+Configuration (environment variables):
+    CARBONEX_GRID_CHUNK   cells per chunk (default 262144)
+"""
+
+import argparse
+import os
+import struct
+import time
+import zipfile
+
+import numpy as np
+
+from DuanSun2006 import KERNEL_IONS, shared_model
+
+CARBONEX_GRID_CHUNK = int(os.environ.get("CARBONEX_GRID_CHUNK", str(1 << 18)))
+
+# kg/mol
+CO2_MOLAR_MASS = 0.04401
+# kg/m^3, to turn pore volume into water mass
+WATER_DENSITY = 1000.0
+
+OUTPUT_FILES = {"solubility": "solubility.npy", "trapped_co2": "trapped_co2.npy"}
+
+
+def _npz_member(path, name):
+    """Memory-map one member of an .npz archive, or read it when compressed."""
+    with zipfile.ZipFile(path) as archive:
+        members = [member[:-4] for member in archive.namelist() if member.endswith(".npy")]
+        if name is None:
+            if len(members) != 1:
+                raise ValueError(
+                    f"{path} holds {len(members)} arrays; name one as {path}:<name>"
+                )
+            name = members[0]
+        info = archive.getinfo(f"{name}.npy")
+        if info.compress_type != zipfile.ZIP_STORED:
+            with archive.open(info) as member:
+                return np.lib.format.read_array(member)
+
+    with open(path, "rb") as archive_file:
+        # The local header repeats the name and may have its own extra field
+        archive_file.seek(info.header_offset + 26)
+        name_length, extra_length = struct.unpack("<HH", archive_file.read(4))
+        archive_file.seek(info.header_offset + 30 + name_length + extra_length)
+        if np.lib.format.read_magic(archive_file) == (1, 0):
+            read_header = np.lib.format.read_array_header_1_0
+        else:
+            read_header = np.lib.format.read_array_header_2_0
+        shape, fortran_order, dtype = read_header(archive_file)
+        offset = archive_file.tell()
+    return np.memmap(
+        path,
+        dtype=dtype,
+        mode="r",
+        offset=offset,
+        shape=shape,
+        order="F" if fortran_order else "C",
+    )
+
+
+def _is_raw(source):
+    if isinstance(source, (int, float)):
+        return False
+    return not (str(source).endswith(".npy") or ".npz" in str(source))
+
+
+def open_field(source, shape=None, dtype="float64"):
+    """
+    Open one per-cell field read-only without loading it.
+
+    Parameters:
+        source: Number, .npy path, .npz path (optionally "path.npz:name") or
+            raw binary path
+        shape: Grid shape, needed for raw binary files
+        dtype: Data type of raw binary files
+
+    Returns:
+        ndarray (a memory map for files), or a float for a uniform field
+    """
+    if isinstance(source, (int, float)):
+        return float(source)
+
+    source = str(source)
+    path, _, name = source.partition(":") if ".npz:" in source else (source, "", "")
+    if path.endswith(".npy"):
+        return np.load(path, mmap_mode="r")
+    if path.endswith(".npz"):
+        return _npz_member(path, name or None)
+    if shape is None:
+        raise ValueError(f"The grid shape is needed to read raw binary {path}")
+    return np.memmap(path, dtype=dtype, mode="r", shape=tuple(shape))
+
+
+def _open_fields(fields, shape, dtype):
+    """Open every field and check that the arrays share one grid shape."""
+    opened = {
+        name: open_field(source)
+        for name, source in fields.items()
+        if not _is_raw(source)
+    }
+
+    shapes = {np.shape(field) for field in opened.values() if np.ndim(field)}
+    if shape is not None:
+        shapes.add(tuple(shape))
+    if len(shapes) != 1:
+        raise ValueError(
+            "The fields do not share one grid shape"
+            if shapes
+            else "Give the grid shape when no field is an .npy or .npz array"
+        )
+    shape = shapes.pop()
+
+    for name, source in fields.items():
+        if name not in opened:
+            opened[name] = open_field(source, shape, dtype)
+    return opened, shape
+
+
+def _flat(field, start, stop):
+    """Cells start:stop of a field in C order, as float64."""
+    if np.ndim(field) == 0:
+        return field
+    if field.flags.c_contiguous:
+        cells = field.reshape(-1)[start:stop]
+    else:
+        # Reshaping a Fortran-ordered map would copy all of it
+        cells = field[np.unravel_index(np.arange(start, stop), field.shape)]
+    return np.asarray(cells, dtype=np.float64)
+
+
+def _evaluate_chunk(job, start, stop):
+    """
+    Evaluate cells start:stop of a grid job into its output files.
+
+    Returns:
+        tuple: (cells outside the model, dissolved CO2 in kg or None)
+    """
+    fields, _ = _open_fields(job["fields"], job["shape"], job["dtype"])
+    outputs = {
+        key: np.load(path, mmap_mode="r+") for key, path in job["outputs"].items()
+    }
+
+    molalities = {ion: _flat(fields[ion], start, stop) for ion in KERNEL_IONS if ion in fields}
+    solubility = shared_model.calculate_CO2_solubility_array(
+        _flat(fields["pressure"], start, stop),
+        _flat(fields["temperature"], start, stop),
+        molalities,
+        model=job["model"],
+    )
+    solubility = np.broadcast_to(solubility, (stop - start,))
+    outputs["solubility"].reshape(-1)[start:stop] = solubility
+
+    trapped_total = None
+    if "trapped_co2" in outputs:
+        if "water_mass" in fields:
+            water_mass = _flat(fields["water_mass"], start, stop)
+        else:
+            water_mass = _flat(fields["pore_volume"], start, stop) * WATER_DENSITY
+            if "water_saturation" in fields:
+                water_mass = water_mass * _flat(fields["water_saturation"], start, stop)
+        trapped = solubility * water_mass * CO2_MOLAR_MASS
+        outputs["trapped_co2"].reshape(-1)[start:stop] = trapped
+        trapped_total = float(np.nansum(trapped))
+
+    for output in outputs.values():
+        output.flush()
+    return int(np.isnan(solubility).sum()), trapped_total
+
+
+def evaluate_grid(
+    pressure,
+    temperature,
+    molalities,
+    output_dir,
+    water_mass=None,
+    pore_volume=None,
+    water_saturation=None,
+    model="DuanSun",
+    shape=None,
+    dtype="float64",
+    output_dtype="float64",
+    chunk_size=None,
+    parallel=False,
+):
+    """
+    Calculate CO2 solubility and dissolved CO2 for every cell of a grid.
+
+    Parameters:
+        pressure: Pressure field in MPa (see open_field for the sources)
+        temperature: Temperature field in Kelvin
+        molalities: Dictionary of ion molality fields (keys like 'Na+', 'Cl-')
+        output_dir: Directory for solubility.npy and trapped_co2.npy
+        water_mass: Water mass field in kg, for trapped_co2.npy
+        pore_volume: Pore volume field in m^3, used instead of water_mass
+        water_saturation: Water saturation field, with pore_volume
+        model: 'DuanSun' or 'Guo'
+        shape: Grid shape, needed when every field is raw binary
+        dtype: Data type of the raw binary fields
+        output_dtype: Data type of the outputs
+        chunk_size: Cells per chunk (default CARBONEX_GRID_CHUNK)
+        parallel: Spread the chunks over the workers of parallel.py
+
+    Returns:
+        dict: grid 'shape', 'cells', 'out_of_range' cells, total
+        'trapped_co2_kg' (None without water), 'outputs' paths and 'seconds'
+    """
+    from parallel import parallel_starmap
+
+    shared_model._parameters(model)
+    unknown = set(molalities) - set(KERNEL_IONS)
+    if unknown:
+        raise ValueError(f"Unknown ions {sorted(unknown)}; use {list(KERNEL_IONS)}")
+
+    fields = {"pressure": pressure, "temperature": temperature, **molalities}
+    if water_mass is not None:
+        fields["water_mass"] = water_mass
+    elif pore_volume is not None:
+        fields["pore_volume"] = pore_volume
+        if water_saturation is not None:
+            fields["water_saturation"] = water_saturation
+    _, shape = _open_fields(fields, shape, dtype)
+
+    os.makedirs(output_dir, exist_ok=True)
+    outputs = {"solubility": os.path.join(output_dir, OUTPUT_FILES["solubility"])}
+    if water_mass is not None or pore_volume is not None:
+        outputs["trapped_co2"] = os.path.join(output_dir, OUTPUT_FILES["trapped_co2"])
+    for path in outputs.values():
+        np.lib.format.open_memmap(path, mode="w+", dtype=output_dtype, shape=shape).flush()
+
+    job = {
+        "fields": fields,
+        "shape": shape,
+        "dtype": dtype,
+        "model": model,
+        "outputs": outputs,
+    }
+    cells = int(np.prod(shape))
+    chunk_size = max(1, int(chunk_size or CARBONEX_GRID_CHUNK))
+    chunks = [
+        (job, start, min(start + chunk_size, cells))
+        for start in range(0, cells, chunk_size)
+    ]
+
+    started = time.time()
+    if parallel:
+        results = parallel_starmap(_evaluate_chunk, chunks)
+    else:
+        results = [_evaluate_chunk(*chunk) for chunk in chunks]
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+
+    return {
+        "shape": list(shape),
+        "cells": cells,
+        "out_of_range": sum(result[0] for result in results),
+        "trapped_co2_kg": (
+            sum(result[1] for result in results) if "trapped_co2" in outputs else None
+        ),
+        "outputs": outputs,
+        "seconds": time.time() - started,
+    }
+
+
+def _source(value):
+    """Command line field: a number or a path."""
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Duan and Sun CO2 solubility over a reservoir grid."
+    )
+    parser.add_argument("--pressure", type=_source, required=True, help="MPa")
+    parser.add_argument("--temperature", type=_source, required=True, help="K")
+    parser.add_argument(
+        "--ion",
+        action="append",
+        default=[],
+        metavar="ION=SOURCE",
+        help="Ion molality field, e.g. Ca+2=calcium.npy (repeatable)",
+    )
+    parser.add_argument(
+        "--nacl", type=_source, help="NaCl molality field, for both Na+ and Cl-"
+    )
+    parser.add_argument("--water-mass", type=_source, help="kg of water per cell")
+    parser.add_argument("--pore-volume", type=_source, help="m^3 per cell")
+    parser.add_argument("--water-saturation", type=_source)
+    parser.add_argument("--model", choices=("DuanSun", "Guo"), default="DuanSun")
+    parser.add_argument("--shape", type=int, nargs="+", help="Grid shape of raw files")
+    parser.add_argument("--dtype", default="float64", help="Data type of raw files")
+    parser.add_argument("--output-dtype", default="float64")
+    parser.add_argument("--chunk-size", type=int, default=CARBONEX_GRID_CHUNK)
+    parser.add_argument("--parallel", action="store_true")
+    parser.add_argument("--output-dir", default=".")
+    args = parser.parse_args()
+
+    molalities = {}
+    if args.nacl is not None:
+        molalities["Na+"] = molalities["Cl-"] = args.nacl
+    for item in args.ion:
+        ion, _, source = item.partition("=")
+        molalities[ion] = _source(source)
+
+    summary = evaluate_grid(
+        args.pressure,
+        args.temperature,
+        molalities,
+        args.output_dir,
+        water_mass=args.water_mass,
+        pore_volume=args.pore_volume,
+        water_saturation=args.water_saturation,
+        model=args.model,
+        shape=args.shape,
+        dtype=args.dtype,
+        output_dtype=args.output_dtype,
+        chunk_size=args.chunk_size,
+        parallel=args.parallel,
+    )
+    print(
+        f"{summary['cells']} cells in {summary['seconds']:.1f} s, "
+        f"{summary['out_of_range']} outside the model",
+        flush=True,
+    )
+    if summary["trapped_co2_kg"] is not None:
+        print(f"Dissolved CO2: {summary['trapped_co2_kg']:.6g} kg", flush=True)
+    for path in summary["outputs"].values():
+        print(path, flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,397 @@
+"""
+Content-addressed cache for simulation results.
+
+Results are keyed by a SHA-256 hash of
+    - the simulation function,
+    - its arguments after normalisation (ints and floats rounded to
+      CARBONEX_CACHE_PRECISION significant digits, dict keys sorted),
+    - the contents of the PHREEQC templates the function renders and of the
+      database file (or lookup table, or carbonex calibration) selected by
+      its model argument,
+so editing a template or a database invalidates the affected entries.
+
+Three tiers are consulted in order:
+    1. an in-process LRU bounded by CARBONEX_CACHE_MAX_BYTES (pickled size),
+    2. the SQLite result store shared by all workers and kept across
+       restarts (see result_store.py),
+    3. an optional directory shared by all gunicorn workers, enabled by
+       setting CARBONEX_CACHE_DIR; it must not be writable by other users.
+
+On a miss, concurrent calls with the same key are coalesced so that only
+one of them runs the simulation (see single_flight.py).
+
+A sweep that drops or zeroes points that failed (a PHREEQC error, a crashed
+worker, a pool timeout) calls mark_incomplete(); its result is then
+returned but not cached, nor is that of any cached simulation it was
+computed for, so a transient failure is not served as a valid result.
+
+Set CARBONEX_CACHE=0 to disable caching entirely.
+"""
+
+import contextvars
+import functools
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+
+from carbonex import CARBONEX_CALIBRATION
+from phreeqc_engine import database_path
+from phreeqc_templates import get_template
+from solubility_tables import TABLE_MODELS, table_path
+from result_store import open_result_store
+from single_flight import coalesce, single_flight_stats
+from workspace import check_private
+
+CARBONEX_CACHE = os.environ.get("CARBONEX_CACHE", "1") == "1"
+CARBONEX_CACHE_MAX_BYTES = int(
+    os.environ.get("CARBONEX_CACHE_MAX_BYTES", str(64 * 1024 * 1024))
+)
+CARBONEX_CACHE_PRECISION = int(os.environ.get("CARBONEX_CACHE_PRECISION", "10"))
+CARBONEX_CACHE_DIR = os.environ.get("CARBONEX_CACHE_DIR")
+
+# Flag of the cached simulation being computed in this context, set by
+# mark_incomplete()
+_incomplete = contextvars.ContextVar("carbonex_incomplete", default=None)
+
+# Model strings that select a PHREEQC database, mapped to that database
+_MODEL_DATABASES = {
+    "phreeqc_phreeqc": "phreeqc",
+    "phreeqc_pitzer": "pitzer",
+    "phreeqc_pitzer_mod": "pitzer_mod",
+    "phreeqc": "phreeqc",
+    "pitzer": "pitzer",
+    **TABLE_MODELS,
+}
+
+
+def _normalize(value):
+    """Turn an argument into a JSON-serialisable canonical form."""
+    if isinstance(value, bool) or value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)):
+        return float(f"{float(value):.{CARBONEX_CACHE_PRECISION}g}")
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in sorted(value.items())}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    if hasattr(value, "tolist"):
+        # NumPy scalars and arrays
+        return _normalize(value.tolist())
+    raise TypeError(f"Cannot build a cache key from {type(value).__name__}")
+
+
+_file_digests = {}
+_file_digests_lock = threading.Lock()
+
+
+def file_digest(path):
+    """Return the SHA-256 of a file, re-hashed only when its size or mtime change."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    signature = (stat.st_size, stat.st_mtime_ns)
+    with _file_digests_lock:
+        cached = _file_digests.get(path)
+        if cached and cached[0] == signature:
+            return cached[1]
+
+    with open(path, "rb") as file:
+        digest = hashlib.sha256(file.read()).hexdigest()
+
+    with _file_digests_lock:
+        _file_digests[path] = (signature, digest)
+    return digest
+
+
+# Arguments that describe the brine and rock composition of a call
+_COMPOSITION_ARGUMENTS = ("species", "ion_moles", "minerals", "mineralogy")
+
+
+def _store_metadata(function_name, arguments, databases):
+    """Describe a call by model, database, T, P and composition for the result store."""
+    model = arguments.get("model")
+    database = _MODEL_DATABASES.get(model)
+    if database is None and databases:
+        database = ",".join(sorted(databases))
+
+    composition = {
+        name: _normalize(arguments[name])
+        for name in _COMPOSITION_ARGUMENTS
+        if name in arguments
+    }
+    composition_hash = hashlib.sha256(
+        json.dumps(composition, sort_keys=True, separators=(",", ":")).encode()
+    ).hexdigest()
+
+    def number(name):
+        value = arguments.get(name)
+        return float(value) if isinstance(value, (int, float)) else None
+
+    return {
+        "function": function_name,
+        "model": model,
+        "database": database,
+        "temperature": number("temperature"),
+        "pressure": number("pressure"),
+        "composition_hash": composition_hash,
+    }
+
+
+def cache_key(function_name, arguments, templates=(), databases=()):
+    """Build the content-addressed key of one simulation call."""
+    # Digest of the template text actually rendered, loaded at import
+    dependencies = {template: get_template(template).digest for template in templates}
+    databases = set(databases)
+    if arguments.get("model") in _MODEL_DATABASES:
+        databases.add(_MODEL_DATABASES[arguments["model"]])
+    for database in databases:
+        dependencies[database] = file_digest(database_path(database))
+    if arguments.get("model") in TABLE_MODELS:
+        # Rebuilding a lookup table invalidates the results interpolated from it
+        dependencies["table"] = file_digest(
+            table_path(TABLE_MODELS[arguments["model"]])
+        )
+    if arguments.get("model") == "carbonex":
+        dependencies["calibration"] = file_digest(CARBONEX_CALIBRATION)
+
+    payload = json.dumps(
+        {
+            "function": function_name,
+            "arguments": _normalize(arguments),
+            "dependencies": dependencies,
+        },
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class LRUCache:
+    """Thread-safe LRU of pickled results, evicting by total pickled size."""
+
+    def __init__(self, max_bytes=CARBONEX_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            blob = self._entries.get(key)
+            if blob is None:
+                return None
+            self._entries.move_to_end(key)
+            return blob
+
+    def put(self, key, blob):
+        if len(blob) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self._entries[key] = blob
+            self.size += len(blob)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DiskCache:
+    """Pickled results in a directory shared by every worker process."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        # The files are unpickled, so other users must not be able to write them
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        check_private(directory)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.pkl")
+
+    def get(self, key):
+        try:
+            with open(self._path(key), "rb") as file:
+                return file.read()
+        except OSError:
+            return None
+
+    def put(self, key, blob):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename, so readers in other workers never see half a file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                file.write(blob)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+memory_cache = LRUCache()
+result_store = open_result_store() if CARBONEX_CACHE else None
+disk_cache = DiskCache(CARBONEX_CACHE_DIR) if CARBONEX_CACHE_DIR else None
+
+_stats = {"hits": 0, "misses": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(outcome):
+    with _stats_lock:
+        _stats[outcome] += 1
+
+
+def cache_stats():
+    """
+    Return hit/miss counters and the size of the in-process tier, plus the
+    fleet-wide counters of the result store under "store" when it is enabled
+    and the coalescing counters of this worker under "single_flight".
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+    stats["entries"] = len(memory_cache)
+    stats["bytes"] = memory_cache.size
+    if result_store is not None:
+        stats["store"] = result_store.stats()
+    stats["single_flight"] = single_flight_stats()
+    return stats
+
+
+def mark_incomplete():
+    """
+    Keep the cached simulation being computed in this context, and those it
+    is computed for, from caching a result that lacks failed points.
+    """
+    incomplete = _incomplete.get()
+    if incomplete is not None:
+        incomplete[0] = True
+
+
+def cached_simulation(templates=(), databases=(), normalize=None):
+    """
+    Decorator caching a simulation function by the content of its inputs.
+
+    Parameters:
+        templates: PHREEQC template files (in phreeqc_programs) the function
+            renders; their contents are part of the key.
+        databases: Databases the function always uses, whatever its model
+            argument says; their contents are part of the key.
+        normalize: Dictionary of argument names to functions applied to
+            those arguments before they are hashed, for arguments with
+            several spellings of the same input (e.g. model strings that
+            select the same database).
+
+    Results are stored pickled and unpickled on every hit, so callers may
+    modify what they get back without corrupting the cache.
+
+    Callers that compute the same result another way (e.g. point by point
+    while streaming it) can use wrapper.lookup(*args, **kwargs), which
+    returns the cached result or None, and wrapper.store(result, *args,
+    **kwargs).
+    """
+
+    def decorator(function):
+        signature = inspect.signature(function)
+        function_name = f"{function.__module__}.{function.__qualname__}"
+
+        def key_of(args, kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            arguments = dict(bound.arguments)
+            for name, normalizer in (normalize or {}).items():
+                arguments[name] = normalizer(arguments[name])
+            return cache_key(function_name, arguments, templates, databases), arguments
+
+        def get(key, count=True):
+            blob = memory_cache.get(key)
+            if blob is None and result_store is not None:
+                blob = result_store.get(key)
+                if blob is not None:
+                    memory_cache.put(key, blob)
+            if blob is None and disk_cache is not None:
+                blob = disk_cache.get(key)
+                if blob is not None:
+                    memory_cache.put(key, blob)
+            if blob is None:
+                if count:
+                    _count("misses")
+                return None
+            if count:
+                _count("hits")
+            return pickle.loads(blob)
+
+        def put(key, arguments, result):
+            blob = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+            memory_cache.put(key, blob)
+            if result_store is not None:
+                result_store.put(
+                    key, blob, _store_metadata(function_name, arguments, databases)
+                )
+            if disk_cache is not None:
+                disk_cache.put(key, blob)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            key, arguments = key_of(args, kwargs)
+            if not CARBONEX_CACHE:
+                # Nothing to share across workers without the cache
+                return coalesce(key, lambda: function(*args, **kwargs), workers=False)
+
+            result = get(key)
+            if result is not None:
+                return result
+
+            def compute():
+                # Another request may have stored it while this one waited
+                result = get(key, count=False)
+                if result is None:
+                    incomplete = [False]
+                    token = _incomplete.set(incomplete)
+                    try:
+                        result = function(*args, **kwargs)
+                    finally:
+                        _incomplete.reset(token)
+                    if incomplete[0]:
+                        print(f"Not caching {function_name}: points failed", flush=True)
+                        mark_incomplete()
+                    else:
+                        put(key, arguments, result)
+                return result
+
+            return coalesce(key, compute)
+
+        def lookup(*args, **kwargs):
+            if not CARBONEX_CACHE:
+                return None
+            return get(key_of(args, kwargs)[0])
+
+        def store(result, *args, **kwargs):
+            if CARBONEX_CACHE:
+                key, arguments = key_of(args, kwargs)
+                put(key, arguments, result)
+
+        wrapper.uncached = function
+        wrapper.lookup = lookup
+        wrapper.store = store
+        return wrapper
+
+    return decorator
@@ -0,0 +1,266 @@
+"""
+Persistent store of completed simulation results in a local SQLite file.
+
+The database runs in WAL mode, so every gunicorn worker can read while
+another one writes, and results survive worker restarts and deploys.  Each
+row is addressed by the content hash built in result_cache.py and also
+records the model, database, temperature, pressure and a hash of the brine
+(and mineral) composition, which are indexed for lookups by state.
+
+Configuration (environment variables):
+    CARBONEX_RESULT_STORE            path of the SQLite file, or "off" (default
+                                     carbonex_results.sqlite3 in the private
+                                     directory of workspace.py)
+    CARBONEX_RESULT_STORE_TTL        seconds a result stays valid (default 7 days)
+    CARBONEX_RESULT_STORE_MAX_BYTES  total size of stored results (default 256 MiB)
+
+Expired rows are ignored on read.  Every EVICTION_INTERVAL writes, expired
+rows are deleted and the least recently used ones are removed until the
+store fits in its size budget.  Hits and misses are counted in the database
+itself, so stats() reports the hit rate of the whole fleet; to keep reads
+from being write transactions, each worker buffers the counters and the
+access times of the rows it read and writes them together every
+ACCESS_FLUSH_INTERVAL seconds, before an eviction and at exit.
+
+The rows are unpickled by result_cache.py, so the file is refused if another
+user owns it or can write to it.
+"""
+
+import atexit
+import os
+import sqlite3
+import threading
+import time
+
+from workspace import private_directory, private_file
+
+CARBONEX_RESULT_STORE = os.environ.get("CARBONEX_RESULT_STORE")
+CARBONEX_RESULT_STORE_TTL = float(
+    os.environ.get("CARBONEX_RESULT_STORE_TTL", str(7 * 24 * 3600))
+)
+CARBONEX_RESULT_STORE_MAX_BYTES = int(
+    os.environ.get("CARBONEX_RESULT_STORE_MAX_BYTES", str(256 * 1024 * 1024))
+)
+
+EVICTION_INTERVAL = 100
+
+# Seconds between two writes of the buffered counters and access times
+ACCESS_FLUSH_INTERVAL = 10.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    function TEXT NOT NULL,
+    model TEXT,
+    database TEXT,
+    temperature REAL,
+    pressure REAL,
+    composition_hash TEXT,
+    result BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_state
+    ON results (model, database, temperature, pressure, composition_hash);
+CREATE INDEX IF NOT EXISTS results_accessed_at ON results (accessed_at);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO counters (name, value) VALUES ('hits', 0), ('misses', 0);
+"""
+
+
+class ResultStore:
+    """SQLite-backed result store shared by every worker on the host."""
+
+    def __init__(
+        self,
+        path,
+        ttl=CARBONEX_RESULT_STORE_TTL,
+        max_bytes=CARBONEX_RESULT_STORE_MAX_BYTES,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._writes = 0
+        self._writes_lock = threading.Lock()
+        self._counts = {"hits": 0, "misses": 0}
+        self._accessed = {}
+        self._flushed_at = time.monotonic()
+        self._access_lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        private_file(path)
+        self._connection().executescript(_SCHEMA)
+        atexit.register(self.flush)
+
+    def _connection(self):
+        # sqlite3 connections must stay on the thread that created them
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def get(self, key):
+        """Return the stored result blob for key, or None if missing or expired."""
+        try:
+            return self._get(key)
+        except sqlite3.Error as e:
+            # A locked or damaged store must never fail the simulation itself
+            print(f"Result store read failed: {e}", flush=True)
+            return None
+
+    def _get(self, key):
+        now = time.time()
+        row = self._connection().execute(
+            "SELECT result FROM results WHERE key = ? AND created_at >= ?",
+            (key, now - self.ttl),
+        ).fetchone()
+
+        with self._access_lock:
+            self._counts["hits" if row is not None else "misses"] += 1
+            if row is not None:
+                self._accessed[key] = now
+            due = time.monotonic() - self._flushed_at >= ACCESS_FLUSH_INTERVAL
+        if due:
+            self.flush()
+        return row[0] if row is not None else None
+
+    def flush(self):
+        """Write the buffered hit/miss counters and access times."""
+        with self._access_lock:
+            counts, self._counts = self._counts, {"hits": 0, "misses": 0}
+            accessed, self._accessed = self._accessed, {}
+            self._flushed_at = time.monotonic()
+        if not any(counts.values()) and not accessed:
+            return
+
+        connection = self._connection()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                connection.executemany(
+                    "UPDATE counters SET value = value + ? WHERE name = ?",
+                    [(count, name) for name, count in counts.items() if count],
+                )
+                connection.executemany(
+                    "UPDATE results SET accessed_at = MAX(accessed_at, ?) WHERE key = ?",
+                    [(accessed_at, key) for key, accessed_at in accessed.items()],
+                )
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            # Only statistics and the LRU order are lost
+            print(f"Result store access flush failed: {e}", flush=True)
+
+    def put(self, key, blob, metadata=None):
+        """
+        Store a result blob.
+
+        Parameters:
+            key: Content hash of the simulation call
+            blob: Pickled result
+            metadata: Optional dict with function, model, database, temperature,
+                pressure and composition_hash
+        """
+        try:
+            self._put(key, blob, metadata or {})
+        except sqlite3.Error as e:
+            print(f"Result store write failed: {e}", flush=True)
+
+    def _put(self, key, blob, metadata):
+        now = time.time()
+        self._connection().execute(
+            """
+            INSERT OR REPLACE INTO results (
+                key, function, model, database, temperature, pressure,
+                composition_hash, result, size, created_at, accessed_at
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                key,
+                metadata.get("function", ""),
+                metadata.get("model"),
+                metadata.get("database"),
+                metadata.get("temperature"),
+                metadata.get("pressure"),
+                metadata.get("composition_hash"),
+                sqlite3.Binary(blob),
+                len(blob),
+                now,
+                now,
+            ),
+        )
+
+        with self._writes_lock:
+            self._writes += 1
+            evict = self._writes % EVICTION_INTERVAL == 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """Delete expired rows, then least recently used rows over the size budget."""
+        self.flush()
+        connection = self._connection()
+        connection.execute(
+            "DELETE FROM results WHERE created_at < ?", (time.time() - self.ttl,)
+        )
+
+        (total,) = connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM results"
+        ).fetchone()
+        if total <= self.max_bytes:
+            return
+
+        excess = total - self.max_bytes
+        doomed = []
+        for key, size in connection.execute(
+            "SELECT key, size FROM results ORDER BY accessed_at"
+        ):
+            doomed.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        connection.executemany("DELETE FROM results WHERE key = ?", doomed)
+
+    def stats(self):
+        """Return fleet-wide hit/miss counters, hit rate and store size."""
+        self.flush()
+        connection = self._connection()
+        counters = dict(connection.execute("SELECT name, value FROM counters"))
+        entries, size = connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results"
+        ).fetchone()
+        lookups = counters.get("hits", 0) + counters.get("misses", 0)
+        return {
+            "hits": counters.get("hits", 0),
+            "misses": counters.get("misses", 0),
+            "hit_rate": counters.get("hits", 0) / lookups if lookups else 0.0,
+            "entries": entries,
+            "bytes": size,
+        }
+
+
+def open_result_store(path=CARBONEX_RESULT_STORE):
+    """
+    Open the configured store, or return None when it is switched off or
+    cannot be opened safely.
+    """
+    if path is not None and (not path or path.lower() == "off"):
+        return None
+    try:
+        if not path:
+            path = os.path.join(private_directory(), "carbonex_results.sqlite3")
+        return ResultStore(path)
+    except (sqlite3.Error, OSError) as e:
+        print(f"Result store disabled, cannot open {path}: {e}", flush=True)
+        return None
@@ -0,0 +1,231 @@
+"""
+Readers for PHREEQC SELECTED_OUTPUT tables.
+
+PHREEQC writes one tab-separated row per simulation step, with padded
+headings and a trailing tab on every line.  Most callers only need the final
+equilibrium state, so read_last_row() seeks to the end of the file and parses
+that single line, whatever the size of the output.  read_columns() streams
+the file once and returns only the requested columns as NumPy arrays.
+
+Numbers are parsed into floats as they are read.  Undefined results, which
+PHREEQC prints as "-1.#IND", "1.#INF", "-nan(ind)" and the like depending on
+the platform, are handled here once for all callers: they become None in
+rows (so float() fails as it did on the raw text) and NaN in arrays.
+"""
+
+import math
+import os
+
+import numpy as np
+
+_BLOCK_SIZE = 8192
+
+
+def parse_value(text):
+    """
+    Convert one SELECTED_OUTPUT field.
+
+    Returns a float for numbers, None for undefined numbers and empty fields,
+    and the stripped text for everything else (e.g. the 'state' column).
+    """
+    text = text.strip()
+    if not text:
+        return None
+    try:
+        value = float(text)
+    except ValueError:
+        if "#" in text or "nan" in text.lower():
+            return None
+        return text
+    return value if math.isfinite(value) else None
+
+
+def clean_value(value):
+    """Apply the same rules to a value that did not come from text (IPhreeqc)."""
+    if isinstance(value, str):
+        return parse_value(value)
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+
+def _split(line):
+    fields = line.rstrip("\r\n").split("\t")
+    # PHREEQC terminates every line with a tab, which yields an empty field
+    if fields and not fields[-1].strip():
+        fields.pop()
+    return fields
+
+
+def read_headings(path):
+    """Return the stripped column headings of a selected-output file."""
+    with open(path, mode="r") as file:
+        return [heading.strip() for heading in _split(file.readline())]
+
+
+def _last_line(path):
+    """Return the last non-empty line of a file, reading backwards from its end."""
+    with open(path, mode="rb") as file:
+        file.seek(0, os.SEEK_END)
+        position = file.tell()
+        tail = b""
+        while position > 0:
+            step = min(_BLOCK_SIZE, position)
+            position -= step
+            file.seek(position)
+            tail = file.read(step) + tail
+            lines = tail.rstrip(b"\r\n").split(b"\n")
+            # The first piece may be cut mid-line unless the start was reached
+            if len(lines) > 1 or position == 0:
+                return lines[-1].decode()
+    return ""
+
+
+def read_last_row(path):
+    """
+    Return the final row of a selected-output file as a dict keyed by heading.
+
+    Returns {} when the file holds headings only.
+    """
+    headings = read_headings(path)
+    fields = _split(_last_line(path))
+    if not fields or [field.strip() for field in fields] == headings:
+        return {}
+    return {
+        heading: parse_value(field) for heading, field in zip(headings, fields)
+    }
+
+
+def read_rows(path):
+    """Return (headings, rows) with every field parsed by parse_value()."""
+    with open(path, mode="r") as file:
+        headings = [heading.strip() for heading in _split(file.readline())]
+        rows = []
+        for line in file:
+            fields = _split(line)
+            if fields:
+                rows.append(
+                    [parse_value(field) for field in fields[: len(headings)]]
+                )
+    return headings, rows
+
+
+def read_columns(path, columns):
+    """
+    Read a subset of columns into NumPy arrays.
+
+    Parameters:
+        path: Selected-output file
+        columns: List of headings (read as float64), or dict mapping heading
+            to dtype, e.g. {"state": str, "C(4)": float}; other dtypes are
+            cast from float64
+
+    Returns:
+        dict: heading -> array; missing columns are left out, undefined
+        numbers are NaN in float columns
+    """
+    if not isinstance(columns, dict):
+        columns = {heading: float for heading in columns}
+
+    headings = read_headings(path)
+    wanted = [
+        (heading, headings.index(heading), dtype)
+        for heading, dtype in columns.items()
+        if heading in headings
+    ]
+    values = {heading: [] for heading, _, _ in wanted}
+
+    with open(path, mode="r") as file:
+        file.readline()
+        for line in file:
+            fields = _split(line)
+            if not fields:
+                continue
+            for heading, index, dtype in wanted:
+                field = fields[index] if index < len(fields) else ""
+                if dtype is str:
+                    values[heading].append(field.strip())
+                else:
+                    value = parse_value(field)
+                    values[heading].append(
+                        value if isinstance(value, float) else math.nan
+                    )
+
+    arrays = {}
+    for heading, _, dtype in wanted:
+        if dtype is str:
+            arrays[heading] = np.array(values[heading], dtype=object)
+        elif dtype is float:
+            arrays[heading] = np.array(values[heading], dtype=np.float64)
+        else:
+            # Integer-like columns: undefined entries cannot be represented
+            arrays[heading] = np.array(values[heading], dtype=np.float64).astype(
+                dtype
+            )
+    return arrays
+
+
+def to_array(values):
+    """Convert parsed values to a float64 array, with NaN where undefined."""
+    return np.array(
+        [value if isinstance(value, (int, float)) else math.nan for value in values],
+        dtype=np.float64,
+    )
+
+
+# Species whose activity (la_*) and molar volume (VM_*) the co2_brine
+# templates write
+SOLUTION_SPECIES = ("Na+", "Cl-", "K+", "Mg+2", "Ca+2", "SO4-2", "HCO3-", "CO3-2")
+
+
+def solution_properties(row):
+    """
+    Extract the solution properties from the final row of a co2_brine run.
+
+    Returns:
+        dict: 'species_data' (the 'activity' and 'molar_volume' of each of
+        SOLUTION_SPECIES), 'density', 'ionic_strength', 'pH',
+        'osmotic_coefficient', 'partial_pressure_co2' and 'fugacity_co2'
+    """
+    species_data = []
+    for ion in SOLUTION_SPECIES:
+        # Handle potential missing keys safely
+        try:
+            activity = math.exp(float(row.get(f"la_{ion}", 0)))
+            molar_volume = float(row.get(f"VM_{ion}", 0))
+        except (ValueError, TypeError):
+            activity = 0
+            molar_volume = 0
+
+        # Even a non-existent species has an activity of -1000; this avoids
+        # including non-existing species
+        threshold = -500
+        species_data.append(
+            {
+                "species": ion,
+                "activity": round(activity if activity >= threshold else 0, 4),
+                "molar_volume": round(
+                    molar_volume if molar_volume >= threshold else 0, 4
+                ),
+            }
+        )
+
+    try:
+        properties = {
+            "density": float(row.get("SOL_DENSITY", 0)),
+            "ionic_strength": float(row.get("mu", 0)),
+            "pH": float(row.get("pH", 7.0)),
+            "osmotic_coefficient": float(row.get("OSMOTIC", 0)),
+            "partial_pressure_co2": float(row.get("PR_CO2", 0)),
+            "fugacity_co2": float(row.get("PHI_CO2", 0)),
+        }
+    except (ValueError, TypeError):
+        properties = {
+            "density": 0,
+            "ionic_strength": 0,
+            "pH": 7.0,
+            "osmotic_coefficient": 0,
+            "partial_pressure_co2": 0,
+            "fugacity_co2": 0,
+        }
+    return {"species_data": species_data, **properties}
@@ -0,0 +1,159 @@
+"""
+Coalescing of identical simulations that are in flight at the same time.
+
+When several requests ask for the same simulation at once, coalesce() lets
+the first one (the leader) run it while the others wait and receive a copy
+of its result, or its exception, instead of starting PHREEQC themselves.
+Requests are identified by the content hash built in result_cache.py, which
+calls coalesce() on every cache miss.
+
+Within a gunicorn worker the requests wait on the leader thread.  Across
+workers, setting CARBONEX_SINGLE_FLIGHT_DIR makes every leader also take an
+exclusive flock() on a lock file of that directory before running; a leader
+of another worker waits for the lock and then finds the result in the
+shared result store (see result_store.py) instead of computing it again.
+Each key has its own lock file, which the leader deletes once its result is
+stored; a worker still waiting on the deleted file then finds the result in
+the store, so a race around the deletion can at worst repeat a run.  flock()
+is released by the kernel if a worker dies.
+
+Configuration (environment variables):
+    CARBONEX_SINGLE_FLIGHT          set to 0 to disable coalescing (default 1)
+    CARBONEX_SINGLE_FLIGHT_DIR      directory of the lock files shared by the
+                                    workers (default unset: coalesce within a
+                                    worker only; needs fcntl, i.e. not Windows)
+    CARBONEX_SINGLE_FLIGHT_TIMEOUT  seconds to wait for another request before
+                                    running the simulation anyway (default 600)
+"""
+
+import contextlib
+import os
+import pickle
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+CARBONEX_SINGLE_FLIGHT = os.environ.get("CARBONEX_SINGLE_FLIGHT", "1") == "1"
+CARBONEX_SINGLE_FLIGHT_DIR = os.environ.get("CARBONEX_SINGLE_FLIGHT_DIR")
+CARBONEX_SINGLE_FLIGHT_TIMEOUT = float(
+    os.environ.get("CARBONEX_SINGLE_FLIGHT_TIMEOUT", "600")
+)
+
+# Seconds between two attempts to take a lock file held by another worker
+_LOCK_POLL_INTERVAL = 0.05
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.followers = 0
+        self.blob = None
+        self.error = None
+
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+_stats = {"leaders": 0, "coalesced": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(outcome):
+    with _stats_lock:
+        _stats[outcome] += 1
+
+
+def single_flight_stats():
+    """Return how many requests ran a simulation and how many waited on one."""
+    with _stats_lock:
+        return dict(_stats)
+
+
+@contextlib.contextmanager
+def worker_lock(key):
+    """
+    Hold the lock file of key, shared with the other workers, if
+    CARBONEX_SINGLE_FLIGHT_DIR is set; give up waiting after
+    CARBONEX_SINGLE_FLIGHT_TIMEOUT seconds.
+    """
+    if not CARBONEX_SINGLE_FLIGHT_DIR or fcntl is None:
+        yield
+        return
+
+    os.makedirs(CARBONEX_SINGLE_FLIGHT_DIR, exist_ok=True)
+    path = os.path.join(CARBONEX_SINGLE_FLIGHT_DIR, f"{key}.lock")
+    with open(path, "a+b") as file:
+        deadline = time.monotonic() + CARBONEX_SINGLE_FLIGHT_TIMEOUT
+        locked = False
+        while True:
+            try:
+                fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                locked = True
+                break
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    print(f"Timed out waiting for the lock of {key}", flush=True)
+                    break
+                time.sleep(_LOCK_POLL_INTERVAL)
+        try:
+            yield
+        finally:
+            if locked:
+                with contextlib.suppress(OSError):
+                    os.remove(path)
+                fcntl.flock(file, fcntl.LOCK_UN)
+
+
+def coalesce(key, function, workers=True):
+    """
+    Run function() once for all the concurrent calls with the same key.
+
+    The leader returns what function() returns; the other callers get an
+    unpickled copy of it, so they may modify it freely, or the exception it
+    raised.  A caller that waits longer than CARBONEX_SINGLE_FLIGHT_TIMEOUT
+    runs function() itself.  With workers, the leader also holds the
+    worker_lock() of the key, so function() should first look for a result
+    stored by another worker.
+    """
+    if not CARBONEX_SINGLE_FLIGHT:
+        return function()
+
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+        else:
+            flight.followers += 1
+
+    if not leader:
+        _count("coalesced")
+        if not flight.done.wait(CARBONEX_SINGLE_FLIGHT_TIMEOUT):
+            print(f"Timed out waiting for the simulation {key}", flush=True)
+            return function()
+        if flight.error is not None:
+            raise flight.error
+        return pickle.loads(flight.blob)
+
+    _count("leaders")
+    try:
+        with worker_lock(key) if workers else contextlib.nullcontext():
+            result = function()
+    except BaseException as e:
+        flight.error = e
+        raise
+    finally:
+        with _flights_lock:
+            del _flights[key]
+            followers = flight.followers
+        if followers and flight.error is None:
+            try:
+                flight.blob = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+            except Exception as e:
+                flight.error = e
+        flight.done.set()
+    return result
@@ -0,0 +1,333 @@
+"""
+Precomputed CO2 solubility tables for the PHREEQC databases.
+
+Most queries fall inside a bounded envelope: 273-473 K, 0.1-50 MPa and
+NaCl-dominated brines up to about 6 mol/kg.  For each database (phreeqc,
+pitzer, pitzer_mod) an offline build runs _run_PHREEQC_state_batch over a
+dense (temperature, pressure, NaCl molality) grid and stores the dissolved
+CO2 as a compact .npz table.  The "*_table" models (e.g.
+"phreeqc_pitzer_table") then answer by multilinear interpolation in that
+grid, and run the real PHREEQC engine for any state outside it.
+
+A brine is inside the table when it is NaCl: Na+ and Cl- balance each other
+and all other ions together stay below CARBONEX_TABLE_MINOR_IONS (default
+1 %) of the NaCl molality.
+
+Accuracy: after the grid is filled, the builder runs PHREEQC directly at the
+centres of a random sample of grid cells, where multilinear interpolation is
+least accurate, and records the maximum and mean absolute and relative error
+in the table file.  build prints them and table_info() (exposed through
+GET /utilities/solubility-tables) reports them for every table loaded.
+
+Build (needs PHREEQC, takes a while; uses the parallel workers):
+    python solubility_tables.py                      # all three databases
+    python solubility_tables.py --database pitzer --validation-points 1000
+
+Configuration (environment variables):
+    CARBONEX_TABLE_DIR          directory of the <database>.npz tables
+                                (default solubility_tables/ next to this file)
+    CARBONEX_TABLE_MINOR_IONS   tolerated fraction of non-NaCl ions (default 0.01)
+"""
+
+import argparse
+import os
+import threading
+import time
+
+import numpy as np
+from scipy.interpolate import RegularGridInterpolator
+
+CARBONEX_TABLE_DIR = os.environ.get(
+    "CARBONEX_TABLE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "solubility_tables"),
+)
+CARBONEX_TABLE_MINOR_IONS = float(os.environ.get("CARBONEX_TABLE_MINOR_IONS", "0.01"))
+
+DATABASES = ("phreeqc", "pitzer", "pitzer_mod")
+
+# Model strings answered from the tables, mapped to their database
+TABLE_MODELS = {
+    "phreeqc_phreeqc_table": "phreeqc",
+    "phreeqc_pitzer_table": "pitzer",
+    "phreeqc_pitzer_mod_table": "pitzer_mod",
+}
+
+# Default grid: denser at low pressure and around the CO2 critical pressure
+TEMPERATURE_AXIS = np.arange(273.15, 473.15 + 1e-9, 10.0)
+PRESSURE_AXIS = np.array(
+    [0.1, 0.25, 0.5, 0.75, 1, 1.5, 2, 3, 4, 5, 6, 7, 7.5, 8, 9, 10,
+     12.5, 15, 17.5, 20, 25, 30, 35, 40, 45, 50],
+    dtype=np.float64,
+)
+NACL_AXIS = np.arange(0.0, 6.0 + 1e-9, 0.5)
+
+# States per PHREEQC job when building
+_BATCH_SIZE = 50
+
+
+def table_path(database):
+    """Return the path of the table file for a database."""
+    return os.path.join(CARBONEX_TABLE_DIR, f"{database}.npz")
+
+
+def nacl_molality(species, tolerance=CARBONEX_TABLE_MINOR_IONS):
+    """
+    Return the NaCl molality of a brine, or None if it is not NaCl-dominated.
+
+    Parameters:
+        species: Dictionary of ion molalities
+        tolerance: Largest fraction of other ions (and of Na/Cl imbalance)
+            relative to the NaCl molality
+    """
+    na = species.get("Na+", 0) or 0
+    cl = species.get("Cl-", 0) or 0
+    minor = abs(na - cl) + sum(
+        abs(value or 0)
+        for ion, value in species.items()
+        if ion not in ("Na+", "Cl-")
+    )
+    molality = (na + cl) / 2
+    if minor > tolerance * molality and minor > 1e-12:
+        return None
+    return molality
+
+
+class SolubilityTable:
+    """Dissolved CO2 on a (temperature, pressure, NaCl molality) grid."""
+
+    def __init__(self, temperature, pressure, nacl, co2, metadata=None):
+        self.temperature = np.asarray(temperature, dtype=np.float64)
+        self.pressure = np.asarray(pressure, dtype=np.float64)
+        self.nacl = np.asarray(nacl, dtype=np.float64)
+        self.co2 = np.asarray(co2, dtype=np.float64)
+        self.metadata = metadata or {}
+        self._interpolator = RegularGridInterpolator(
+            (self.temperature, self.pressure, self.nacl),
+            self.co2,
+            method="linear",
+            bounds_error=False,
+            fill_value=np.nan,
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            metadata = {
+                key: data[key].item()
+                for key in data.files
+                if key not in ("temperature", "pressure", "nacl", "co2")
+            }
+            return cls(
+                data["temperature"],
+                data["pressure"],
+                data["nacl"],
+                data["co2"],
+                metadata,
+            )
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        np.savez_compressed(
+            path,
+            temperature=self.temperature,
+            pressure=self.pressure,
+            nacl=self.nacl,
+            co2=self.co2,
+            **{key: np.asarray(value) for key, value in self.metadata.items()},
+        )
+
+    def __call__(self, temperature, pressure, nacl):
+        """
+        Interpolate dissolved CO2 (mol/kg); arguments broadcast together.
+
+        Returns NaN outside the grid and in cells touching a failed point.
+        """
+        temperature, pressure, nacl = np.broadcast_arrays(
+            np.asarray(temperature, dtype=np.float64),
+            np.asarray(pressure, dtype=np.float64),
+            np.asarray(nacl, dtype=np.float64),
+        )
+        points = np.stack([temperature, pressure, nacl], axis=-1).reshape(-1, 3)
+        return self._interpolator(points).reshape(temperature.shape)
+
+
+_tables = {}
+_tables_lock = threading.Lock()
+
+
+def get_table(database):
+    """Return the loaded table for a database, or None when it was not built."""
+    path = table_path(database)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+    with _tables_lock:
+        cached = _tables.get(database)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, SolubilityTable.load(path))
+            _tables[database] = cached
+    return cached[1]
+
+
+def lookup(database, temperature, pressure, species):
+    """
+    Interpolate dissolved CO2 for one or more states of a single brine.
+
+    Parameters:
+        database: PHREEQC database name
+        temperature: Temperature(s) in Kelvin
+        pressure: Pressure(s) in MPa
+        species: Dictionary of ion molalities
+
+    Returns:
+        ndarray of dissolved CO2 (mol/kg), NaN for states outside the table,
+        or None when there is no table or the brine is not NaCl-dominated
+    """
+    table = get_table(database)
+    if table is None:
+        return None
+    molality = nacl_molality(species)
+    if molality is None:
+        return None
+    return table(temperature, pressure, molality)
+
+
+def table_info():
+    """Describe the grid and build-time error of every available table."""
+    info = {}
+    for database in DATABASES:
+        table = get_table(database)
+        if table is None:
+            continue
+        info[database] = {
+            "temperature_range": [table.temperature[0], table.temperature[-1]],
+            "pressure_range": [table.pressure[0], table.pressure[-1]],
+            "nacl_range": [table.nacl[0], table.nacl[-1]],
+            "shape": list(table.co2.shape),
+            "failed_points": int(np.isnan(table.co2).sum()),
+            **table.metadata,
+        }
+        for key in ("temperature_range", "pressure_range", "nacl_range"):
+            info[database][key] = [float(value) for value in info[database][key]]
+    return info
+
+
+def _solve_states(states, database):
+    """Dissolved CO2 for (temperature, pressure, NaCl molality) states via PHREEQC."""
+    from co2_brine_simulation import _run_PHREEQC_state_batch
+    from parallel import parallel_starmap
+
+    # One brine per PHREEQC job, so group the states by molality
+    jobs = []
+    for molality in sorted({state[2] for state in states}):
+        indices = [i for i, state in enumerate(states) if state[2] == molality]
+        species = {"Na+": molality, "Cl-": molality}
+        for start in range(0, len(indices), _BATCH_SIZE):
+            chunk = indices[start : start + _BATCH_SIZE]
+            jobs.append((chunk, species))
+
+    batches = parallel_starmap(
+        _run_PHREEQC_state_batch,
+        [
+            ([(states[i][0], states[i][1]) for i in chunk], species, database)
+            for chunk, species in jobs
+        ],
+    )
+
+    co2 = np.full(len(states), np.nan)
+    for (chunk, _), batch in zip(jobs, batches):
+        if isinstance(batch, Exception):
+            print(f"Batch failed: {batch}", flush=True)
+            continue
+        for i, value in zip(chunk, batch):
+            if value is not None:
+                co2[i] = value
+    return co2
+
+
+def build_table(
+    database,
+    temperature=TEMPERATURE_AXIS,
+    pressure=PRESSURE_AXIS,
+    nacl=NACL_AXIS,
+    validation_points=500,
+    seed=0,
+):
+    """Run PHREEQC over the grid, measure the interpolation error and return the table."""
+    grid = np.stack(
+        np.meshgrid(temperature, pressure, nacl, indexing="ij"), axis=-1
+    ).reshape(-1, 3)
+    started = time.time()
+    co2 = _solve_states([tuple(point) for point in grid], database)
+    table = SolubilityTable(
+        temperature,
+        pressure,
+        nacl,
+        co2.reshape(len(temperature), len(pressure), len(nacl)),
+    )
+
+    # Cell centres are the farthest points from the grid nodes
+    rng = np.random.default_rng(seed)
+    shape = np.array(table.co2.shape) - 1
+    cells = rng.integers(0, shape, size=(validation_points, 3))
+    centres = np.stack(
+        [
+            (axis[cells[:, k]] + axis[cells[:, k] + 1]) / 2
+            for k, axis in enumerate((table.temperature, table.pressure, table.nacl))
+        ],
+        axis=-1,
+    )
+    direct = _solve_states([tuple(point) for point in centres], database)
+    interpolated = table(centres[:, 0], centres[:, 1], centres[:, 2])
+
+    valid = np.isfinite(direct) & np.isfinite(interpolated)
+    abs_error = np.abs(interpolated[valid] - direct[valid])
+    rel_error = abs_error / np.maximum(np.abs(direct[valid]), 1e-12)
+    table.metadata = {
+        "database": database,
+        "built_at": time.time(),
+        "build_seconds": time.time() - started,
+        "validation_points": int(valid.sum()),
+        "max_abs_error": float(abs_error.max()) if abs_error.size else float("nan"),
+        "mean_abs_error": float(abs_error.mean()) if abs_error.size else float("nan"),
+        "max_rel_error": float(rel_error.max()) if rel_error.size else float("nan"),
+        "mean_rel_error": float(rel_error.mean()) if rel_error.size else float("nan"),
+    }
+    return table
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build CO2 solubility lookup tables with PHREEQC."
+    )
+    parser.add_argument(
+        "--database",
+        choices=DATABASES,
+        action="append",
+        help="Database to tabulate (repeatable, default: all)",
+    )
+    parser.add_argument("--validation-points", type=int, default=500)
+    parser.add_argument("--output-dir", default=CARBONEX_TABLE_DIR)
+    args = parser.parse_args()
+
+    for database in args.database or DATABASES:
+        print(f"Building {database} table...", flush=True)
+        table = build_table(database, validation_points=args.validation_points)
+        path = os.path.join(args.output_dir, f"{database}.npz")
+        table.save(path)
+        metadata = table.metadata
+        print(
+            f"{path}: {int(np.isnan(table.co2).sum())} failed points, "
+            f"max error {metadata['max_abs_error']:.3g} mol/kg "
+            f"({metadata['max_rel_error']:.2%}), "
+            f"mean error {metadata['mean_abs_error']:.3g} mol/kg "
+            f"over {metadata['validation_points']} cell centres, "
+            f"{metadata['build_seconds']:.0f} s",
+            flush=True,
+        )
+
+
+if __name__ == "__main__":
+    main()
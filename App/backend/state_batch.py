@@ -0,0 +1,231 @@
+"""
+Parsing and deduplication of the states of a batch request.
+
+A batch is a list of states, each a dictionary with a 'temperature' (K), a
+'pressure' (MPa) and compositions such as 'concentrations' or
+'mineralogy'; a composition missing from a state is taken from the defaults
+of the request.  parse_states() validates every state on its own, so a bad
+state only fills its own error slot, and collapses identical states so
+each one is computed once.  columns() then spreads the results of the
+unique states back over the batch, in input order.
+
+Configuration (environment variables):
+    CARBONEX_BATCH_MAX_STATES  states accepted in one batch (default 10000)
+"""
+
+import json
+import math
+import os
+
+from parallel import parallel_starmap
+
+CARBONEX_BATCH_MAX_STATES = int(os.environ.get("CARBONEX_BATCH_MAX_STATES", "10000"))
+
+# States per PHREEQC job of a batch
+BATCH_CHUNK_SIZE = 50
+
+
+def _number(state, field):
+    value = state.get(field)
+    if isinstance(value, bool) or value is None:
+        raise ValueError(f"Missing {field}")
+    value = float(value)
+    if not math.isfinite(value) or value <= 0:
+        raise ValueError(f"The {field} must be a positive number")
+    return value
+
+
+def _composition(state, field, defaults):
+    composition = state.get(field, defaults.get(field))
+    if composition is None:
+        composition = {}
+    if not isinstance(composition, dict):
+        raise ValueError(f"The {field} must be an object")
+    return {
+        str(name): float(amount if amount is not None else 0)
+        for name, amount in sorted(composition.items())
+    }
+
+
+def parse_states(states, defaults=None, compositions=("concentrations",)):
+    """
+    Validate and deduplicate the states of a batch.
+
+    Parameters:
+        states: List of state dictionaries
+        defaults: Dictionary of the compositions used by states without one
+        compositions: Names of the composition fields of a state
+
+    Returns:
+        tuple: (unique, index, errors) where unique lists the distinct valid
+        states as dictionaries with 'temperature', 'pressure' and every
+        composition, index[i] is the position of state i in unique (None if
+        it is invalid) and errors[i] the reason it is invalid
+
+    Raises:
+        ValueError: if states is not a list or holds more than
+            CARBONEX_BATCH_MAX_STATES states
+    """
+    if not isinstance(states, list):
+        raise ValueError("The states must be a list")
+    if len(states) > CARBONEX_BATCH_MAX_STATES:
+        raise ValueError(
+            f"A batch holds at most {CARBONEX_BATCH_MAX_STATES} states"
+        )
+    defaults = defaults or {}
+
+    unique = []
+    positions = {}
+    index = [None] * len(states)
+    errors = [None] * len(states)
+    for i, state in enumerate(states):
+        try:
+            if not isinstance(state, dict):
+                raise ValueError("A state must be an object")
+            parsed = {
+                "temperature": _number(state, "temperature"),
+                "pressure": _number(state, "pressure"),
+            }
+            for field in compositions:
+                parsed[field] = _composition(state, field, defaults)
+        except (TypeError, ValueError) as e:
+            errors[i] = str(e)
+            continue
+
+        key = json.dumps(parsed, sort_keys=True)
+        if key not in positions:
+            positions[key] = len(unique)
+            unique.append(parsed)
+        index[i] = positions[key]
+    return unique, index, errors
+
+
+def group_states(unique, compositions=("concentrations",)):
+    """
+    Group the unique states by composition.
+
+    Returns:
+        list: (composition values, positions in unique) tuples, in the
+        order the compositions first appear
+    """
+    groups = {}
+    for position, state in enumerate(unique):
+        key = json.dumps([state[field] for field in compositions], sort_keys=True)
+        if key not in groups:
+            groups[key] = ([state[field] for field in compositions], [])
+        groups[key][1].append(position)
+    return list(groups.values())
+
+
+def run_state_batches(batch, retry, unique, positions, compositions, database):
+    """
+    Run unique states through PHREEQC on the parallel workers.
+
+    The states at positions are grouped by composition and each group runs
+    as jobs of BATCH_CHUNK_SIZE states; states a job could not equilibrate
+    are retried one by one, as the sweeps do.
+
+    Parameters:
+        batch: Function (states, *compositions, database) returning a value
+            per (temperature, pressure) state, None where it has none
+        retry: Function (temperature, pressure, *compositions, database)
+            returning the value of one state
+        unique: The unique states (see parse_states)
+        positions: Positions in unique of the states to run
+        compositions: Names of the composition fields passed on to batch
+            and retry
+        database: PHREEQC database name
+
+    Returns:
+        tuple: (values, errors) dictionaries keyed by position
+    """
+    jobs = []
+    for composition, group in group_states(
+        [unique[position] for position in positions], compositions
+    ):
+        group = [positions[i] for i in group]
+        for start in range(0, len(group), BATCH_CHUNK_SIZE):
+            jobs.append((composition, group[start : start + BATCH_CHUNK_SIZE]))
+
+    batches = parallel_starmap(
+        batch,
+        [
+            (
+                [
+                    (unique[position]["temperature"], unique[position]["pressure"])
+                    for position in chunk
+                ],
+                *composition,
+                database,
+            )
+            for composition, chunk in jobs
+        ],
+    )
+
+    values = {}
+    errors = {}
+    missing = []
+    for (composition, chunk), result in zip(jobs, batches):
+        if isinstance(result, Exception):
+            print(f"Error in state batch: {result}", flush=True)
+            result = [None] * len(chunk)
+        for position, value in zip(chunk, result):
+            if value is None:
+                missing.append(position)
+            else:
+                values[position] = value
+
+    retried = parallel_starmap(
+        retry,
+        [
+            (
+                unique[position]["temperature"],
+                unique[position]["pressure"],
+                *(unique[position][field] for field in compositions),
+                database,
+            )
+            for position in missing
+        ],
+    )
+    for position, value in zip(missing, retried):
+        if isinstance(value, Exception):
+            errors[position] = str(value)
+        else:
+            values[position] = value
+    return values, errors
+
+
+def columns(states, unique, index, errors, values, value_errors):
+    """
+    Spread the results of the unique states over the batch, in input order.
+
+    Parameters:
+        states: The states of the request
+        unique, index, errors: As returned by parse_states
+        values: Result per unique state, None where it failed
+        value_errors: Error message per unique state, None where it worked
+
+    Returns:
+        dict: 'temperature', 'pressure', 'dissolved_co2' and 'error' lists,
+        one entry per state, plus the count of 'unique_states'
+    """
+    temperature, pressure, dissolved_co2, error = [], [], [], []
+    for state, position, state_error in zip(states, index, errors):
+        if position is None:
+            state = state if isinstance(state, dict) else {}
+            temperature.append(state.get("temperature"))
+            pressure.append(state.get("pressure"))
+            dissolved_co2.append(None)
+            error.append(state_error)
+            continue
+        temperature.append(unique[position]["temperature"])
+        pressure.append(unique[position]["pressure"])
+        dissolved_co2.append(values[position])
+        error.append(value_errors[position])
+    return {
+        "temperature": temperature,
+        "pressure": pressure,
+        "dissolved_co2": dissolved_co2,
+        "error": error,
+        "unique_states": len(unique),
+    }
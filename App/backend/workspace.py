@@ -0,0 +1,113 @@
+"""
+Per-simulation scratch directories for PHREEQC input and output files.
+
+Every run gets its own freshly created directory, so concurrent requests in
+different gunicorn workers or threads never share a file name, and the
+directory is deleted as soon as the run is over.
+
+The directories are created under:
+    CARBONEX_SCRATCH_DIR   if set,
+    /dev/shm               when available (RAM-backed, no disk I/O),
+    tempfile.gettempdir()  otherwise.
+
+Set CARBONEX_KEEP_SCRATCH=1 to keep the directories (and the PHREEQC .pqo
+reports inside them) for debugging.
+
+Files that outlive a run and are shared by the workers, such as the result
+and job stores, hold pickled data and so must not be writable by other
+users.  They live in private_directory():
+    CARBONEX_DATA_DIR                 if set,
+    $XDG_CACHE_HOME/carbonex          or ~/.cache/carbonex,
+    <tempdir>/carbonex-<uid>          when the home directory is not writable,
+created with mode 0700 and refused if another user owns it or can write to
+it.
+"""
+
+import getpass
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+CARBONEX_SCRATCH_DIR = os.environ.get("CARBONEX_SCRATCH_DIR")
+CARBONEX_KEEP_SCRATCH = os.environ.get("CARBONEX_KEEP_SCRATCH", "0") == "1"
+CARBONEX_DATA_DIR = os.environ.get("CARBONEX_DATA_DIR")
+
+_RAM_DIR = "/dev/shm"
+
+
+def scratch_root():
+    """Return the directory under which workspaces are created."""
+    if CARBONEX_SCRATCH_DIR:
+        os.makedirs(CARBONEX_SCRATCH_DIR, exist_ok=True)
+        return CARBONEX_SCRATCH_DIR
+    if os.path.isdir(_RAM_DIR) and os.access(_RAM_DIR, os.W_OK):
+        return _RAM_DIR
+    return tempfile.gettempdir()
+
+
+@contextmanager
+def simulation_workspace(prefix="phreeqc"):
+    """
+    Create an isolated scratch directory and remove it on exit.
+
+    Example:
+        with simulation_workspace("state_out") as work_dir:
+            ...
+    """
+    work_dir = tempfile.mkdtemp(prefix=f"carbonex_{prefix}_", dir=scratch_root())
+    try:
+        yield work_dir
+    finally:
+        if not CARBONEX_KEEP_SCRATCH:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def check_private(path):
+    """
+    Raise PermissionError if path belongs to another user or is writable by
+    group or others; a missing path passes.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return
+    if hasattr(os, "geteuid") and stat.st_uid != os.geteuid():
+        raise PermissionError(f"{path} is owned by another user")
+    if stat.st_mode & 0o022:
+        raise PermissionError(f"{path} is writable by other users")
+
+
+def _private_directory(path):
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    check_private(path)
+    return path
+
+
+def private_directory():
+    """Return the directory of the files shared by the workers (see above)."""
+    if CARBONEX_DATA_DIR:
+        return _private_directory(CARBONEX_DATA_DIR)
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    try:
+        return _private_directory(os.path.join(cache_home, "carbonex"))
+    except OSError:
+        uid = os.geteuid() if hasattr(os, "geteuid") else getpass.getuser()
+        return _private_directory(
+            os.path.join(tempfile.gettempdir(), f"carbonex-{uid}")
+        )
+
+
+def private_file(path):
+    """
+    Create path with mode 0600 unless it exists, and check that it is
+    private (see check_private) before it is opened.
+    """
+    try:
+        os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600))
+    except FileExistsError:
+        pass
+    check_private(path)
+    return path
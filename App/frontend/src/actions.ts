@@ -1,7 +1,7 @@
 import axios from "axios";
 import { store } from "./store"; // Adjust the path to your store
 
-export async function runSimulationCO2BrineFixed() {
+export async function runSimulationCO2BrineState() {
   try {
     const payload = {
       concentrations: store.simulationInput.concentrations,
@@ -10,52 +10,23 @@ export async function runSimulationCO2BrineFixed() {
       model: store.simulationInput.solubilityModel,
     };
 
+    // Dissolved CO2 and solution properties from one equilibrium run
     const response = await axios.post(
-      "http://127.0.0.1:5000/simulate/co2-brine/fixed",
+      "http://127.0.0.1:5000/simulate/co2-brine/state",
       payload
     );
 
     if (response.data.status === "success" && response.data.data) {
-      const trapped_co2 = response.data.data.trapped_co2;
-      const co2Value = typeof trapped_co2 === 'string' 
-        ? parseFloat(trapped_co2) 
-        : Number(trapped_co2);
-      
+      const responseData = response.data.data;
+
+      const co2Value = Number(responseData.trapped_co2);
       if (!isNaN(co2Value)) {
-        // CORRECT: Mutate the property directly
         store.simulationOutput.solubilityTrapping.trapped_co2 = co2Value;
       } else {
-        console.error("Invalid dissolved CO2 value received:", trapped_co2);
+        console.error("Invalid dissolved CO2 value received:", responseData.trapped_co2);
       }
-    } else {
-      console.error("No valid trapped_co2 data in response:", response.data);
-    }
-  } catch (error) {
-    console.error("Error during static simulation:", error);
-  }
-}
-
-export async function runSimulationCO2BrineSolutionProperties() {
-  try {
-    const payload = {
-      concentrations: store.simulationInput.concentrations,
-      temperature: store.simulationInput.temperature,
-      pressure: store.simulationInput.pressure,
-      model: store.simulationInput.solubilityModel
-    };
-
-    const response = await axios.post(
-      "http://127.0.0.1:5000/simulate/co2-brine/solution-properties",
-      payload
-    );
-
-    console.log("Full API response:", response.data);
 
-    // Check if the response has the expected structure
-    if (response.data.status === "success" && response.data.data) {
-      const responseData = response.data.data;
-
-      // CORRECT: Update each property on the existing reactive object
+      // Update each property on the existing reactive object
       store.simulationOutput.solubilityTrapping.density = parseFloat(responseData.density || 0);
       store.simulationOutput.solubilityTrapping.ionic_strength = parseFloat(responseData.ionic_strength || 0);
       store.simulationOutput.solubilityTrapping.pH = parseFloat(responseData.pH || 0);
@@ -68,20 +39,16 @@ export async function runSimulationCO2BrineSolutionProperties() {
       console.error("API returned error or unexpected structure:", response.data);
       throw new Error(`API Error: ${response.data.message || "Unknown error"}`);
     }
-    
+
     // IMPORTANT: Do NOT touch plotDataPressure or plotDataTemperature here, as this endpoint doesn't provide them.
 
   } catch (error) {
-    console.error("Error during simulation:", error);
-    // Reset values on error if needed, but do it property by property
+    console.error("Error during state simulation:", error);
+    // Reset values on error, property by property
     store.simulationOutput.solubilityTrapping.density = 0;
     store.simulationOutput.solubilityTrapping.ionic_strength = 0;
     store.simulationOutput.solubilityTrapping.pH = 0;
     store.simulationOutput.solubilityTrapping.activity_of_water = 0;
-    store.simulationOutput.solubilityTrapping.osmotic_coefficient = 0;
-    store.simulationOutput.solubilityTrapping.fugacity_co2 = 0;
-    store.simulationOutput.solubilityTrapping.partial_pressure_co2 = 0;
-    store.simulationOutput.solubilityTrapping.speciesData = [];
   }
 }
 
@@ -139,57 +106,49 @@ export async function runSimulationCO2BrineVarT() {
   }
 }
 
-export async function runSimulationCO2BrineRockSolutionProperties() {
+export async function runSimulationCO2BrinePTMap(temperaturePoints = 50, pressurePoints = 50) {
   try {
     const payload = {
       concentrations: store.simulationInput.concentrations,
-      temperature: store.simulationInput.temperature,
-      pressure: store.simulationInput.pressure,
-      mineralogy: store.simulationInput.minerals
+      model: store.simulationInput.solubilityModel,
+      temperature_points: temperaturePoints,
+      pressure_points: pressurePoints
     };
 
     const response = await axios.post(
-      "http://127.0.0.1:5000/simulate/co2-brine-rock/solution-properties",
+      "http://127.0.0.1:5000/simulate/co2-brine/pt-map",
       payload
     );
 
-    console.log("Full API response for brine-rock solution properties:", response.data);
-
-    // Check if the response has the expected structure
-    if (response.data.status === "success" && response.data.data) {
-      const responseData = response.data.data;
+    // The backend sends one row of values per temperature; the heatmap wants
+    // [temp_index, pressure_index, CO2] triples, without the missing cells
+    const { temperatures, pressures, values } = response.data.data;
+    const gridData: [number, number, number][] = [];
+    values.forEach((row: (number | null)[], tempIndex: number) => {
+      row.forEach((co2, pressureIndex) => {
+        if (co2 !== null) {
+          gridData.push([tempIndex, pressureIndex, co2]);
+        }
+      });
+    });
 
-      // Update mineral trapping solution properties
-      store.simulationOutput.mineralTrapping.density = parseFloat(responseData.density || 0);
-      store.simulationOutput.mineralTrapping.ionic_strength = parseFloat(responseData.ionic_strength || 0);
-      store.simulationOutput.mineralTrapping.pH = parseFloat(responseData.pH || 0);
-      store.simulationOutput.mineralTrapping.activity_of_water = parseFloat(responseData.activity_of_water || 0);
-      store.simulationOutput.mineralTrapping.osmotic_coefficient = parseFloat(responseData.osmotic_coefficient || 0);
-      store.simulationOutput.mineralTrapping.fugacity_co2 = parseFloat(responseData.fugacity_co2 || 0);
-      store.simulationOutput.mineralTrapping.partial_pressure_co2 = parseFloat(responseData.partial_pressure_co2 || 0);
-      store.simulationOutput.mineralTrapping.speciesData = responseData.species_data || [];
-      
-      console.log("Mineral trapping solution properties updated successfully");
-    } else {
-      console.error("API returned error or unexpected structure:", response.data);
-      throw new Error(`API Error: ${response.data.message || "Unknown error"}`);
-    }
+    store.simulationOutput.solubilityTrapping.heatmapData = {
+      grid_data: gridData,
+      temperatures: temperatures,
+      pressures: pressures
+    };
 
   } catch (error) {
-    console.error("Error during brine-rock solution properties simulation:", error);
-    // Reset values on error
-    store.simulationOutput.mineralTrapping.density = 0;
-    store.simulationOutput.mineralTrapping.ionic_strength = 0;
-    store.simulationOutput.mineralTrapping.pH = 0;
-    store.simulationOutput.mineralTrapping.activity_of_water = 0;
-    store.simulationOutput.mineralTrapping.osmotic_coefficient = 0;
-    store.simulationOutput.mineralTrapping.fugacity_co2 = 0;
-    store.simulationOutput.mineralTrapping.partial_pressure_co2 = 0;
-    store.simulationOutput.mineralTrapping.speciesData = [];
+    console.error("Error during pressure-temperature map simulation:", error);
+    store.simulationOutput.solubilityTrapping.heatmapData = {
+      grid_data: [],
+      temperatures: [],
+      pressures: []
+    };
   }
 }
 
-export async function runSimulationCO2BrineRockFixed() {
+export async function runSimulationCO2BrineRockState() {
   try {
     const payload = {
       concentrations: store.simulationInput.concentrations,
@@ -199,30 +158,36 @@ export async function runSimulationCO2BrineRockFixed() {
       model: store.simulationInput.primaryModel
     };
 
+    // Dissolved CO2, mineral deltas and solution properties from one equilibrium run
     const response = await axios.post(
-      "http://127.0.0.1:5000/simulate/co2-brine-rock/fixed",
+      "http://127.0.0.1:5000/simulate/co2-brine-rock/state",
       payload
     );
 
     if (response.data.status === "success" && response.data.data) {
       const data = response.data.data;
-      
+
       // Store a snapshot of the initial minerals from when the simulation was run
       store.simulationOutput.mineralTrapping.initial_minerals = { ...store.simulationInput.minerals };
-      
-      store.simulationOutput.mineralTrapping.trapped_co2 = typeof data.trapped_co2 === 'string' 
-        ? parseFloat(data.trapped_co2) 
-        : Number(data.trapped_co2);
-      
-      // Handle mineral equilibrium data
+
+      store.simulationOutput.mineralTrapping.trapped_co2 = Number(data.trapped_co2);
       store.simulationOutput.mineralTrapping.mineral_equi = data.mineral_equi || {};
 
-      console.log("Brine-rock simulation completed successfully:", store.simulationOutput.mineralTrapping);
+      store.simulationOutput.mineralTrapping.density = parseFloat(data.density || 0);
+      store.simulationOutput.mineralTrapping.ionic_strength = parseFloat(data.ionic_strength || 0);
+      store.simulationOutput.mineralTrapping.pH = parseFloat(data.pH || 0);
+      store.simulationOutput.mineralTrapping.activity_of_water = parseFloat(data.activity_of_water || 0);
+      store.simulationOutput.mineralTrapping.osmotic_coefficient = parseFloat(data.osmotic_coefficient || 0);
+      store.simulationOutput.mineralTrapping.fugacity_co2 = parseFloat(data.fugacity_co2 || 0);
+      store.simulationOutput.mineralTrapping.partial_pressure_co2 = parseFloat(data.partial_pressure_co2 || 0);
+      store.simulationOutput.mineralTrapping.speciesData = data.species_data || [];
+
+      console.log("Brine-rock state simulation completed successfully:", store.simulationOutput.mineralTrapping);
     } else {
-      console.error("No valid data in brine-rock simulation response:", response.data);
+      console.error("No valid data in brine-rock state simulation response:", response.data);
     }
   } catch (error) {
-    console.error("Error during brine-rock simulation:", error);
+    console.error("Error during brine-rock state simulation:", error);
     // On error, reset to default values
     store.simulationOutput.mineralTrapping = {
       trapped_co2: 0,
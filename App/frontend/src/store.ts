@@ -96,7 +96,7 @@ export type { TemperatureUnit, PressureUnit, WaterChemistryUnit, FormationMinera
 export type ConcentrationUnit = WaterChemistryUnit;
 export type MineralogyUnit = FormationMineralogyUnit;
 export type PrimaryModelType = 'phreeqc_phreeqc' | 'phreeqc_pitzer';
-export type SolubilityModelType = 'phreeqc_phreeqc' | 'phreeqc_pitzer' | 'phreeqc_pitzer_mod' | 'duan_sun_2006' | 'carbonex';
+export type SolubilityModelType = 'phreeqc_phreeqc' | 'phreeqc_pitzer' | 'phreeqc_pitzer_mod' | 'phreeqc_phreeqc_table' | 'phreeqc_pitzer_table' | 'phreeqc_pitzer_mod_table' | 'duan_sun_2006' | 'duan_sun_guo' | 'carbonex';
 export type CorrosionModelType = 'deWaald1991' | 'deWaald1995';
 
 // CO2 critical point constants (imported from units module)